@@ -0,0 +1,182 @@
+import argparse
+import sys
+
+from . import (
+    CustomTx,
+    DummyTx,
+    GreengenesTx,
+    GtdbTx,
+    NcbiTx,
+    OttTx,
+    SilvaTx,
+    __version__,
+)
+
+_taxonomies = {
+    "custom": CustomTx,
+    "dummy": DummyTx,
+    "greengenes": GreengenesTx,
+    "gtdb": GtdbTx,
+    "ncbi": NcbiTx,
+    "ott": OttTx,
+    "silva": SilvaTx,
+}
+
+
+def _add_tax_arguments(parser):
+    group = parser.add_argument_group("taxonomy")
+    group.add_argument(
+        "-t", "--tax", required=True, choices=sorted(_taxonomies), help="Taxonomy."
+    )
+    group.add_argument("-f", "--files", nargs="*", help="Local files to parse.")
+    group.add_argument(
+        "-u", "--urls", nargs="*", help="Urls to download and parse (default urls)."
+    )
+    group.add_argument("--root-node", help="Alternative root node.")
+    group.add_argument(
+        "--undefined-node", help="Default return value for undefined nodes."
+    )
+    group.add_argument(
+        "--undefined-name", help="Default return value for undefined names."
+    )
+    group.add_argument(
+        "--undefined-rank", help="Default return value for undefined ranks."
+    )
+    group.add_argument(
+        "--extended-names",
+        action="store_true",
+        help="Parse extended names if available.",
+    )
+
+
+def _annotate(args):
+    tax = _load_tax(args)
+    inf = sys.stdin if args.input == "-" else args.input
+    outf = sys.stdout if args.output == "-" else args.output
+    tax.annotate(
+        inf,
+        outf,
+        column=args.column,
+        cols=args.cols,
+        sep=args.sep,
+        sep_multi=args.sep_multi,
+        ranks=args.ranks,
+        header=args.header,
+        chunk=args.chunk,
+        processes=args.processes,
+    )
+
+
+def _load_tax(args):
+    return _taxonomies[args.tax](
+        files=args.files,
+        urls=args.urls,
+        root_node=args.root_node,
+        undefined_node=args.undefined_node,
+        undefined_name=args.undefined_name,
+        undefined_rank=args.undefined_rank,
+        extended_names=args.extended_names,
+    )
+
+
+def _serve(args):
+    from .server import TaxServer
+
+    tax = _load_tax(args)
+    if args.freeze:
+        tax.freeze(ranks=args.ranks)
+    server = TaxServer(
+        tax, batch_window=args.batch_window / 1000, batch_size=args.batch_size
+    )
+    print(
+        "Serving "
+        + repr(tax)
+        + " on "
+        + (args.socket if args.socket else args.host + ":" + str(args.port)),
+        file=sys.stderr,
+    )
+    server.serve(host=args.host, port=args.port, path=args.socket)
+
+
+def main(argv: list = None):
+    """
+    Command-line interface: multitax <command> [options]
+
+    Commands:
+    * **annotate**: Appends taxonomic fields to a tabular file. See MultiTax.annotate()
+    * **serve**: Serves a loaded taxonomy over HTTP/JSON. See multitax.server.TaxServer
+    """
+    parser = argparse.ArgumentParser(
+        prog="multitax",
+        description="Obtain, parse and explore biological and custom taxonomies.",
+    )
+    parser.add_argument("-v", "--version", action="version", version=__version__)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    annotate = subparsers.add_parser(
+        "annotate", help="Append taxonomic fields to a tabular file."
+    )
+    _add_tax_arguments(annotate)
+    annotate.add_argument(
+        "-i", "--input", default="-", help="Input file (.gz supported). Default: stdin"
+    )
+    annotate.add_argument(
+        "-o", "--output", default="-", help="Output file. Default: stdout"
+    )
+    annotate.add_argument(
+        "-c", "--column", type=int, default=1, help="Column with nodes (1-based)."
+    )
+    annotate.add_argument(
+        "--cols",
+        nargs="*",
+        default=["name_lineage"],
+        help="Fields to append: node, latest, parent, rank, name, leaves, children, lineage, rank_lineage, name_lineage",
+    )
+    annotate.add_argument("--ranks", nargs="*", help="Ranks to report on lineages.")
+    annotate.add_argument("--sep", default="\t", help="Separator of fields.")
+    annotate.add_argument(
+        "--sep-multi", default="|", help="Separator of multi-valued fields."
+    )
+    annotate.add_argument(
+        "--header", action="store_true", help="Input has a header line."
+    )
+    annotate.add_argument(
+        "--chunk", type=int, default=100000, help="Lines processed at once."
+    )
+    annotate.add_argument(
+        "-p", "--processes", type=int, default=1, help="Number of processes."
+    )
+    annotate.set_defaults(function=_annotate)
+
+    serve = subparsers.add_parser(
+        "serve", help="Serve a loaded taxonomy over HTTP/JSON."
+    )
+    _add_tax_arguments(serve)
+    serve.add_argument("--host", default="127.0.0.1", help="Host to listen on.")
+    serve.add_argument("--port", type=int, default=8080, help="Port to listen on.")
+    serve.add_argument("--socket", help="Listen on a Unix socket instead of host:port.")
+    serve.add_argument(
+        "--batch-window",
+        type=float,
+        default=1,
+        help="Time in milliseconds to collect concurrent queries into a batch.",
+    )
+    serve.add_argument(
+        "--batch-size", type=int, default=4096, help="Maximum queries in a batch."
+    )
+    serve.add_argument(
+        "--freeze",
+        action="store_true",
+        help="Pre-build all aux. structures and freeze the taxonomy before serving.",
+    )
+    serve.add_argument(
+        "--ranks", nargs="*", help="Ranks of the rank table built with --freeze."
+    )
+    serve.set_defaults(function=_serve)
+
+    args = parser.parse_args(argv)
+    args.function(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -7,7 +7,11 @@ class CustomTx(MultiTax):
     _possible_cols = ["node", "parent", "rank", "name"]
 
     def __init__(
-        self, cols: list = ["node", "parent", "rank", "name"], sep: str = "\t", **kwargs
+        self,
+        cols: list = ["node", "parent", "rank", "name"],
+        sep: str = "\t",
+        validate: bool = True,
+        **kwargs,
     ):
         """
         CustomTx()
@@ -15,6 +19,7 @@ class CustomTx(MultiTax):
         Parameters:
         * **cols** *[list, dict]*: List of fields to be parsed or a dictionary with {field: column index}. Options: "node", "parent", "rank", "name"
         * **sep** *[str]*: Separator of fields
+        * **validate** *[bool]*: Validate the tree after parsing (see `multitax.multitax.MultiTax.validate`). Raises ValueError for nodes not linked to the root (e.g. cycles) and warns for nodes defined with different parents (last entry is kept).
         * **\*\*kwargs** defined at `multitax.multitax.MultiTax`
 
         Example:
@@ -27,6 +32,16 @@ class CustomTx(MultiTax):
         self._sep = sep
         super().__init__(**kwargs)
 
+        if validate:
+            report = self.validate()
+            if report["duplicates"]:
+                warnings.warn(
+                    "Nodes defined with different parents (last entry kept): "
+                    + ",".join(report["duplicates"])
+                )
+            if report["unreachable"]:
+                self.validate(report=False)
+
     def __repr__(self):
         stats = ["{}={}".format(k, repr(v)) for (k, v) in self.stats().items()]
         return "CustomTx({})".format(", ".join(stats))
@@ -53,7 +68,11 @@ class CustomTx(MultiTax):
                     fields = line.decode().rstrip().split(self._sep)
 
                 node = fields[self._cols["node"]]
-                nodes[node] = fields[self._cols["parent"]]
+                parent = fields[self._cols["parent"]]
+                # Node defined again with another parent
+                if node in nodes and nodes[node] != parent:
+                    self._duplicated_nodes.append(node)
+                nodes[node] = parent
                 if "name" in self._cols:
                     names[node] = fields[self._cols["name"]]
                 if "rank" in self._cols:
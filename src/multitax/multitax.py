@@ -1,6 +1,16 @@
 from multitax.utils import (
     join_check,
     check_no_file,
+    IntervalMask,
+    Lineage,
+    MaskedMapping,
+    NgramIndex,
+    FuzzyIndex,
+    PrefixIndex,
+    SharedBlock,
+    SharedMapping,
+    SharedStrings,
+    SqliteMapping,
     filter_function,
     reverse_dict,
     check_file,
@@ -9,15 +19,72 @@ from multitax.utils import (
     open_files,
     check_dir,
 )
-from collections import Counter
+from array import array
+from collections import Counter, deque
+from multiprocessing import shared_memory
+import json
 from . import __version__
 
 
+# Taxonomy shared with pool processes (set by initializer)
+_pool_tax = None
+
+
+def _set_pool_tax(tax):
+    global _pool_tax
+    _pool_tax = tax
+
+
+def _consensus_chunk(args):
+    sets, method, threshold = args
+    return [_pool_tax._consensus(s, method, threshold) for s in sets]
+
+
+# Parameters of annotate() on pool processes (set by initializer)
+_pool_annotate = None
+
+
+def _set_pool_annotate(tax, column, cols, sep, sep_multi, ranks):
+    global _pool_tax, _pool_annotate
+    _pool_tax = tax
+    # Formatted fields are memoized across chunks on each process
+    _pool_annotate = (
+        column,
+        sep,
+        tax._field_formatter(cols, sep, sep_multi, ranks),
+        {},
+    )
+
+
+def _annotate_chunk(chunk):
+    # chunk is either a text block or a byte range (file, start, end)
+    if isinstance(chunk, tuple):
+        file, start, end = chunk
+        with open(file, "rb") as f:
+            f.seek(start)
+            chunk = f.read(end - start).decode()
+    lines = chunk.split("\n")
+    if not lines[-1]:
+        lines.pop()
+    return _pool_tax._annotate_lines(lines, *_pool_annotate), len(lines)
+
+
 class MultiTax(object):
     version = __version__
 
     _default_urls = []
     _default_root_node = "1"
+    # Attributes kept on exports (to_arrow, to_shared_memory, to_sqlite)
+    _settings_attrs = [
+        "root_node",
+        "root_parent",
+        "root_name",
+        "root_rank",
+        "undefined_node",
+        "undefined_name",
+        "undefined_rank",
+        "sources",
+    ]
 
     def __init__(
         self,
@@ -66,8 +133,7 @@ class MultiTax(object):
         if files:
             if isinstance(files, str):
                 files = [files]
-            for file in files:
-                check_file(file)
+            self._check_files(files)
 
         if output_prefix:
             check_dir(output_prefix)
@@ -78,13 +144,26 @@ class MultiTax(object):
         self._names = {}
         # Aux. structures
         self._lineages = {}
+        self._lineages_ranks = {}
         self._name_nodes = {}
+        self._name_fuzzy = None
+        self._name_ngrams = None
+        self._name_prefixes = {}
         self._node_children = {}
+        self._node_intervals = {}
         self._rank_nodes = {}
+        self._rank_table = {}
+        self._subtree_counts = {}
         self._translated_nodes = {}
 
         # Store source of tax files (url or file)
         self.sources = []
+        # Nodes defined more than once on parsed files (if tracked by the parser)
+        self._duplicated_nodes = []
+        # Read-only taxonomies (views) raise an error on functions changing the tree
+        self._mutable = True
+        # Frozen taxonomies also raise an error on functions changing aux. structures
+        self._frozen = False
 
         # Open/Download/Write files
         fhs = {}
@@ -129,6 +208,300 @@ class MultiTax(object):
 
         self.check_consistency()
 
+    def __getstate__(self):
+        """
+        Compact state for pickling: main structures in columnar form (see _columns).
+        Aux. structures are not serialized and are built again on first use (translations are kept).
+        Frozen taxonomies are frozen again when unpickled.
+        """
+        state = dict(self.__dict__)
+        state.pop("_shm", None)
+        state.pop("_sqlite", None)
+        state["_nodes"] = state["_ranks"] = state["_names"] = None
+        state["_columns"] = self._columns()
+
+        # Empty aux. structures, as in _reset_aux_data
+        empty = MultiTax.__new__(MultiTax)
+        empty._reset_aux_data()
+        for attr, value in empty.__dict__.items():
+            if attr != "_translated_nodes":
+                state[attr] = value
+        if "_extended_name_ngrams" in state:
+            state["_extended_name_ngrams"] = None
+        # Sub-class data queried from a database (attach_sqlite) is copied
+        for attr, value in state.items():
+            if isinstance(value, SqliteMapping):
+                state[attr] = dict(value)
+
+        if self._frozen:
+            state["_mutable"] = True
+            state["_frozen"] = False
+            state["_freeze"] = {
+                "ranks": list(self._rank_table),
+                "search": self._name_fuzzy is not None,
+            }
+        return state
+
+    def __setstate__(self, state):
+        columns = state.pop("_columns")
+        freeze = state.pop("_freeze", None)
+        self.__dict__.update(state)
+
+        nodes = columns["nodes"]
+        outside = columns["outside"]
+        self._nodes = dict(
+            zip(
+                nodes,
+                [
+                    nodes[p] if p >= 0 else outside[i]
+                    for i, p in enumerate(columns["parents"])
+                ],
+            )
+        )
+        for col, attr in [("name", "_names"), ("rank", "_ranks")]:
+            strings = columns[col + "s"]
+            idx = columns[col + "_idx"]
+            if -1 in idx or -2 in idx:
+                values = {
+                    nodes[i]: strings[v] if v >= 0 else None
+                    for i, v in enumerate(idx)
+                    if v != -1
+                }
+            else:
+                values = dict(zip(nodes, [strings[v] for v in idx]))
+            setattr(self, attr, values)
+
+        if freeze:
+            self.freeze(**freeze)
+
+    def _add_aux(self, node: str):
+        """
+        Inserts a new node into built aux. data structures (incremental update)
+        """
+        parent = self._nodes[node]
+        name = self._names[node]
+        rank = self._ranks[node]
+
+        if self._node_children:
+            if parent not in self._node_children:
+                self._node_children[parent] = []
+            self._node_children[parent].append(node)
+
+        if self._name_nodes:
+            if name not in self._name_nodes:
+                self._name_nodes[name] = []
+                if self._name_ngrams is not None:
+                    self._name_ngrams.add(name)
+                if self._name_fuzzy is not None:
+                    self._name_fuzzy.add(name)
+            self._name_nodes[name].append(node)
+        for prefixes in self._name_prefixes.values():
+            prefixes.add(name, node)
+
+        if self._rank_nodes:
+            if rank not in self._rank_nodes:
+                self._rank_nodes[rank] = []
+            self._rank_nodes[rank].append(node)
+
+        if self._lineages or self._rank_table:
+            # Setup on first use
+            if not self._node_children:
+                self._node_children = reverse_dict(self._nodes)
+            # New node extends the lineage/projected ranks of its parent, as well as
+            # nodes still linked to it (e.g. removed and added again), top-down
+            for n, _ in self._iter_preorder(node):
+                p = self._nodes[n]
+                if p in self._lineages:
+                    self._lineages[n] = self._child_lineage(n, self._lineages[p])
+                for r, table in self._rank_table.items():
+                    if p in table:
+                        anc = table[p]
+                        if anc == self.undefined_node and self._ranks[n] == r:
+                            anc = n
+                        table[n] = anc
+
+        # Pre-order positions and clade counts of ancestors change
+        self._node_intervals = {}
+        self._subtree_counts = {}
+
+    def _annotate_lines(
+        self, lines: list, column: int, sep: str, formatter, memo: dict
+    ):
+        """
+        Returns the lines annotated with the formatted fields of the nodes in column (1-based), as one string.
+        """
+        idx = column - 1
+        out = []
+        for line in lines:
+            line = line.rstrip("\r\n")
+            fields = line.split(sep, column)
+            node = fields[idx] if len(fields) > idx else ""
+            try:
+                ann = memo[node]
+            except KeyError:
+                ann = memo[node] = formatter(node)
+            out.append(line + sep + ann + "\n")
+        return "".join(out)
+
+    def _build_node_intervals(self):
+        """
+        Builds node,(pre-order position, last pre-order position of subtree, depth) dict.
+        A node is an ancestor of another if the position of the other is within its interval.
+        """
+        self._node_intervals = {}
+        # Nodes with open intervals (subtree not finished)
+        stack = []
+        pos = -1
+        for pos, (node, depth) in enumerate(self._iter_preorder(self.root_node)):
+            while stack and stack[-1][2] >= depth:
+                n, pre, d = stack.pop()
+                self._node_intervals[n] = (pre, pos - 1, d)
+            stack.append((node, pos, depth))
+        for n, pre, d in stack:
+            self._node_intervals[n] = (pre, pos, d)
+
+    def _check_files(self, files: list):
+        """
+        Raises an error if input files do not exist or are empty
+        """
+        for file in files:
+            check_file(file)
+
+    def _check_mutable(self, aux: bool = False):
+        """
+        Raises an error if the taxonomy is read-only (or frozen, for changes on aux. structures)
+        """
+        if not self._mutable and not aux:
+            raise ValueError("Read-only taxonomy (view or frozen) cannot be modified.")
+        if self._frozen:
+            raise ValueError("Frozen taxonomy: aux. structures cannot be changed.")
+
+    def _child_lineage(self, node: str, lin):
+        """
+        Returns lineage of a node given the lineage of its parent (as in build_lineages)
+        """
+        if not lin:
+            # Invalid lineage
+            return lin
+        if self._lineages_ranks:
+            pos = self._lineages_ranks.get(self.rank(node))
+            # Keep top-most node of a rank, as in lineage()
+            if pos is not None and lin[pos] == self.undefined_node:
+                lin = lin.copy()
+                lin[pos] = node
+            return lin
+        else:
+            return Lineage(node, lin)
+
+    def _columns(self):
+        """
+        Returns main structures in columnar form (dict): nodes (list), parents (array of node indices, -1 for parents outside the tree, stored in outside dict),
+        unique names and ranks (lists) and their indices for each node (arrays, -1 for not defined, -2 for None)
+        """
+        nodes = list(self._nodes)
+        ids = dict(zip(nodes, range(len(nodes))))
+        parents = array("i", [ids.get(p, -1) for p in self._nodes.values()])
+        columns = {
+            "nodes": nodes,
+            "parents": parents,
+            "outside": {
+                i: self._nodes[nodes[i]] for i, p in enumerate(parents) if p == -1
+            },
+        }
+
+        for col, values in [("name", self._names), ("rank", self._ranks)]:
+            strings = {}
+            idx = array(
+                "i",
+                [
+                    -1 if v is None else strings.setdefault(v, len(strings))
+                    for v in map(values.get, nodes)
+                ],
+            )
+            # Distinguish None values from not defined
+            if len(values) > len(idx) - idx.count(-1):
+                for i, node in enumerate(nodes):
+                    if idx[i] == -1 and node in values:
+                        idx[i] = -2
+            columns[col + "_idx"] = idx
+            columns[col + "s"] = list(strings)
+
+        return columns
+
+    def _consensus(self, nodes, method: str, threshold: float):
+        """
+        Returns consensus node of a set of nodes (or dict {node: weight}), using node intervals
+        """
+        if isinstance(nodes, dict):
+            weights = {n: w for n, w in nodes.items() if n in self._node_intervals}
+        else:
+            weights = {}
+            for n in nodes:
+                if n in self._node_intervals:
+                    weights[n] = weights.get(n, 0) + 1
+        if not weights:
+            return self.undefined_node
+
+        # LCA of the set is the lowest ancestor of the shallowest node
+        # containing the first and last nodes of the set in pre-order
+        top = None
+        for n in weights:
+            pre, _, depth = self._node_intervals[n]
+            if top is None:
+                top, top_depth, first, last = n, depth, pre, pre
+            else:
+                if depth < top_depth:
+                    top, top_depth = n, depth
+                if pre < first:
+                    first = pre
+                elif pre > last:
+                    last = pre
+        lca = self._lca(top, first, last)
+        if method == "lca":
+            return lca
+
+        # Accumulate weights on ancestors up to the LCA
+        acc = {}
+        for node, w in weights.items():
+            n = node
+            while True:
+                acc[n] = acc.get(n, 0) + w
+                if n == lca:
+                    break
+                n = self._nodes[n]
+
+        # Deepest node with more than threshold of the weight (LCA has all)
+        # Ties: higher weight, then pre-order
+        min_weight = threshold * acc[lca]
+        return max(
+            (n for n, w in acc.items() if w > min_weight or n == lca),
+            key=lambda n: (
+                self._node_intervals[n][2],
+                acc[n],
+                -self._node_intervals[n][0],
+            ),
+        )
+
+    @classmethod
+    def _empty_from_settings(cls, settings: dict):
+        """
+        Returns an empty taxonomy (no files parsed or downloaded) with exported settings (see _settings()).
+        If called from the main class, the taxonomy is of the exported class.
+        """
+        # Class of exported taxonomy, if called from the main class
+        if cls is MultiTax:
+            for sub in MultiTax.__subclasses__():
+                if sub.__name__ == settings.get("class"):
+                    cls = sub
+
+        tax = cls.__new__(cls)
+        tax._default_urls = []
+        tax.__init__()
+        for attr in cls._settings_attrs:
+            if attr in settings:
+                setattr(tax, attr, settings[attr])
+        return tax
+
     def _exact_name(self, text: str, names: dict):
         """
         Returns list of nodes of a given exact name (case sensitive).
@@ -138,6 +511,161 @@ class MultiTax(object):
         else:
             return []
 
+    def _field_formatter(
+        self, cols: list, sep: str = "\t", sep_multi: str = "|", ranks: list = None
+    ):
+        """
+        Returns a function formatting the fields (cols) of a node as one line (without line break), as in write().
+        The lineage is calculated once for all lineage fields.
+        """
+        names, undefined_name = self._names, self.undefined_name
+        ranks_, undefined_rank = self._ranks, self.undefined_rank
+        fields = {
+            "node": lambda node, lin: node,
+            "latest": lambda node, lin: str(self.latest(node)),
+            "parent": lambda node, lin: str(self.parent(node)),
+            "rank": lambda node, lin: str(ranks_.get(node, undefined_rank)),
+            "name": lambda node, lin: str(names.get(node, undefined_name)),
+            "leaves": lambda node, lin: join_check(self.leaves(node), sep_multi),
+            "children": lambda node, lin: join_check(self.children(node), sep_multi),
+            "lineage": lambda node, lin: join_check(lin, sep_multi),
+            "rank_lineage": lambda node, lin: join_check(
+                [ranks_.get(n, undefined_rank) for n in lin], sep_multi
+            ),
+            "name_lineage": lambda node, lin: join_check(
+                [names.get(n, undefined_name) for n in lin], sep_multi
+            ),
+        }
+        for c in cols:
+            if c not in fields:
+                raise ValueError(
+                    "Field [" + c + "] is not valid. Options: " + ",".join(fields)
+                )
+
+        functions = [fields[c] for c in cols]
+        with_lineage = bool(
+            {"lineage", "rank_lineage", "name_lineage"}.intersection(cols)
+        )
+
+        def formatter(node):
+            if with_lineage:
+                lin = self.lineage(node, ranks=ranks)
+            else:
+                lin = None
+            return sep.join([f(node, lin) for f in functions])
+
+        return formatter
+
+    def _has_rank_table(self, ranks: list):
+        """
+        Checks if all ranks were projected with build_rank_table()
+        """
+        for r in ranks:
+            if r not in self._rank_table:
+                return False
+        return True
+
+    def _index_lineages(self, columns: dict, ranks: list = None):
+        """
+        Returns the lineage of each node on columns (see _columns()) as a sequence of node indices, in the same order as nodes.
+        Lineages are extended top-down from the lineage of the parent, sharing its prefix (Lineage) or its list when not changed (ranks).
+        With ranks, lineages have fixed length (-1 for ranks not on the lineage). Nodes not linked to the root have empty lineages.
+        """
+        nodes, parents = columns["nodes"], columns["parents"]
+        try:
+            root = nodes.index(self.root_node)
+        except ValueError:
+            return [[] for _ in nodes]
+
+        if ranks:
+            # Position of each rank (index on columns["ranks"]) on the lineage (first occurrence)
+            rank_ids = {r: i for i, r in enumerate(columns["ranks"])}
+            rank_pos = {}
+            for i, r in reversed(list(enumerate(ranks))):
+                if r in rank_ids:
+                    rank_pos[rank_ids[r]] = i
+            rank_idx = columns["rank_idx"]
+
+            def extend(lin, k):
+                pos = rank_pos.get(rank_idx[k])
+                # Keep the top-most node of a rank (same as lineage())
+                if pos is not None and lin[pos] == -1:
+                    lin = lin.copy()
+                    lin[pos] = k
+                return lin
+
+            base = [-1] * len(ranks)
+        else:
+
+            def extend(lin, k):
+                # Shares the prefix (lineage of the parent), see Lineage
+                return Lineage(k, lin)
+
+            base = Lineage()
+
+        invalid = []
+        lins = [None] * len(nodes)
+        lins[root] = extend(base, root)
+        for i in range(len(nodes)):
+            path = []
+            j = i
+            while j >= 0 and lins[j] is None:
+                # Mark as visited (guards against cycles)
+                lins[j] = invalid
+                path.append(j)
+                j = parents[j]
+            lin = lins[j] if j >= 0 else invalid
+            for k in reversed(path):
+                lin = extend(lin, k) if lin else invalid
+                lins[k] = lin
+        return lins
+
+    def _iter_preorder(self, node: str, max_depth: int = None, post: bool = False):
+        """
+        Generator of (node, depth) in pre-order (or post-order) with a stack of children iterators
+        """
+        if not post:
+            yield node, 0
+        stack = [(node, iter(self.children(node)))]
+        while stack:
+            child = (
+                next(stack[-1][1], None)
+                if max_depth is None or len(stack) <= max_depth
+                else None
+            )
+            if child is None:
+                n, _ = stack.pop()
+                if post:
+                    yield n, len(stack)
+            else:
+                if not post:
+                    yield child, len(stack)
+                stack.append((child, iter(self.children(child))))
+
+    def _lca(self, node: str, first: int, last: int):
+        """
+        Returns lowest ancestor of node (itself included) containing the pre-order interval [first, last]
+        """
+        n = node
+        while True:
+            pre, end, _ = self._node_intervals[n]
+            if pre <= first and last <= end:
+                return n
+            n = self._nodes[n]
+
+    def _leaf_counts(self, node: str):
+        """
+        Returns subtree counts of a leaf node [nodes, leaves, ranked_nodes, ranked_leaves]
+        """
+        ranked_nodes = Counter([self._ranks[node]] if node in self._ranks else [])
+        return [1, 1, ranked_nodes, Counter([self.rank(node)])]
+
+    def _merged_nodes(self):
+        """
+        Returns dict {node: latest node} of nodes merged or forwarded into other nodes (e.g. merged.dmp on NcbiTx)
+        """
+        return {}
+
     def _parse(self, fhs: dict):
         """
         main function to be overloaded
@@ -146,14 +674,15 @@ class MultiTax(object):
         """
         return {}, {}, {}
 
-    def _partial_name(self, text: str, names: dict):
+    def _partial_name(self, text: str, names: dict, ngrams: NgramIndex = None):
         """
         Searches names containing a certain text (case sensitive) and return their respective nodes.
+        If a n-gram index of the names is provided, only verify its candidates.
         """
         matching_nodes = set()
-        for name in names:
-            if text in name:
-                matching_nodes.update(names[name])
+        for name in ngrams.search(text) if ngrams else names:
+            if name is not None and text in name:
+                matching_nodes.update(names.get(name, []))
         return list(matching_nodes)
 
     def _recurse_leaves(self, node: str):
@@ -178,16 +707,80 @@ class MultiTax(object):
         if node in self._ranks:
             del self._ranks[node]
 
+    def _remove_aux(self, node: str):
+        """
+        Removes a node from built aux. data structures (incremental update), before removing it from the taxonomy
+        """
+        parent = self._nodes[node]
+
+        # Descendants are not linked to the root anymore: invalid lineages
+        if self._lineages or self._rank_table:
+            for n, _ in self._iter_preorder(node):
+                if n in self._lineages:
+                    self._lineages[n] = Lineage()
+                for table in self._rank_table.values():
+                    table.pop(n, None)
+            self._lineages.pop(node, None)
+
+        if parent in self._node_children:
+            self._node_children[parent].remove(node)
+            if not self._node_children[parent]:
+                del self._node_children[parent]
+
+        if node in self._names:
+            name = self._names[node]
+            if node in self._name_nodes.get(name, []):
+                self._name_nodes[name].remove(node)
+                # Name kept on n-gram indices, without nodes
+                if not self._name_nodes[name]:
+                    del self._name_nodes[name]
+            for prefixes in self._name_prefixes.values():
+                prefixes.remove(name, node)
+
+        if node in self._ranks:
+            rank = self._ranks[node]
+            if node in self._rank_nodes.get(rank, []):
+                self._rank_nodes[rank].remove(node)
+                if not self._rank_nodes[rank]:
+                    del self._rank_nodes[rank]
+
+        self._translated_nodes.pop(node, None)
+
+        # Pre-order positions and clade counts of ancestors change
+        self._node_intervals = {}
+        self._subtree_counts = {}
+
     def _reset_aux_data(self):
         """
         Reset aux. data structures
         """
         self._lineages = {}
+        self._lineages_ranks = {}
         self._name_nodes = {}
+        self._name_fuzzy = None
+        self._name_ngrams = None
+        self._name_prefixes = {}
         self._node_children = {}
+        self._node_intervals = {}
         self._rank_nodes = {}
+        self._rank_table = {}
+        self._subtree_counts = {}
         self._translated_nodes = {}
 
+    def _search_names(self):
+        """
+        Returns list of name,nodes dicts to be indexed for prefix and fuzzy search.
+        """
+        if not self._name_nodes:
+            self._name_nodes = reverse_dict(self._names)
+        return [self._name_nodes]
+
+    def _set_merged_nodes(self, merged):
+        """
+        Sets dict {node: latest node} of nodes merged or forwarded into other nodes (see _merged_nodes), if supported
+        """
+        pass
+
     def _set_root_node(self, root: str, parent: str, name: str, rank: str):
         """
         Set root node of the tree.
@@ -235,11 +828,22 @@ class MultiTax(object):
         # Set static rank
         self.root_rank = self._ranks[self.root_node]
 
+    def _settings(self):
+        """
+        Returns dict with class name and settings (root, undefined values and sources) to be exported.
+        """
+        settings = {"class": type(self).__name__}
+        for attr in self._settings_attrs:
+            settings[attr] = getattr(self, attr)
+        return settings
+
     def add(self, node: str, parent: str, name: str = None, rank: str = None):
         """
         Add node to taxonomy.
-        Deletes built lineages and translations.
+        Built lineages, children, name and rank indices and rank tables are updated with the new node.
+        Deletes built translations.
         """
+        self._check_mutable()
         if parent not in self._nodes:
             raise ValueError("Parent node [" + parent + "] not found.")
         elif node in self._nodes:
@@ -248,21 +852,600 @@ class MultiTax(object):
         self._nodes[node] = parent
         self._names[node] = name if name is not None else self.undefined_name
         self._ranks[node] = rank if rank is not None else self.undefined_rank
-        self._reset_aux_data()
+        self._add_aux(node)
+        self._translated_nodes = {}
+
+    def add_many(self, records):
+        """
+        Add several nodes to taxonomy at once.
+        Records can be in any order (children before parents) and parents can be existing nodes or other records.
+        All records are validated before changing the taxonomy (new nodes, missing parents and cycles).
+        Built aux. structures are updated top-down in a single pass (sorted prefix indices are rebuilt on next use).
+        Deletes built translations.
+
+        Parameters:
+        * **records** *[iterable]*: Tuples of (node, parent), (node, parent, name) or (node, parent, name, rank).
+
+        Example:
+
+            from multitax import GtdbTx
+            tax = GtdbTx()
+            tax.add_many([("MAG_1", "g__Escherichia_spp"), ("g__Escherichia_spp", "f__Enterobacteriaceae", "g__Escherichia_spp", "genus")])
+            tax.lineage("MAG_1")
+            # ['1', 'd__Bacteria', 'p__Pseudomonadota', 'c__Gammaproteobacteria', 'o__Enterobacterales', 'f__Enterobacteriaceae', 'g__Escherichia_spp', 'MAG_1']
+
+        Returns: None
+        """
+        self._check_mutable()
+        new_nodes = {}
+        new_names = {}
+        new_ranks = {}
+        for record in records:
+            node, parent = record[0], record[1]
+            if node in self._nodes or node in new_nodes:
+                raise ValueError("Node [" + node + "] already present.")
+            new_nodes[node] = parent
+            name = record[2] if len(record) > 2 else None
+            rank = record[3] if len(record) > 3 else None
+            new_names[node] = name if name is not None else self.undefined_name
+            new_ranks[node] = rank if rank is not None else self.undefined_rank
+
+        # Order of insertion (parents first): top-down from parents already on the tree
+        new_children = reverse_dict(new_nodes)
+        order = []
+        for parent, children in new_children.items():
+            if parent not in new_nodes:
+                if parent not in self._nodes:
+                    raise ValueError("Parent node [" + parent + "] not found.")
+                order.extend(children)
+        i = 0
+        while i < len(order):
+            order.extend(new_children.get(order[i], []))
+            i += 1
+        # Nodes not reached from the tree are in (or below) a cycle
+        if len(order) < len(new_nodes):
+            cycle = set(new_nodes).difference(order)
+            raise ValueError("Cycle found on nodes: " + ",".join(sorted(cycle)))
+
+        # Children of existing nodes are needed to update lineages, before adding new nodes
+        if (self._lineages or self._rank_table) and not self._node_children:
+            self._node_children = reverse_dict(self._nodes)
+
+        self._nodes.update(new_nodes)
+        self._names.update(new_names)
+        self._ranks.update(new_ranks)
+
+        self._name_prefixes = {}
+        if (
+            self._node_children
+            or self._name_nodes
+            or self._rank_nodes
+            or self._lineages
+            or self._rank_table
+        ):
+            for node in order:
+                self._add_aux(node)
+            self._translated_nodes = {}
+        else:
+            self._reset_aux_data()
+
+    def annotate(
+        self,
+        input_file,
+        output_file=None,
+        column: int = 1,
+        cols: list = ["name_lineage"],
+        sep: str = "\t",
+        sep_multi: str = "|",
+        ranks: list = None,
+        header: bool = False,
+        chunk: int = 100000,
+        processes: int = 1,
+        chunk_bytes: int = 16777216,
+    ):
+        """
+        Annotates a tabular file (e.g. output of a classifier) with fields of the nodes in one of its columns.
+        The fields are appended to the end of each line. Lines are processed in chunks and the fields of repeated nodes are formatted only once.
+        With processes > 1, chunks are annotated in a process pool and written in the original order.
+        Plain files are split into byte ranges read by each process, other inputs (gzipped files, file objects) are read and distributed by the main process.
+
+        Parameters:
+        * **input_file** *[str, file]*: Input file (gzipped if ending with .gz) or file object (e.g. sys.stdin).
+        * **output_file** *[str, file]*: Output file or file object. Default: sys.stdout
+        * **column** *[int]*: Column with the nodes (1-based).
+        * **cols** *[list]*: Fields to append. Options: same as write()
+        * **sep** *[str]*: Separator of fields
+        * **sep_multi** *[str]*: Separator of multi-valued fields
+        * **ranks** *[list]*: Ranks to report on lineage fields
+        * **header** *[bool]*: First line is a header. The names of the fields (cols) are appended to it.
+        * **chunk** *[int]*: Number of lines processed at once (processes=1).
+        * **processes** *[int]*: Number of processes. The taxonomy is shared with the processes on start (copy-on-write on fork).
+        * **chunk_bytes** *[int]*: Approximate size in bytes of the chunks sent to each process (processes > 1).
+
+        Example:
+
+            from multitax import NcbiTx
+            tax = NcbiTx()
+            # read_id, taxid
+            tax.annotate("classified.tsv", "annotated.tsv", column=2, cols=["rank", "name_lineage"], processes=32)
+            # read1   562     species 1|cellular organisms|Bacteria|...|Escherichia|Escherichia coli
+
+        Returns: number of annotated lines
+        """
+        import gzip
+        import os
+        import sys
+        from itertools import islice
+
+        if column < 1:
+            raise ValueError("Column [" + str(column) + "] is not valid (1-based).")
+        formatter = self._field_formatter(cols, sep, sep_multi, ranks)
+
+        byte_ranges = (
+            processes > 1
+            and isinstance(input_file, str)
+            and not input_file.endswith(".gz")
+        )
+        # Text is decoded as utf-8 and split only on "\n" (as byte ranges), "\r" is stripped from line ends
+        inf = outf = None
+        count = 0
+        try:
+            if byte_ranges:
+                inf = open(input_file, "rb")
+            elif isinstance(input_file, str):
+                if input_file.endswith(".gz"):
+                    inf = gzip.open(input_file, "rt", encoding="utf-8", newline="\n")
+                else:
+                    inf = open(input_file, "r", encoding="utf-8", newline="\n")
+            else:
+                inf = input_file
+
+            if output_file is None:
+                outf = sys.stdout
+            elif isinstance(output_file, str):
+                check_no_file(output_file)
+                outf = open(output_file, "w", encoding="utf-8")
+            else:
+                outf = output_file
+
+            if header:
+                line = inf.readline()
+                if byte_ranges:
+                    line = line.decode()
+                if line:
+                    outf.write(line.rstrip("\r\n") + sep + sep.join(cols) + "\n")
+
+            if processes > 1:
+                import multiprocessing
+
+                def chunks():
+                    if byte_ranges:
+                        size = os.path.getsize(input_file)
+                        start = inf.tell()
+                        while start < size:
+                            # Extend range to the end of the line
+                            inf.seek(start + chunk_bytes)
+                            inf.readline()
+                            end = min(inf.tell(), size)
+                            yield (input_file, start, end)
+                            start = end
+                    else:
+                        while True:
+                            lines = inf.readlines(chunk_bytes)
+                            if not lines:
+                                break
+                            yield "".join(lines)
+
+                with multiprocessing.Pool(
+                    processes,
+                    initializer=_set_pool_annotate,
+                    initargs=(self, column, cols, sep, sep_multi, ranks),
+                ) as pool:
+                    # Write in order, keeping a limited number of chunks in memory
+                    pending = deque()
+                    for c in chunks():
+                        pending.append(pool.apply_async(_annotate_chunk, (c,)))
+                        if len(pending) >= 2 * processes:
+                            out, n = pending.popleft().get()
+                            outf.write(out)
+                            count += n
+                    while pending:
+                        out, n = pending.popleft().get()
+                        outf.write(out)
+                        count += n
+            else:
+                memo = {}
+                while True:
+                    lines = list(islice(inf, chunk))
+                    if not lines:
+                        break
+                    outf.write(
+                        self._annotate_lines(lines, column, sep, formatter, memo)
+                    )
+                    count += len(lines)
+        finally:
+            if inf is not None and inf is not input_file:
+                inf.close()
+            if outf is not None:
+                if isinstance(output_file, str):
+                    outf.close()
+                else:
+                    outf.flush()
+
+        return count
+
+    @classmethod
+    def attach_shared(cls, name: str):
+        """
+        Attaches to a taxonomy exported with to_shared_memory(), without copying it (e.g. on worker processes).
+        Tree, names, ranks, children and pre-order intervals (if exported) are read from the shared memory block.
+        The taxonomy is read-only and other aux. structures are built on first use on each process.
+        Data specific to sub-classes (e.g. merged nodes of NcbiTx) is not shared.
+        The block is not unlinked when an attached process exits, only by its creator.
+
+        Parameters:
+        * **name** *[str]*: Name of the shared memory block.
+
+        Example:
+
+            from multitax.multitax import MultiTax
+            tax = MultiTax.attach_shared("psm_21da8f7c")
+            tax.lineage("562")
+            # ['1', '131567', '2', '1224', '1236', '91347', '543', '561', '562']
+
+        Returns: read-only taxonomy of the exported class (or the calling class)
+        """
+        import os
+
+        try:
+            # Python >= 3.13: block is unlinked only by its creator
+            shm = shared_memory.SharedMemory(name=name, track=False)
+            tracked = False
+        except TypeError:
+            shm = shared_memory.SharedMemory(name=name)
+            tracked = True
+
+        block = SharedBlock(shm)
+        header_len = int.from_bytes(shm.buf[:8], "little")
+        meta = json.loads(bytes(shm.buf[8 : 8 + header_len]))
+
+        # Python < 3.13: attaching registers the block to be unlinked when this process exits.
+        # The creator and its worker processes share one resource tracker (with the creator registration)
+        if tracked:
+            import multiprocessing
+            from multiprocessing import resource_tracker
+
+            parent = multiprocessing.parent_process()
+            creators = [os.getpid(), parent.pid if parent else None]
+            if meta.get("pid") not in creators:
+                resource_tracker.unregister(shm._name, "shared_memory")
+
+        start = (8 + header_len + 7) // 8 * 8
+        arrays = {}
+        for key, (offset, typecode, nbytes) in meta["arrays"].items():
+            arrays[key] = block.view(start + offset, nbytes, typecode)
+
+        tax = cls._empty_from_settings(meta)
+        nodes = SharedStrings(arrays["node_offsets"], arrays["node_data"])
+        table = arrays["node_table"]
+        tax._nodes = SharedMapping(
+            nodes, table, arrays["parents"], default=meta["root_parent"]
+        )
+        tax._names = SharedMapping(
+            nodes,
+            table,
+            arrays["name_idx"],
+            strings=SharedStrings(arrays["name_offsets"], arrays["name_data"]),
+        )
+        tax._ranks = SharedMapping(
+            nodes,
+            table,
+            arrays["rank_idx"],
+            strings=SharedStrings(arrays["rank_offsets"], arrays["rank_data"]),
+        )
+        tax._reset_aux_data()
+        tax._node_children = SharedMapping(
+            nodes, table, (arrays["child_offsets"], arrays["child_idx"]), lists=True
+        )
+        if "interval_pre" in arrays:
+            tax._node_intervals = SharedMapping(
+                nodes,
+                table,
+                (
+                    arrays["interval_pre"],
+                    arrays["interval_last"],
+                    arrays["interval_depth"],
+                ),
+            )
+
+        tax._mutable = False
+        # Keep block attached while the taxonomy is used
+        tax._shm = block
+        return tax
+
+    @classmethod
+    def attach_sqlite(cls, file: str, cache: int = 10000):
+        """
+        Attaches to a taxonomy exported with to_sqlite(), without loading it in memory.
+        Tree, names, ranks, children, nodes by name/rank and lineages are queried from the indexed database on use,
+        keeping only the most recently used entries of each in memory (memory usage does not depend on the size of the taxonomy).
+        Merged/forwarded nodes and extended names (NcbiTx, OttTx) are also queried from the database.
+        The taxonomy is read-only and other aux. structures are built in memory on first use.
+
+        Parameters:
+        * **file** *[str]*: SQLite database file.
+        * **cache** *[int]*: Number of entries kept in memory for each structure.
+
+        Example:
+
+            from multitax import NcbiTx
+            NcbiTx().to_sqlite("ncbi.db")  # once
+            tax = NcbiTx.attach_sqlite("ncbi.db")
+            tax.lineage("562")
+            # ['1', '131567', '2', '1224', '1236', '91347', '543', '561', '562']
+
+        Returns: read-only taxonomy of the exported class (or the calling class)
+        """
+        import sqlite3
+        from pathlib import Path
+
+        check_file(file)
+        con = sqlite3.connect(
+            Path(file).resolve().as_uri() + "?mode=ro",
+            uri=True,
+            check_same_thread=False,
+        )
+        meta = json.loads(
+            con.execute("SELECT value FROM meta WHERE key = 'multitax'").fetchone()[0]
+        )
+
+        tax = cls._empty_from_settings(meta)
+
+        def mapping(get, keys, count, lists=False):
+            return SqliteMapping(
+                con,
+                get,
+                keys,
+                count,
+                lists=lists,
+                params={"root": tax.root_node},
+                cache=cache,
+            )
+
+        tax._nodes = mapping(
+            "SELECT parent FROM nodes WHERE node = :key",
+            "SELECT node FROM nodes ORDER BY rowid",
+            "SELECT COUNT(*) FROM nodes",
+        )
+        # Names and ranks defined for each node (bits 1 and 2), None values are stored as NULL
+        for col, bit in [("name", "1"), ("rank", "2")]:
+            defined = " WHERE defined & " + bit
+            setattr(
+                tax,
+                "_" + col + "s",
+                mapping(
+                    "SELECT "
+                    + col
+                    + " FROM nodes WHERE node = :key AND defined & "
+                    + bit,
+                    "SELECT node FROM nodes" + defined + " ORDER BY rowid",
+                    "SELECT COUNT(*) FROM nodes" + defined,
+                ),
+            )
+        tax._reset_aux_data()
+        tax._node_children = mapping(
+            "SELECT node FROM nodes WHERE parent = :key ORDER BY rowid",
+            "SELECT DISTINCT parent FROM nodes",
+            "SELECT COUNT(DISTINCT parent) FROM nodes",
+            lists=True,
+        )
+        tax._name_nodes = mapping(
+            "SELECT node FROM nodes WHERE name = :key ORDER BY rowid",
+            "SELECT DISTINCT name FROM nodes WHERE name IS NOT NULL",
+            "SELECT COUNT(DISTINCT name) FROM nodes",
+            lists=True,
+        )
+        tax._rank_nodes = mapping(
+            "SELECT node FROM nodes WHERE rank = :key ORDER BY rowid",
+            "SELECT DISTINCT rank FROM nodes WHERE rank IS NOT NULL",
+            "SELECT COUNT(DISTINCT rank) FROM nodes",
+            lists=True,
+        )
+        # Lineages walking up the tree (recursive query), only if root is reached
+        tax._lineages = mapping(
+            """WITH RECURSIVE up(node, parent, depth) AS (
+                SELECT node, parent, 0 FROM nodes WHERE node = :key
+                UNION ALL
+                SELECT nodes.node, nodes.parent, up.depth + 1 FROM nodes
+                JOIN up ON nodes.node = up.parent WHERE up.node != :root
+            )
+            SELECT node FROM up
+            WHERE (SELECT node FROM up ORDER BY depth DESC LIMIT 1) = :root
+            ORDER BY depth DESC""",
+            "SELECT node FROM nodes ORDER BY rowid",
+            "SELECT COUNT(*) FROM nodes",
+            lists=True,
+        )
+        # Data of sub-classes (tables may be missing on databases from older versions)
+        tables = {
+            row[0]
+            for row in con.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table'"
+            )
+        }
+        if "merged" in tables:
+            tax._set_merged_nodes(
+                mapping(
+                    "SELECT latest FROM merged WHERE node = :key",
+                    "SELECT node FROM merged ORDER BY rowid",
+                    "SELECT COUNT(*) FROM merged",
+                )
+            )
+        if "extended_names" in tables and hasattr(tax, "_extended_name_nodes"):
+            tax._extended_name_nodes = mapping(
+                "SELECT node FROM extended_names WHERE name = :key ORDER BY rowid",
+                "SELECT DISTINCT name FROM extended_names",
+                "SELECT COUNT(DISTINCT name) FROM extended_names",
+                lists=True,
+            )
+        tax._mutable = False
+        # Keep connection open while the taxonomy is used
+        tax._sqlite = con
+        return tax
 
     def build_lineages(self, root_node: str = None, ranks: list = None):
         """
         Stores lineages in memory for faster access.
         It is valid for lineage(), rank_lineage() and name_lineage().
         If keyword arguments (root_node, ranks) are used in those functions stored lineages are not used.
+        Lineages are built top-down and share their common prefixes (see `multitax.utils.Lineage`).
+        With ranks, nodes without a new ranked ancestor share the list of their parent.
+        Stored lineages are internal, lineage() returns them as new lists.
 
         Returns: None
         """
+        self._check_mutable(aux=True)
         self.clear_lineages()
+        if not root_node:
+            root_node = self.root_node
+
+        # Position of each rank on the fixed length ranked lineage (first occurrence)
+        # Kept to extend lineages of nodes added later
+        rank_pos = self._lineages_ranks
+        if ranks:
+            for i, r in reversed(list(enumerate(ranks))):
+                rank_pos[r] = i
+
+        # Shared empty lineage for invalid nodes (not linked to root_node)
+        invalid = Lineage()
+        lineages = self._lineages
         for node in self._nodes:
-            self._lineages[node] = self.lineage(
-                node=node, root_node=root_node, ranks=ranks
-            )
+            if node in lineages:
+                continue
+            # Walk up until a node with known lineage, the root or the end of the tree
+            path = []
+            n = node
+            while n not in lineages and n != root_node and n in self._nodes:
+                path.append(n)
+                n = self._nodes[n]
+
+            if n == root_node and n not in lineages:
+                if ranks:
+                    lin = [self.undefined_node] * len(ranks)
+                    r = self.rank(n)
+                    if r in rank_pos:
+                        lin[rank_pos[r]] = n
+                else:
+                    lin = Lineage(n)
+                lineages[n] = lin
+            lin = lineages.get(n, invalid)
+
+            # Extend lineage back down the path
+            for n in reversed(path):
+                lin = self._child_lineage(n, lin)
+                lineages[n] = lin
+
+    def build_ngram_index(self):
+        """
+        Builds a n-gram (trigram) index of names for faster partial name search.
+        Used by search_name(exact=False), also when filtering by rank.
+        NcbiTx and OttTx also index extended names, if parsed.
+
+        Returns: None
+        """
+        self._check_mutable(aux=True)
+        if not self._name_nodes:
+            self._name_nodes = reverse_dict(self._names)
+        self._name_ngrams = NgramIndex(self._name_nodes)
+
+    def build_rank_table(self, ranks: list):
+        """
+        Stores the ancestor of each node for the given ranks for faster access.
+        Builds one node,ancestor dict per rank in a single top-down pass.
+        It is used by lineage() with ranks (and without root_node), rank_lineage(), name_lineage(), parent_rank() and closest_parent() when all requested ranks are stored.
+        Nodes without an ancestor of a certain rank are stored with undefined_node.
+
+        Example:
+
+            from multitax import NcbiTx
+            tax = NcbiTx()
+            tax.build_rank_table(["genus", "species"])
+            tax.parent_rank("562", "genus")
+            # '561'
+
+        Returns: None
+        """
+        self._check_mutable(aux=True)
+        if isinstance(ranks, str):
+            ranks = [ranks]
+        self._rank_table = {r: {} for r in ranks}
+
+        tables = list(self._rank_table.values())
+        # Any table has the nodes already projected (same keys for all ranks)
+        first = tables[0] if tables else {}
+        for node in self._nodes:
+            if node in first:
+                continue
+            # Walk up until a node already projected or the root
+            path = []
+            n = node
+            while n not in first and n != self.root_node and n in self._nodes:
+                path.append(n)
+                n = self._nodes[n]
+
+            if n == self.root_node and n not in first:
+                path.append(n)
+            elif n not in first:
+                # Not linked to root, invalid lineage
+                continue
+
+            # Project ranks back down the path (top-most node of a rank is kept)
+            for n in reversed(path):
+                p = self._nodes[n]
+                r = self.rank(n)
+                for rank, table in self._rank_table.items():
+                    anc = table.get(p, self.undefined_node)
+                    if anc == self.undefined_node and r == rank:
+                        anc = n
+                    table[n] = anc
+
+    def build_subtree_counts(self):
+        """
+        Stores the number of nodes, leaves, nodes per rank and leaves per rank of every subtree (node included).
+        Computed in one bottom-up pass. Counts are stored only for internal nodes (leaves are trivial).
+        Used by subtree_stats() and stats().
+
+        Returns: None
+        """
+        self._check_mutable(aux=True)
+        self._subtree_counts = {}
+
+        # Top-down order of the tree (parents before children)
+        order = [self.root_node]
+        i = 0
+        while i < len(order):
+            order.extend(self.children(order[i]))
+            i += 1
+
+        for node in reversed(order):
+            if node in self._subtree_counts:
+                # Internal node, children already accounted
+                c = self._subtree_counts[node]
+                c[0] += 1
+                if node in self._ranks:
+                    c[2][self._ranks[node]] += 1
+            else:
+                c = self._leaf_counts(node)
+
+            if node != self.root_node:
+                parent = self._nodes[node]
+                if parent not in self._subtree_counts:
+                    self._subtree_counts[parent] = [0, 0, Counter(), Counter()]
+                pc = self._subtree_counts[parent]
+                pc[0] += c[0]
+                pc[1] += c[1]
+                pc[2].update(c[2])
+                pc[3].update(c[3])
 
     def build_translation(self, tax, files: list = None, urls: list = None):
         """
@@ -290,6 +1473,7 @@ class MultiTax(object):
             ncbi_tax.translate("620")
                 {'g__Escherichia', 'g__Proteus', 'g__Serratia'}
         """
+        self._check_mutable(aux=True)
         if files:
             if isinstance(files, str):
                 files = [files]
@@ -350,7 +1534,9 @@ class MultiTax(object):
 
         Returns: None
         """
+        self._check_mutable(aux=True)
         self._lineages = {}
+        self._lineages_ranks = {}
 
     def closest_parent(self, node: str, ranks: str):
         """
@@ -367,11 +1553,191 @@ class MultiTax(object):
         # nothing found
         return self.undefined_node
 
+    def consensus_many(
+        self,
+        sets,
+        method: str = "lca",
+        threshold: float = 0.5,
+        processes: int = 1,
+        chunksize: int = 10000,
+    ):
+        """
+        Returns the consensus node of each set of nodes (e.g. multiple hits of a read).
+        Uses an index of pre-order intervals (built on first use): the LCA of a set is the LCA of its first and last nodes in pre-order.
+
+        Parameters:
+        * **sets** *[iterable]*: Sets (or lists) of nodes or dicts {node: weight}. Nodes not found are ignored.
+        * **method** *[str]*: "lca" (lowest common ancestor) or "majority" (deepest node with more than threshold of the total weight).
+        * **threshold** *[float]*: Fraction of the weight to be exceeded for method="majority".
+        * **processes** *[int]*: Number of processes. If > 1, sets are processed in chunks in a process pool.
+        * **chunksize** *[int]*: Number of sets sent at once to each process.
+
+        Example:
+
+            from multitax import NcbiTx
+            tax = NcbiTx()
+            tax.consensus_many([{"562", "561"}, {"562": 3, "1280": 1}], method="majority", threshold=0.7)
+            # ['561', '562']
+
+        Returns: list of nodes (undefined_node for empty sets)
+        """
+        if method not in ["lca", "majority"]:
+            raise ValueError(
+                "Method [" + method + "] is not valid. Options: lca,majority"
+            )
+
+        # Setup on first use (before forking processes)
+        if not self._node_intervals:
+            self._build_node_intervals()
+
+        if processes > 1:
+            import multiprocessing
+
+            sets = list(sets)
+            chunks = [sets[i : i + chunksize] for i in range(0, len(sets), chunksize)]
+            with multiprocessing.Pool(
+                processes, initializer=_set_pool_tax, initargs=(self,)
+            ) as pool:
+                ret = []
+                for r in pool.imap(
+                    _consensus_chunk, [(c, method, threshold) for c in chunks]
+                ):
+                    ret.extend(r)
+                return ret
+        else:
+            return [self._consensus(s, method, threshold) for s in sets]
+
+    def distance(self, node1: str, node2: str, metric: str = "edges"):
+        """
+        Returns the taxonomic distance between two nodes, based on their lowest common ancestor (LCA).
+
+        Parameters:
+        * **node1** *[str]*: First node.
+        * **node2** *[str]*: Second node.
+        * **metric** *[str]*: "edges" (path length through the LCA) or "rank" (rank of the LCA).
+
+        Returns: int (edges), str (rank) or None if a node is not found
+        """
+        if metric not in ["edges", "rank"]:
+            raise ValueError(
+                "Metric [" + metric + "] is not valid. Options: edges,rank"
+            )
+
+        lin1 = self.lineage(node1, ranks=[])
+        lin2 = self.lineage(node2, ranks=[])
+        if not lin1 or not lin2:
+            return None
+
+        # Length of common prefix (depth of LCA + 1)
+        common = 0
+        for n1, n2 in zip(lin1, lin2):
+            if n1 != n2:
+                break
+            common += 1
+
+        if metric == "edges":
+            return len(lin1) + len(lin2) - 2 * common
+        else:
+            return self.rank(lin1[common - 1])
+
+    def distance_matrix(self, nodes: list, metric: str = "edges", chunk: int = 1024):
+        """
+        Returns a pairwise distance matrix (numpy.ndarray) between nodes, based on their lowest common ancestor (LCA).
+        Nodes are sorted in depth-first order (lexicographic order of lineages), where the LCA depth of any pair
+        is the minimum LCA depth of the neighbours between them. Each row is then filled with one vectorized cumulative minimum.
+        Requires numpy.
+
+        Parameters:
+        * **nodes** *[list]*: List of nodes (rows and columns of the matrix, in the same order).
+        * **metric** *[str]*: "edges" (path length through the LCA, int matrix, -1 if a node is not found) or "rank" (rank of the LCA, object matrix, undefined_rank if a node is not found).
+        * **chunk** *[int]*: Number of rows processed at once for metric="rank" (limits memory usage).
+
+        Example:
+
+            from multitax import GtdbTx
+            tax = GtdbTx()
+            tax.distance_matrix(["s__Escherichia coli", "s__Escherichia albertii", "g__Salmonella"])
+            # array([[0, 2, 3],
+            #        [2, 0, 3],
+            #        [3, 3, 0]], dtype=int16)
+        """
+        import numpy as np
+
+        if metric not in ["edges", "rank"]:
+            raise ValueError(
+                "Metric [" + metric + "] is not valid. Options: edges,rank"
+            )
+
+        # Lineages as lists of integer ids
+        ids = {}
+        lineages = []
+        for node in nodes:
+            lineages.append(
+                [ids.setdefault(n, len(ids)) for n in self.lineage(node, ranks=[])]
+            )
+        k = len(lineages)
+        lens = np.array([len(lin) for lin in lineages], dtype=np.int64)
+        max_len = int(lens.max()) if k else 0
+        dtype = np.int16 if 2 * max_len < 2**15 else np.int32
+
+        # Lexicographic order of lineages is a depth-first order of the nodes
+        order = sorted(range(k), key=lineages.__getitem__)
+        # Number of common ancestors (LCA depth + 1) of neighbours
+        adjacent = np.zeros(max(k - 1, 0), dtype=dtype)
+        for t in range(k - 1):
+            c = 0
+            for n1, n2 in zip(lineages[order[t]], lineages[order[t + 1]]):
+                if n1 != n2:
+                    break
+                c += 1
+            adjacent[t] = c
+
+        # Number of common ancestors of every pair, on depth-first order
+        common = np.empty((k, k), dtype=dtype)
+        for i in range(k):
+            common[i, i] = lens[order[i]]
+            if i + 1 < k:
+                row = np.minimum.accumulate(adjacent[i:])
+                common[i, i + 1 :] = row
+                common[i + 1 :, i] = row
+        # Back to input order
+        pos = np.empty(k, dtype=np.int64)
+        pos[order] = np.arange(k)
+        common = common[np.ix_(pos, pos)]
+
+        valid = lens > 0
+        invalid_pairs = ~(valid[:, None] & valid[None, :])
+        if metric == "edges":
+            lens = lens.astype(dtype)
+            dist = lens[:, None] + lens[None, :]
+            dist -= common
+            dist -= common
+            dist[invalid_pairs] = -1
+            return dist
+        else:
+            # Matrix of ancestors by depth (padded) to get the LCA of each pair
+            anc = np.zeros((k, max(max_len, 1)), dtype=np.int64)
+            for i, lin in enumerate(lineages):
+                anc[i, : len(lin)] = lin
+            ranks = np.array(
+                [self.rank(n) for n in ids] + [self.undefined_rank], dtype=object
+            )
+            dist = np.empty((k, k), dtype=object)
+            for start in range(0, k, chunk):
+                c = common[start : start + chunk].astype(np.int64)
+                lca = np.take_along_axis(
+                    anc[start : start + chunk], np.maximum(c - 1, 0), axis=1
+                )
+                lca[invalid_pairs[start : start + chunk]] = len(ids)
+                dist[start : start + chunk] = ranks[lca]
+            return dist
+
     def filter(self, nodes: list, desc: bool = False):
         """
         Filters taxonomy given a list of nodes.
         By default keep all the ancestors of the given nodes.
         If desc=True, keep all descendants instead.
+        Nodes to keep are marked in a single pass (every node is visited once).
         Deletes built lineages and translations.
 
         Example:
@@ -389,34 +1755,47 @@ class MultiTax(object):
             # Keep only descendants of 'g__Enterovibrio'
             tax.filter('g__Enterovibrio', desc=True)
         """
+        self._check_mutable()
         if isinstance(nodes, str):
             nodes = [nodes]
 
-        # Keep track of nodes to be filtered out
-        filtered_nodes = set(self._nodes)
-        # Always keep root
-        filtered_nodes.discard(self.root_node)
+        # Keep track of nodes to be kept, always keep root
+        kept_nodes = {self.root_node}
 
         if desc:
             # Keep descendants of the given nodes
+            linked_nodes = []
             for node in nodes:
-                # Check if node exists (skips root)
-                if node in filtered_nodes:
-                    # For each leaf of the selected nodes
-                    for leaf in self.leaves(node):
-                        # Build lineage of each leaf up-to node itself
-                        for n in self.lineage(leaf, root_node=node):
-                            # Discard nodes from set to be kept
-                            filtered_nodes.discard(n)
-                    # Link node to root
+                # Check if node exists and it is not yet kept (skips root)
+                if node in self._nodes and node not in kept_nodes:
+                    # Mark subtree, skipping branches already kept
+                    stack = [node]
+                    while stack:
+                        n = stack.pop()
+                        kept_nodes.add(n)
+                        for child in self.children(n):
+                            if child not in kept_nodes:
+                                stack.append(child)
+                    linked_nodes.append(node)
+            # Link nodes to root if their parent is not kept (after marking, children are not updated)
+            # Nested nodes (descendants of other given nodes) keep their parents, independent of order
+            for node in linked_nodes:
+                if self._nodes[node] not in kept_nodes:
                     self._nodes[node] = self.root_node
         else:
             # Keep ancestors of the given nodes (full lineage up-to root)
             for node in nodes:
-                # ranks=[] in case build_lineages() was used with specific ranks
-                for n in self.lineage(node, ranks=[]):
-                    # Discard nodes from set to be kept
-                    filtered_nodes.discard(n)
+                # Walk up until a node already kept
+                path = []
+                n = node
+                while n not in kept_nodes and n in self._nodes:
+                    path.append(n)
+                    n = self._nodes[n]
+                # Only keep if linked to root
+                if n in kept_nodes:
+                    kept_nodes.update(path)
+
+        filtered_nodes = set(self._nodes).difference(kept_nodes)
 
         # Delete filtered nodes
         for node in filtered_nodes:
@@ -426,9 +1805,238 @@ class MultiTax(object):
         self._reset_aux_data()
         self.check_consistency()
 
-    def latest(self, node: str):
+    def freeze(self, ranks: list = None, search: bool = True):
         """
-        Returns latest/updated version of a given node.
+        Builds all aux. structures and makes the taxonomy immutable, for concurrent reads (e.g. threads).
+        Afterwards, functions changing the tree (add, remove, filter, prune, ...) or aux. structures (build_*, clear_lineages) raise an error.
+        Queries only read structures built here, never building or changing them on first use, so no locks are needed.
+
+        Parameters:
+        * **ranks** *[list]*: Also build a rank table for those ranks (see build_rank_table()).
+        * **search** *[bool]*: Also build name indices for partial, fuzzy and prefix search. Otherwise, fuzzy and prefix searches build a temporary index on every call.
+
+        Example:
+
+            from concurrent.futures import ThreadPoolExecutor
+            from multitax import NcbiTx
+            tax = NcbiTx()
+            tax.freeze(ranks=["genus", "species"])
+            with ThreadPoolExecutor(8) as pool:
+                lineages = list(pool.map(tax.lineage, ["562", "561", "620"]))
+
+        Returns: None
+        """
+        if self._frozen:
+            return
+        if not self._node_children:
+            self._node_children = reverse_dict(self._nodes)
+        if not self._name_nodes:
+            self._name_nodes = reverse_dict(self._names)
+        if not self._rank_nodes:
+            self._rank_nodes = reverse_dict(self._ranks)
+        if not self._lineages:
+            self.build_lineages()
+        if not self._node_intervals:
+            self._build_node_intervals()
+        if not self._subtree_counts:
+            self.build_subtree_counts()
+        if ranks:
+            self.build_rank_table(ranks)
+        if search:
+            self.build_ngram_index()
+            self._name_fuzzy = FuzzyIndex(
+                {name for names in self._search_names() for name in names}
+            )
+            for case_sensitive in [True, False]:
+                self._name_prefixes[case_sensitive] = PrefixIndex(
+                    self._search_names(), case_sensitive=case_sensitive
+                )
+        # Count nodes of views (cached)
+        len(self._nodes)
+        self._mutable = False
+        self._frozen = True
+
+    @classmethod
+    def from_arrow(cls, table):
+        """
+        Loads a taxonomy from a table exported with to_arrow() or write_parquet().
+        Only the columns node, parent, name and rank are used. Tables from other sources need at least node and parent
+        (root: node without a parent in the table). Requires pyarrow.
+
+        Parameters:
+        * **table** *[pyarrow.Table, str]*: Table or Parquet file.
+
+        Example:
+
+            from multitax import GtdbTx
+            tax = GtdbTx.from_arrow("gtdb.parquet")
+
+        Returns: taxonomy of the exported class (or the calling class)
+        """
+        import pyarrow.parquet as pq
+
+        if isinstance(table, str):
+            # Read only the used columns
+            names = pq.read_schema(table).names
+            table = pq.read_table(
+                table,
+                columns=[c for c in ["node", "parent", "name", "rank"] if c in names],
+            )
+        for col in ["node", "parent"]:
+            if col not in table.column_names:
+                raise ValueError("Column [" + col + "] not found.")
+
+        metadata = table.schema.metadata or {}
+        meta = json.loads(metadata.get(b"multitax", b"{}"))
+
+        tax = cls._empty_from_settings(meta)
+        nodes = table.column("node").to_pylist()
+        tax._nodes = dict(zip(nodes, table.column("parent").to_pylist()))
+        for col, attr in [("name", "_names"), ("rank", "_ranks")]:
+            if col in table.column_names:
+                column = table.column(col)
+                values = zip(nodes, column.to_pylist())
+                if column.null_count:
+                    values = ((n, v) for n, v in values if v is not None)
+                setattr(tax, attr, dict(values))
+            else:
+                setattr(tax, attr, {})
+        tax._reset_aux_data()
+
+        # Root of tables from other sources
+        if not meta:
+            for node, parent in tax._nodes.items():
+                if parent not in tax._nodes or parent == node:
+                    tax.root_node = node
+                    tax.root_parent = parent
+                    break
+            tax.root_name = tax._names.get(tax.root_node)
+            tax.root_rank = tax._ranks.get(tax.root_node)
+        return tax
+
+    @classmethod
+    def from_edges(cls, edges, **kwargs):
+        """
+        Creates a taxonomy from edges (node, parent, name, rank) in any order.
+        The taxonomy is created with the keyword arguments (empty for DummyTx, or parsed from files) and edges are added with add_many().
+        An edge of the root node only sets its name and rank.
+
+        Parameters:
+        * **edges** *[iterable]*: Tuples of (node, parent), (node, parent, name) or (node, parent, name, rank).
+        * **\*\*kwargs** defined at `multitax.multitax.MultiTax`
+
+        Example:
+
+            from multitax import DummyTx
+            tax = DummyTx.from_edges([("562", "561", "Escherichia coli", "species"), ("561", "1", "Escherichia", "genus")])
+            tax.lineage("562")
+            # ['1', '561', '562']
+
+        Returns: taxonomy of the calling class
+        """
+        tax = cls(**kwargs)
+        records = []
+        root = False
+        for edge in edges:
+            if edge[0] == tax.root_node:
+                if len(edge) > 2 and edge[2] is not None:
+                    tax._names[tax.root_node] = tax.root_name = edge[2]
+                if len(edge) > 3 and edge[3] is not None:
+                    tax._ranks[tax.root_node] = tax.root_rank = edge[3]
+                root = True
+            else:
+                records.append(edge)
+        if root:
+            tax._reset_aux_data()
+        tax.add_many(records)
+        return tax
+
+    def iter_lineages(
+        self, nodes: list = None, root_node: str = None, ranks: list = None
+    ):
+        """
+        Generator of lineages, yielding tuples (node, lineage).
+        If nodes are not provided, walks the subtree of root_node (default root) in pre-order,
+        extending the lineage of the parent node (see `multitax.utils.Lineage`) without repeated walks to the root.
+        Those lineages are read-only sequences sharing their prefixes, use tolist() to get a list.
+        Parameters root_node and ranks as in lineage().
+
+        Example:
+
+            for node, lin in tax.iter_lineages(["562", "561"], ranks=["genus", "species"]):
+                print(node, lin)
+        """
+        if nodes is not None:
+            if isinstance(nodes, str):
+                nodes = [nodes]
+            for node in nodes:
+                yield node, self.lineage(node, root_node=root_node, ranks=ranks)
+        else:
+            if not root_node:
+                root_node = self.root_node
+            if root_node not in self._nodes:
+                return
+            if ranks:
+                for node in self.iter_subtree(root_node):
+                    yield node, self.lineage(node, root_node=root_node, ranks=ranks)
+            else:
+                lineages = [Lineage(root_node)]
+                for node, depth in self._iter_preorder(root_node):
+                    if depth:
+                        del lineages[depth:]
+                        lineages.append(Lineage(node, lineages[depth - 1]))
+                    yield node, lineages[depth]
+
+    def iter_subtree(
+        self,
+        node: str = None,
+        order: str = "pre",
+        max_depth: int = None,
+        ranks: list = None,
+    ):
+        """
+        Generator of nodes of the subtree of a given node (node included), default root.
+        Iterative and lazy: nodes are yielded while the tree is traversed.
+
+        Parameters:
+        * **node** *[str]*: Top node of the subtree (default root).
+        * **order** *[str]*: Traversal order. Options: "pre" (pre-order), "post" (post-order), "bfs" (breadth-first).
+        * **max_depth** *[int]*: Maximum depth relative to node (node has depth 0).
+        * **ranks** *[list]*: Yield only nodes of the given ranks (traversal continues through other nodes).
+
+        Example:
+
+            from multitax import GtdbTx
+            tax = GtdbTx()
+            for n in tax.iter_subtree("p__Hadarchaeota", ranks=["species"]):
+                print(n)
+        """
+        if order not in ["pre", "post", "bfs"]:
+            raise ValueError(
+                "Order [" + order + "] is not valid. Options: pre,post,bfs"
+            )
+
+        if node is None:
+            node = self.root_node
+        if node not in self._nodes:
+            return
+
+        if order == "bfs":
+            queue = deque([(node, 0)])
+            while queue:
+                n, depth = queue.popleft()
+                if max_depth is None or depth < max_depth:
+                    queue.extend((c, depth + 1) for c in self.children(n))
+                if not ranks or self.rank(n) in ranks:
+                    yield n
+        else:
+            for n, _ in self._iter_preorder(node, max_depth, post=order == "post"):
+                if not ranks or self.rank(n) in ranks:
+                    yield n
+
+    def latest(self, node: str):
+        """
+        Returns latest/updated version of a given node.
         If node is already the latests, returns itself.
         Mainly used for NCBI (merged.dmp) and OTT (forwards.tsv)
         """
@@ -437,6 +2045,15 @@ class MultiTax(object):
         else:
             return self.undefined_node
 
+    def lca(self, nodes: list):
+        """
+        Returns the lowest common ancestor (LCA) of a list of nodes. Nodes not found are ignored.
+        For many sets of nodes, use consensus_many().
+        """
+        if not self._node_intervals:
+            self._build_node_intervals()
+        return self._consensus(nodes, "lca", None)
+
     def leaves(self, node: str = None):
         """
         Returns a list of leaf nodes of a given node.
@@ -457,7 +2074,15 @@ class MultiTax(object):
         """
         # If lineages were built with build_lineages() with matching params
         if node in self._lineages and root_node is None and ranks is None:
-            return self._lineages[node]
+            lin = self._lineages[node]
+            # Stored lineages are shared between nodes, return a new list
+            return lin.copy() if isinstance(lin, list) else lin.tolist()
+        # If all ranks were projected with build_rank_table()
+        elif root_node is None and ranks and self._has_rank_table(ranks):
+            if node in self._rank_table[ranks[0]]:
+                return [self._rank_table[r][node] for r in ranks]
+            else:
+                return []
         else:
             if not root_node:
                 root_node = self.root_node
@@ -542,9 +2167,11 @@ class MultiTax(object):
     def prune(self, nodes: list):
         """
         Prunes branches of the tree under the given nodes.
+        Descendants are marked in a single pass (every node is visited once).
         Deletes built lineages and translations.
         """
 
+        self._check_mutable()
         if isinstance(nodes, str):
             nodes = [nodes]
 
@@ -552,9 +2179,14 @@ class MultiTax(object):
         for node in nodes:
             if node not in self._nodes:
                 raise ValueError("Node [" + node + "] not found.")
-            for leaf in self.leaves(node):
-                for n in self.lineage(leaf, root_node=node)[1:]:
-                    del_nodes.add(n)
+            # Mark descendants, skipping branches already marked
+            stack = [c for c in self.children(node) if c not in del_nodes]
+            while stack:
+                n = stack.pop()
+                del_nodes.add(n)
+                for child in self.children(n):
+                    if child not in del_nodes:
+                        stack.append(child)
 
         for n in del_nodes:
             self._remove(n)
@@ -582,15 +2214,87 @@ class MultiTax(object):
         """
         Removes node from taxonomy. Can break the tree if a parent node is removed. To remove a certain branch, use prune.
         Running check consistency after removing a node is recommended.
-        Deletes built lineages and translations.
+        Built aux. structures are updated: descendants of the removed node get invalid (empty) lineages.
         """
+        self._check_mutable()
         if node not in self._nodes:
             raise ValueError("Node [" + node + "] not found.")
+        self._remove_aux(node)
         self._remove(node)
-        self._reset_aux_data()
         if check_consistency:
             self.check_consistency()
 
+    def rollup(self, counts, nodes: list = None, ranks: list = None):
+        """
+        Cumulative sum of values of nodes to all their ancestors (clade totals).
+        Values are propagated once per edge, from the leaves to the root (topological order), visiting only nodes with values and their ancestors.
+
+        Parameters:
+        * **counts** *[dict, list, numpy.ndarray]*: {node: value} or values in the same order as nodes. Values can be numbers or numpy arrays (e.g. one value per sample). A numpy matrix (nodes x samples) can be used with nodes.
+        * **nodes** *[list]*: Nodes for each value/row of counts (only if counts is not a dict).
+        * **ranks** *[list]*: Return only nodes of the given ranks.
+
+        Example:
+
+            from multitax import NcbiTx
+            tax = NcbiTx()
+            tax.rollup({"562": 10, "561": 2, "1280": 5}, ranks=["genus"])
+            # {'561': 12, '1279': 5}
+
+            # Several samples
+            import numpy as np
+            tax.rollup(np.array([[10, 0], [2, 1], [5, 7]]), nodes=["562", "561", "1280"])
+
+        Returns: dict {node: total}. Nodes not found in the tree are ignored.
+        """
+        if not isinstance(counts, dict):
+            if nodes is None:
+                raise ValueError("nodes are required if counts is not a dict")
+            if len(nodes) != len(counts):
+                raise ValueError("nodes and counts should have the same length")
+            counts = zip(nodes, counts)
+        else:
+            counts = counts.items()
+
+        # Sum values of repeated nodes, ignore nodes not on tree
+        totals = {}
+        for node, value in counts:
+            if node in self._nodes:
+                totals[node] = totals[node] + value if node in totals else value
+
+        # Count children with values of each node, collecting all ancestors once
+        pending = dict.fromkeys(totals, 0)
+        queue = list(totals)
+        while queue:
+            node = queue.pop()
+            parent = self._nodes[node]
+            if node == self.root_node or parent not in self._nodes:
+                continue
+            if parent not in pending:
+                pending[parent] = 0
+                queue.append(parent)
+            pending[parent] += 1
+
+        # Propagate from nodes with all children accounted (topological order)
+        ready = [node for node, c in pending.items() if c == 0]
+        while ready:
+            node = ready.pop()
+            parent = self._nodes[node]
+            if node == self.root_node or parent not in self._nodes:
+                continue
+            if parent in totals:
+                totals[parent] = totals[parent] + totals[node]
+            else:
+                totals[parent] = totals[node]
+            pending[parent] -= 1
+            if pending[parent] == 0:
+                ready.append(parent)
+
+        if ranks:
+            return {n: v for n, v in totals.items() if self.rank(n) in ranks}
+        else:
+            return totals
+
     def search_name(self, text: str, rank: str = None, exact: bool = True):
         """
         Search node by exact or partial name
@@ -609,7 +2313,7 @@ class MultiTax(object):
         if exact:
             ret = self._exact_name(text, self._name_nodes)
         else:
-            ret = self._partial_name(text, self._name_nodes)
+            ret = self._partial_name(text, self._name_nodes, self._name_ngrams)
 
         # Only return nodes of chosen rank
         if rank:
@@ -617,6 +2321,110 @@ class MultiTax(object):
         else:
             return ret
 
+    def search_name_fuzzy(self, text: str, max_distance: int = 2, rank: str = None):
+        """
+        Search nodes by approximate name (case insensitive), allowing typos and spelling variants.
+        Uses a n-gram index of names (built on first use), including extended names of NcbiTx and OttTx, if parsed.
+        On a taxonomy frozen with search=False, the index is built on every call and not kept.
+        Candidates are filtered by shared n-grams (or by length, for short texts) and verified by edit distance.
+
+        Parameters:
+        * **text** *[str]*: Text to search.
+        * **max_distance** *[int]*: Maximum number of edits (insertions, deletions, substitutions).
+        * **rank** *[str]*: Filter results by rank.
+
+        Example:
+
+            from multitax import GtdbTx
+            tax = GtdbTx()
+            tax.search_name_fuzzy("Escherichia colli", max_distance=1)
+            # ['s__Escherichia coli']
+
+        Returns: list of matching nodes, closer matches first
+        """
+        # Setup on first use (frozen taxonomies use a temporary index, not stored)
+        name_fuzzy = self._name_fuzzy
+        if name_fuzzy is None:
+            name_fuzzy = FuzzyIndex(
+                {name for names in self._search_names() for name in names}
+            )
+            if not self._frozen:
+                self._name_fuzzy = name_fuzzy
+
+        ret = []
+        found = set()
+        for name, _ in name_fuzzy.search(text, max_distance=max_distance):
+            for names in self._search_names():
+                for node in names.get(name, []):
+                    # Extended names may refer to nodes not on the tree (e.g. views)
+                    if node in found or node not in self._nodes:
+                        continue
+                    if not rank or self.rank(node) == rank:
+                        found.add(node)
+                        ret.append(node)
+        return ret
+
+    def search_prefix(
+        self,
+        prefix: str,
+        limit: int = None,
+        rank: str = None,
+        case_sensitive: bool = False,
+        order: str = None,
+    ):
+        """
+        Search nodes with names starting with a prefix (e.g. autocomplete).
+        Uses a sorted index of names (built on first use), including extended names of NcbiTx and OttTx, if parsed.
+        On a taxonomy frozen with search=False, the index is built on every call and not kept.
+
+        Parameters:
+        * **prefix** *[str]*: Prefix to search.
+        * **limit** *[int]*: Maximum number of nodes to return.
+        * **rank** *[str]*: Filter results by rank.
+        * **case_sensitive** *[bool]*: Case sensitive search.
+        * **order** *[str]*: Default by name. Options: "depth" (closer to root first), "size" (more leaves first). Ordering evaluates all matches before applying limit.
+
+        Example:
+
+            from multitax import GtdbTx
+            tax = GtdbTx()
+            tax.search_prefix("escherichia", limit=2, rank="genus")
+            # ['g__Escherichia', 'g__Escherichia_C']
+
+        Returns: list of matching nodes
+        """
+        if order not in [None, "depth", "size"]:
+            raise ValueError("Order [" + order + "] is not valid. Options: depth,size")
+
+        # Setup on first use (frozen taxonomies use a temporary index, not stored)
+        name_prefixes = self._name_prefixes.get(case_sensitive)
+        if name_prefixes is None:
+            name_prefixes = PrefixIndex(
+                self._search_names(), case_sensitive=case_sensitive
+            )
+            if not self._frozen:
+                self._name_prefixes[case_sensitive] = name_prefixes
+
+        ret = []
+        found = set()
+        for nodes in name_prefixes.search(prefix):
+            for node in nodes:
+                # Extended names may refer to nodes not on the tree (e.g. views)
+                if node in found or node not in self._nodes:
+                    continue
+                if not rank or self.rank(node) == rank:
+                    found.add(node)
+                    ret.append(node)
+            if order is None and limit and len(ret) >= limit:
+                break
+
+        if order == "depth":
+            ret.sort(key=lambda n: len(self.lineage(n, ranks=[])))
+        elif order == "size":
+            ret.sort(key=lambda n: self.subtree_stats(n)["leaves"], reverse=True)
+
+        return ret[:limit] if limit else ret
+
     def stats(self):
         """
         Returns a dict with general numbers of the taxonomic tree
@@ -646,13 +2454,357 @@ class MultiTax(object):
         s["nodes"] = len(self._nodes)
         s["ranks"] = len(self._ranks)
         s["names"] = len(self._names)
-        all_leaves = self.leaves(self.root_node)
-        s["leaves"] = len(all_leaves)
-        s["ranked_nodes"] = Counter(self._ranks.values())
-        s["ranked_leaves"] = Counter(map(self.rank, all_leaves))
+        if self._subtree_counts:
+            # Reuse counts built with build_subtree_counts()
+            root_stats = self.subtree_stats(self.root_node)
+            s["leaves"] = root_stats["leaves"]
+            s["ranked_nodes"] = root_stats["ranked_nodes"]
+            s["ranked_leaves"] = root_stats["ranked_leaves"]
+        else:
+            all_leaves = self.leaves(self.root_node)
+            s["leaves"] = len(all_leaves)
+            s["ranked_nodes"] = Counter(self._ranks.values())
+            s["ranked_leaves"] = Counter(map(self.rank, all_leaves))
 
         return s
 
+    def subtree_stats(self, node: str):
+        """
+        Returns a dict with numbers of the subtree of a given node (node included).
+        Counts are built for all nodes on first use (see build_subtree_counts()).
+
+        Example:
+
+            from multitax import GtdbTx
+            tax = GtdbTx()
+
+            tax.subtree_stats("g__Escherichia")
+            # {'nodes': 11,
+            #  'leaves': 10,
+            #  'ranked_nodes': Counter({'species': 10, 'genus': 1}),
+            #  'ranked_leaves': Counter({'species': 10})}
+        """
+        # Setup on first use
+        if not self._subtree_counts:
+            self.build_subtree_counts()
+
+        if node in self._subtree_counts:
+            c = self._subtree_counts[node]
+        elif node in self._nodes:
+            c = self._leaf_counts(node)
+        else:
+            c = [0, 0, Counter(), Counter()]
+
+        return {
+            "nodes": c[0],
+            "leaves": c[1],
+            "ranked_nodes": Counter(c[2]),
+            "ranked_leaves": Counter(c[3]),
+        }
+
+    def to_arrow(
+        self,
+        cols: list = [
+            "node",
+            "parent",
+            "rank",
+            "name",
+            "lineage",
+            "rank_lineage",
+            "name_lineage",
+        ],
+        rank_columns: list = None,
+    ):
+        """
+        Exports the taxonomy as a table, one row per node. Requires pyarrow.
+        Lineage fields are list columns, ranks and values of lists are dictionary-encoded.
+        The table keeps the settings of the taxonomy (root and undefined values) as metadata, loaded with from_arrow().
+
+        Parameters:
+        * **cols** *[list]*: Options: "node", "parent", "rank", "name", "lineage", "rank_lineage", "name_lineage"
+        * **rank_columns** *[list]*: Ranks to add as columns (named by rank) with the node of that rank on the lineage of each node (null if not present).
+
+        Example:
+
+            from multitax import NcbiTx
+            tax = NcbiTx()
+            table = tax.to_arrow(rank_columns=["genus", "species"])
+            import pyarrow.compute as pc
+            table.filter(pc.equal(table["node"], "562")).select(["name_lineage", "genus"]).to_pylist()
+            # [{'name_lineage': ['root', 'cellular organisms', ..., 'Escherichia', 'Escherichia coli'], 'genus': '561'}]
+
+        Returns: pyarrow.Table
+        """
+        import pyarrow as pa
+        import pyarrow.compute as pc
+        from itertools import accumulate, chain
+
+        fields = [
+            "node",
+            "parent",
+            "rank",
+            "name",
+            "lineage",
+            "rank_lineage",
+            "name_lineage",
+        ]
+        for c in cols:
+            if c not in fields:
+                raise ValueError(
+                    "Field [" + c + "] is not valid. Options: " + ",".join(fields)
+                )
+        for r in rank_columns or []:
+            if r in cols:
+                raise ValueError("Rank column [" + r + "] conflicts with a field.")
+
+        columns = self._columns()
+        nodes = columns["nodes"]
+        node_dict = pa.array(nodes, pa.string())
+
+        def indices(idx):
+            # Negative indices (not defined or None) as null
+            arr = pa.array(idx, pa.int32())
+            if len(arr) and pc.min(arr).as_py() < 0:
+                arr = pc.if_else(pc.less(arr, 0), pa.scalar(None, pa.int32()), arr)
+            return arr
+
+        data = {}
+        if {"lineage", "rank_lineage", "name_lineage"}.intersection(cols):
+            lins = self._index_lineages(columns)
+            offsets = pa.array(accumulate(map(len, lins), initial=0), pa.int32())
+            flat = pa.array(array("i", chain.from_iterable(lins)), pa.int32())
+            del lins
+
+        for c in cols:
+            if c == "node":
+                data[c] = node_dict
+            elif c == "parent":
+                outside = columns["outside"]
+                data[c] = pa.array(
+                    [
+                        nodes[p] if p >= 0 else outside[i]
+                        for i, p in enumerate(columns["parents"])
+                    ],
+                    pa.string(),
+                )
+            elif c == "rank":
+                data[c] = pa.DictionaryArray.from_arrays(
+                    indices(columns["rank_idx"]),
+                    pa.array(columns["ranks"], pa.string()),
+                )
+            elif c == "name":
+                names = columns["names"]
+                data[c] = pa.array(
+                    [names[i] if i >= 0 else None for i in columns["name_idx"]],
+                    pa.string(),
+                )
+            elif c == "lineage":
+                data[c] = pa.ListArray.from_arrays(
+                    offsets, pa.DictionaryArray.from_arrays(flat, node_dict)
+                )
+            else:
+                # Name or rank index of each node on the lineages
+                col = c.split("_")[0]
+                idx = pc.take(indices(columns[col + "_idx"]), flat)
+                data[c] = pa.ListArray.from_arrays(
+                    offsets,
+                    pa.DictionaryArray.from_arrays(
+                        indices(idx), pa.array(columns[col + "s"], pa.string())
+                    ),
+                )
+
+        if rank_columns:
+            lins = self._index_lineages(columns, ranks=rank_columns)
+            for i, r in enumerate(rank_columns):
+                data[r] = pa.DictionaryArray.from_arrays(
+                    indices(array("i", [lin[i] if lin else -1 for lin in lins])),
+                    node_dict,
+                )
+
+        meta = self._settings()
+        return pa.table(data, metadata={"multitax": json.dumps(meta)})
+
+    def to_shared_memory(self, name: str = None, intervals: bool = True):
+        """
+        Exports the taxonomy to a shared memory block, to be attached without copying by other processes with attach_shared().
+        Nodes, names and ranks are stored as string pools with offsets, the tree (parents and children) as arrays of node indices
+        and nodes are found with a hash table.
+
+        Parameters:
+        * **name** *[str]*: Name of the shared memory block. Default: random name.
+        * **intervals** *[bool]*: Also export pre-order intervals of nodes (used by lca(), consensus_many() and view()).
+
+        Example:
+
+            from multiprocessing import Pool
+            from multitax import NcbiTx
+
+            def init(name):
+                global tax
+                tax = NcbiTx.attach_shared(name)
+
+            def work(node):
+                return tax.lineage(node)
+
+            tax = NcbiTx()
+            shm = tax.to_shared_memory()
+            with Pool(64, initializer=init, initargs=(shm.name,)) as pool:
+                lineages = pool.map(work, ["562", "561", "620"])
+            shm.close()
+            shm.unlink()
+
+        Returns: multiprocessing.shared_memory.SharedMemory (to be closed and unlinked by the caller)
+        """
+        import os
+
+        columns = self._columns()
+        nodes = columns["nodes"]
+        ids = {node: i for i, node in enumerate(nodes)}
+
+        arrays = {}
+        arrays["node_offsets"], arrays["node_data"] = SharedStrings.pack(nodes)
+        arrays["node_table"] = SharedMapping.hash_table(nodes)
+        # Parent outside the tree (root): -1
+        arrays["parents"] = columns["parents"]
+
+        # Unique names/ranks and their index for each node (not defined: -1, None: -2)
+        for col in ["name", "rank"]:
+            arrays[col + "_idx"] = columns[col + "_idx"]
+            arrays[col + "_offsets"], arrays[col + "_data"] = SharedStrings.pack(
+                columns[col + "s"]
+            )
+
+        # Children of each node (from offset i to i+1)
+        # Setup on first use
+        if not self._node_children:
+            self._node_children = reverse_dict(self._nodes)
+        child_offsets = array("q", [0])
+        child_idx = array("q")
+        for node in nodes:
+            if node in self._node_children:
+                child_idx.extend([ids[c] for c in self._node_children[node]])
+            child_offsets.append(len(child_idx))
+        arrays["child_offsets"] = child_offsets
+        arrays["child_idx"] = child_idx
+
+        if intervals:
+            # Setup on first use
+            if not self._node_intervals:
+                self._build_node_intervals()
+            pres, lasts, depths = array("q"), array("q"), array("q")
+            for node in nodes:
+                pre, last, depth = self._node_intervals.get(node, (-1, -1, -1))
+                pres.append(pre)
+                lasts.append(last)
+                depths.append(depth)
+            arrays["interval_pre"] = pres
+            arrays["interval_last"] = lasts
+            arrays["interval_depth"] = depths
+
+        # Header with metadata and position of arrays (8-byte aligned)
+        meta = self._settings()
+        meta["pid"] = os.getpid()
+        meta["arrays"] = {}
+        offset = 0
+        for key, arr in arrays.items():
+            if isinstance(arr, array):
+                typecode, nbytes = arr.typecode, len(arr) * arr.itemsize
+            else:
+                typecode, nbytes = "B", len(arr)
+            meta["arrays"][key] = [offset, typecode, nbytes]
+            offset += (nbytes + 7) // 8 * 8
+        header = json.dumps(meta).encode()
+        start = (8 + len(header) + 7) // 8 * 8
+
+        shm = shared_memory.SharedMemory(name=name, create=True, size=start + offset)
+        shm.buf[:8] = len(header).to_bytes(8, "little")
+        shm.buf[8 : 8 + len(header)] = header
+        for key, arr in arrays.items():
+            offset, _, nbytes = meta["arrays"][key]
+            shm.buf[start + offset : start + offset + nbytes] = memoryview(arr).cast(
+                "B"
+            )
+        return shm
+
+    def to_sqlite(self, file: str, overwrite: bool = False):
+        """
+        Exports the taxonomy to an indexed SQLite database, to be used without loading it in memory with attach_sqlite().
+        Nodes are stored in a single table (node, parent, name, rank) indexed by each column,
+        with a bitmask of defined names (1) and ranks (2) to keep None values.
+        Merged/forwarded nodes (node, latest) and extended names (name, node) of NcbiTx and OttTx are stored in tables indexed by node and name, respectively.
+
+        Parameters:
+        * **file** *[str]*: Output SQLite database file.
+        * **overwrite** *[bool]*: Overwrite output file if it exists.
+
+        Example:
+
+            from multitax import GtdbTx
+            tax = GtdbTx()
+            tax.to_sqlite("gtdb.db")
+            tax = GtdbTx.attach_sqlite("gtdb.db")
+
+        Returns: None
+        """
+        import os
+        import sqlite3
+
+        if overwrite:
+            if os.path.isfile(file):
+                os.remove(file)
+        else:
+            check_no_file(file)
+
+        meta = self._settings()
+        con = sqlite3.connect(file)
+        try:
+            # Database is written once, without journal
+            con.execute("PRAGMA journal_mode = OFF")
+            con.execute("PRAGMA synchronous = OFF")
+            con.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+            con.execute(
+                "INSERT INTO meta VALUES ('multitax', ?)",
+                (json.dumps(meta),),
+            )
+            con.execute(
+                "CREATE TABLE nodes (node TEXT PRIMARY KEY, parent TEXT, name TEXT, rank TEXT, defined INTEGER)"
+            )
+            names = self._names
+            ranks = self._ranks
+            con.executemany(
+                "INSERT INTO nodes VALUES (?, ?, ?, ?, ?)",
+                (
+                    (
+                        node,
+                        parent,
+                        names.get(node),
+                        ranks.get(node),
+                        (node in names) | (node in ranks) << 1,
+                    )
+                    for node, parent in self._nodes.items()
+                ),
+            )
+            con.execute("CREATE TABLE merged (node TEXT PRIMARY KEY, latest TEXT)")
+            con.executemany(
+                "INSERT INTO merged VALUES (?, ?)", self._merged_nodes().items()
+            )
+            con.execute("CREATE TABLE extended_names (name TEXT, node TEXT)")
+            con.executemany(
+                "INSERT INTO extended_names VALUES (?, ?)",
+                (
+                    (name, node)
+                    for name, nodes in getattr(self, "_extended_name_nodes", {}).items()
+                    for node in nodes
+                ),
+            )
+            # Indices are built after all rows are inserted
+            for col in ["parent", "name", "rank"]:
+                con.execute("CREATE INDEX nodes_" + col + " ON nodes (" + col + ")")
+            con.execute("CREATE INDEX extended_names_name ON extended_names (name)")
+            con.commit()
+        finally:
+            con.close()
+
     def translate(self, node: str):
         """
         Returns the translated node from another taxonomy. Translated nodes are generated with the build_translation function.
@@ -662,6 +2814,157 @@ class MultiTax(object):
         else:
             return []
 
+    def validate(self, report: bool = True):
+        """
+        Validates the structure of the tree in linear time (every node is visited once).
+        Checks for nodes not reachable from the root node, orphans (parent not found), cycles and duplicated nodes on parsed files (defined with different parents, tracked by CustomTx).
+
+        Parameters:
+        * **report** *[bool]*: Return a report. Otherwise raise ValueError if the tree is not valid.
+
+        Example:
+
+            from multitax import CustomTx
+            tax = CustomTx(files="my_custom_tax.tsv", validate=False)
+            tax.validate()
+            # {'valid': False, 'unreachable': ['5', '6', '7'], 'orphans': [], 'cycles': [['5', '6']], 'duplicates': []}
+
+        Returns: dict with report (valid, unreachable, orphans, cycles, duplicates) or None
+        """
+        # Mark nodes reachable from the root, top-down (children not kept if not built)
+        node_children = (
+            self._node_children if self._node_children else reverse_dict(self._nodes)
+        )
+        reachable = set()
+        if self.root_node in self._nodes:
+            reachable.add(self.root_node)
+            stack = [self.root_node]
+            while stack:
+                for child in node_children.get(stack.pop(), []):
+                    if child not in reachable:
+                        reachable.add(child)
+                        stack.append(child)
+
+        unreachable = [n for n in self._nodes if n not in reachable]
+        orphans = [n for n in unreachable if self._nodes[n] not in self._nodes]
+
+        # Walk up from unreachable nodes, marking each node with the walk it was visited
+        # A walk ending on a node of the same walk closes a cycle
+        cycles = []
+        visited = {}
+        for walk, node in enumerate(unreachable):
+            n = node
+            while n in self._nodes and n not in visited:
+                visited[n] = walk
+                n = self._nodes[n]
+            if visited.get(n) == walk:
+                cycle = [n]
+                p = self._nodes[n]
+                while p != n:
+                    cycle.append(p)
+                    p = self._nodes[p]
+                cycles.append(cycle)
+
+        valid = not unreachable and not self._duplicated_nodes
+        if report:
+            return {
+                "valid": valid,
+                "unreachable": unreachable,
+                "orphans": orphans,
+                "cycles": cycles,
+                "duplicates": list(self._duplicated_nodes),
+            }
+        elif not valid:
+            if cycles:
+                raise ValueError(
+                    "Cycles found: " + " ".join(",".join(c) for c in cycles)
+                )
+            elif unreachable:
+                raise ValueError(
+                    "Nodes not linked to root node ["
+                    + self.root_node
+                    + "]: "
+                    + ",".join(unreachable)
+                )
+            else:
+                raise ValueError(
+                    "Duplicated nodes: " + ",".join(self._duplicated_nodes)
+                )
+        return None
+
+    def view(self, root: str = None, keep: list = None, prune: list = None):
+        """
+        Returns a read-only view of the taxonomy restricted to a clade, without copying it.
+        Main structures are shared and restricted with pre-order intervals of this taxonomy (see `multitax.utils.IntervalMask`).
+        Views support all query functions, with their own aux. structures (built on first use).
+        Functions changing the tree (add, remove, filter, prune, ...) raise an error. Changing this taxonomy invalidates its views.
+
+        Parameters:
+        * **root** *[str]*: Root node of the view. Default: root node of the taxonomy.
+        * **keep** *[str, list]*: Keep only the subtrees of these nodes (and their lineages). Nodes not found are ignored.
+        * **prune** *[str, list]*: Remove descendants of these nodes.
+
+        Example:
+
+            from multitax import NcbiTx
+            tax = NcbiTx()
+            bac = tax.view(root="2", prune="1224")
+            bac.lineage("1224")
+            # ['2', '1224']
+            bac.lineage("562")
+            # []
+
+        Returns: read-only taxonomy of the same class
+        """
+        if isinstance(keep, str):
+            keep = [keep]
+        if isinstance(prune, str):
+            prune = [prune]
+        if root is None:
+            root = self.root_node
+
+        # Setup on first use
+        if not self._node_intervals:
+            self._build_node_intervals()
+        intervals = self._node_intervals
+
+        if root not in intervals:
+            raise ValueError("Root node [" + root + "] not found.")
+
+        keep_ancestors = None
+        if keep is not None:
+            keep = [n for n in keep if n in intervals]
+            # Lineages of kept nodes up to root, always keep root
+            keep_ancestors = {root}
+            for node in keep:
+                n = node
+                while n in self._nodes and n not in keep_ancestors:
+                    keep_ancestors.add(n)
+                    n = self._nodes[n]
+
+        if prune is not None:
+            for n in prune:
+                if n not in self._nodes:
+                    raise ValueError("Node [" + n + "] not found.")
+            prune = [n for n in prune if n in intervals]
+
+        mask = IntervalMask(intervals, root, keep, keep_ancestors, prune)
+
+        # Same class and attributes, main structures restricted
+        tax = type(self).__new__(type(self))
+        tax.__dict__.update(self.__dict__)
+        tax._nodes = MaskedMapping(self._nodes, mask, {root: self.root_parent})
+        tax._ranks = MaskedMapping(self._ranks, mask)
+        tax._names = MaskedMapping(self._names, mask)
+        tax._reset_aux_data()
+        tax._translated_nodes = self._translated_nodes
+        tax._mutable = False
+        tax._frozen = False
+        tax.root_node = root
+        tax.root_name = self.name(root)
+        tax.root_rank = self.rank(root)
+        return tax
+
     def write(
         self,
         output_file: str,
@@ -670,9 +2973,14 @@ class MultiTax(object):
         sep_multi: str = "|",
         ranks: list = None,
         gz: bool = False,
+        compresslevel: int = 6,
+        background: bool = True,
+        overwrite: bool = False,
+        chunk: int = 10000,
     ):
         """
         Writes loaded taxonomy to a file.
+        Rows are formatted in chunks and the lineage of each node is calculated once for all lineage fields.
 
         Parameters:
         * **cols** *[list]*: Options: "node", "latest", "parent", "rank", "name", "leaves", "children", "lineage", "rank_lineage", "name_lineage"
@@ -680,59 +2988,246 @@ class MultiTax(object):
         * **sep_multi** *[str]*: Separator of multi-valued fields
         * **ranks** *[list]*: Ranks to report
         * **gz** *[bool]*: Gzip output
+        * **compresslevel** *[int]*: Gzip compression level (1: fastest, 9: smallest)
+        * **background** *[bool]*: Compress and write chunks in a background thread, while the next ones are formatted.
+        * **overwrite** *[bool]*: Overwrite output file if it exists.
+        * **chunk** *[int]*: Number of rows formatted at once.
 
         Returns: None
         """
         import gzip
+        import queue
+        import threading
+        from itertools import chain, islice
+
+        formatter = self._field_formatter(cols, sep, sep_multi, ranks)
 
         if gz:
             output_file = (
                 output_file if output_file.endswith(".gz") else output_file + ".gz"
             )
+        if not overwrite:
             check_no_file(output_file)
-            outf = gzip.open(output_file, "wt")
-        else:
-            check_no_file(output_file)
-            outf = open(output_file, "w")
-
-        write_field = {
-            "node": lambda node: node,
-            "latest": self.latest,
-            "parent": self.parent,
-            "rank": self.rank,
-            "name": self.name,
-            "leaves": lambda node: join_check(self.leaves(node), sep_multi),
-            "children": lambda node: join_check(self.children(node), sep_multi),
-            "lineage": lambda node: join_check(
-                self.lineage(node, ranks=ranks), sep_multi
-            ),
-            "rank_lineage": lambda node: join_check(
-                self.rank_lineage(node, ranks=ranks), sep_multi
-            ),
-            "name_lineage": lambda node: join_check(
-                self.name_lineage(node, ranks=ranks), sep_multi
-            ),
-        }
 
-        for c in cols:
-            if c not in write_field:
-                raise ValueError(
-                    "Field [" + c + "] is not valid. Options: " + ",".join(write_field)
-                )
+        # Lineages of all nodes are shared (top-down) while writing, when not yet built
+        temp_lineages = (
+            not ranks
+            and self._mutable
+            and not self._lineages
+            and {"lineage", "rank_lineage", "name_lineage"}.intersection(cols)
+        )
 
         if ranks:
-            for rank in ranks:
-                for node in self.nodes_rank(rank):
-                    print(
-                        *[write_field[c](node) for c in cols],
-                        sep=sep,
-                        end="\n",
-                        file=outf,
-                    )
+            nodes = chain.from_iterable(self.nodes_rank(rank) for rank in ranks)
         else:
-            for node in self._nodes:
-                print(
-                    *[write_field[c](node) for c in cols], sep=sep, end="\n", file=outf
-                )
+            nodes = iter(self._nodes)
+
+        def chunks():
+            while True:
+                batch = list(islice(nodes, chunk))
+                if not batch:
+                    break
+                yield ("\n".join(map(formatter, batch)) + "\n").encode()
+
+        outf = None
+        try:
+            if temp_lineages:
+                self.build_lineages()
+            if gz:
+                outf = gzip.open(output_file, "wb", compresslevel=compresslevel)
+            else:
+                outf = open(output_file, "wb")
+
+            if background:
+                # zlib and file writes release the GIL: compression overlaps formatting
+                q = queue.Queue(maxsize=8)
+                errors = []
+
+                def writer():
+                    while True:
+                        data = q.get()
+                        if data is None:
+                            break
+                        if not errors:
+                            try:
+                                outf.write(data)
+                            except Exception as e:
+                                errors.append(e)
+
+                thread = threading.Thread(target=writer, daemon=True)
+                thread.start()
+                try:
+                    for data in chunks():
+                        q.put(data)
+                        if errors:
+                            break
+                finally:
+                    q.put(None)
+                    thread.join()
+                if errors:
+                    raise errors[0]
+            else:
+                for data in chunks():
+                    outf.write(data)
+        finally:
+            if outf is not None:
+                outf.close()
+            if temp_lineages:
+                self.clear_lineages()
+
+    def write_parquet(
+        self,
+        output_file: str,
+        cols: list = [
+            "node",
+            "parent",
+            "rank",
+            "name",
+            "lineage",
+            "rank_lineage",
+            "name_lineage",
+        ],
+        rank_columns: list = None,
+        compression: str = "zstd",
+        overwrite: bool = False,
+    ):
+        """
+        Writes loaded taxonomy to a Parquet file. Columns are the same as in to_arrow(). Requires pyarrow.
+
+        Parameters:
+        * **cols** *[list]*: Options: "node", "parent", "rank", "name", "lineage", "rank_lineage", "name_lineage"
+        * **rank_columns** *[list]*: Ranks to add as columns with the node of that rank on the lineage.
+        * **compression** *[str]*: Parquet compression codec (e.g. "zstd", "snappy", "none").
+        * **overwrite** *[bool]*: Overwrite output file if it exists.
+
+        Example:
+
+            from multitax import GtdbTx
+            tax = GtdbTx()
+            tax.write_parquet("gtdb.parquet", rank_columns=["phylum", "genus"])
+            # duckdb: SELECT genus, count(*) FROM 'gtdb.parquet' WHERE rank = 'species' GROUP BY genus
+
+        Returns: None
+        """
+        import pyarrow.parquet as pq
+
+        if not overwrite:
+            check_no_file(output_file)
+        pq.write_table(
+            self.to_arrow(cols=cols, rank_columns=rank_columns),
+            output_file,
+            compression=compression,
+        )
+
+    def write_taxdump(
+        self,
+        prefix: str,
+        mapping_file: str = None,
+        overwrite: bool = False,
+        chunk: int = 10000,
+    ):
+        """
+        Writes loaded taxonomy in the NCBI taxdump format (nodes.dmp, names.dmp and merged.dmp), e.g. for Kraken2 or taxonkit.
+        If all nodes are numeric and there is no mapping file, nodes are used as taxids.
+        Otherwise, all nodes (numeric ones included) are mapped to integer taxids with a mapping file (node <tab> taxid),
+        created if not existing and extended with new nodes otherwise, keeping taxids stable between versions of a taxonomy.
+        The root node is mapped to taxid 1 (if not yet mapped) and is its own parent. Merged/forwarded nodes (NcbiTx, OttTx) are written to merged.dmp.
+        Every node has a scientific name on names.dmp: nodes without name get undefined_name (or the node itself, if not set).
+        merged.dmp is always written (empty without merged nodes) and can be loaded with NcbiTx(files=[nodes.dmp, names.dmp, merged.dmp]).
+        The directory of prefix is created if it does not exist.
+
+        Parameters:
+        * **prefix** *[str]*: Prefix of the output files (e.g. "gtdb/" for gtdb/nodes.dmp).
+        * **mapping_file** *[str]*: Mapping file (node <tab> taxid). Default: prefix + "taxid.map"
+        * **overwrite** *[bool]*: Overwrite .dmp files if they exist.
+        * **chunk** *[int]*: Number of lines written at once.
+
+        Example:
+
+            from multitax import GtdbTx
+            tax = GtdbTx()
+            tax.write_taxdump("gtdb/")
+            # gtdb/nodes.dmp gtdb/names.dmp gtdb/merged.dmp gtdb/taxid.map
+
+        Returns: dict {node: taxid} (empty if all nodes are numeric)
+        """
+        import os
+        from itertools import chain, islice
+
+        os.makedirs(os.path.dirname(prefix) or ".", exist_ok=True)
+        if mapping_file is None:
+            mapping_file = prefix + "taxid.map"
+        files = [prefix + f for f in ["nodes.dmp", "names.dmp", "merged.dmp"]]
+        if not overwrite:
+            for file in files:
+                check_no_file(file)
+
+        merged = self._merged_nodes()
+        mapping = {}
+        if os.path.isfile(mapping_file) or not all(
+            n.isdigit() for n in chain(self._nodes, merged, merged.values())
+        ):
+            if os.path.isfile(mapping_file):
+                with open(mapping_file, "r") as f:
+                    for line in f:
+                        node, t = line.rstrip("\n").split("\t")
+                        mapping[node] = int(t)
+            loaded = len(mapping)
+            used = set(mapping.values())
+            if self.root_node not in mapping and 1 not in used:
+                mapping[self.root_node] = 1
+                used.add(1)
+            next_taxid = max(used, default=1) + 1
+            parents = (p for n, p in self._nodes.items() if n != self.root_node)
+            for node in chain(self._nodes, parents, merged, merged.values()):
+                if node not in mapping:
+                    mapping[node] = next_taxid
+                    next_taxid += 1
+            # Write (extended) mapping file
+            if len(mapping) > loaded:
+                with open(mapping_file + ".tmp", "w") as f:
+                    f.writelines(n + "\t" + str(t) + "\n" for n, t in mapping.items())
+                os.replace(mapping_file + ".tmp", mapping_file)
+
+        def taxid(node):
+            return str(mapping[node]) if mapping else node
+
+        root = taxid(self.root_node)
+        undefined_rank = self.undefined_rank
+
+        def nodes_line(node):
+            return (
+                taxid(node)
+                + "\t|\t"
+                + (root if node == self.root_node else taxid(self._nodes[node]))
+                + "\t|\t"
+                + str(self._ranks.get(node, undefined_rank) or "no rank")
+                + "\t|\t\t|\n"
+            )
+
+        undefined_name = self.undefined_name
+
+        def names_line(node):
+            # One scientific name per taxid
+            name = self._names.get(node)
+            if name is None:
+                name = undefined_name if undefined_name is not None else node
+            return taxid(node) + "\t|\t" + str(name) + "\t|\t\t|\tscientific name\t|\n"
+
+        def merged_line(node):
+            return taxid(node) + "\t|\t" + taxid(merged[node]) + "\t|\n"
+
+        for file, nodes, line in [
+            (files[0], self._nodes, nodes_line),
+            (files[1], self._nodes, names_line),
+            (files[2], merged, merged_line),
+        ]:
+            nodes = iter(nodes)
+            with open(file, "w") as outf:
+                while True:
+                    batch = list(islice(nodes, chunk))
+                    if not batch:
+                        break
+                    outf.write("".join(map(line, batch)))
 
-        outf.close()
+        return mapping
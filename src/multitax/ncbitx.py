@@ -1,5 +1,5 @@
 from .multitax import MultiTax
-from multitax.utils import filter_function
+from multitax.utils import check_file, filter_function, NgramIndex
 from multitax.utils import open_files
 from multitax.utils import download_files
 import warnings
@@ -11,6 +11,7 @@ class NcbiTx(MultiTax):
     def __init__(self, **kwargs):
         self._merged = {}
         self._extended_name_nodes = {}
+        self._extended_name_ngrams = None
         super().__init__(**kwargs)
 
     def __repr__(self):
@@ -107,6 +108,14 @@ class NcbiTx(MultiTax):
 
         return translated_nodes
 
+    def _check_files(self, files: list):
+        # [merged.dmp] can be empty (e.g. written by write_taxdump() without merged nodes)
+        for i, file in enumerate(files):
+            check_file(file, allow_empty=i == 2)
+
+    def _merged_nodes(self):
+        return self._merged
+
     def _parse(self, fhs, **kwargs):
         fhs_list = list(fhs.values())
         # One element tar.gz -> taxdump.tar.gz
@@ -178,6 +187,17 @@ class NcbiTx(MultiTax):
             merged = self._parse_merged(fh_merged)
         return nodes, ranks, names, merged
 
+    def _search_names(self):
+        return super()._search_names() + [self._extended_name_nodes]
+
+    def _set_merged_nodes(self, merged):
+        self._merged = merged
+
+    def build_ngram_index(self):
+        super().build_ngram_index()
+        if self._extended_name_nodes:
+            self._extended_name_ngrams = NgramIndex(self._extended_name_nodes)
+
     def latest(self, node: str):
         n = super().latest(node)
         if n == self.undefined_node:
@@ -224,7 +244,11 @@ class NcbiTx(MultiTax):
             if exact:
                 ret = self._exact_name(text, self._extended_name_nodes)
             else:
-                ret = self._partial_name(text, self._extended_name_nodes)
+                ret = self._partial_name(
+                    text, self._extended_name_nodes, self._extended_name_ngrams
+                )
+            # Only return nodes on the tree (e.g. views)
+            ret = [r for r in ret if r in self._nodes]
 
             # Only return nodes of chosen rank
             if rank:
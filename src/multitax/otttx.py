@@ -1,5 +1,5 @@
 from .multitax import MultiTax
-from multitax.utils import filter_function
+from multitax.utils import filter_function, NgramIndex
 import warnings
 
 
@@ -10,6 +10,7 @@ class OttTx(MultiTax):
     def __init__(self, **kwargs):
         self._forwards = {}
         self._extended_name_nodes = {}
+        self._extended_name_ngrams = None
         super().__init__(**kwargs)
 
     def __repr__(self):
@@ -26,6 +27,9 @@ class OttTx(MultiTax):
         )
         return {}
 
+    def _merged_nodes(self):
+        return self._forwards
+
     def _parse(self, fhs, **kwargs):
         fhs_list = list(fhs.values())
         if len(fhs_list) == 1 and list(fhs)[0].endswith(".tgz"):
@@ -105,6 +109,17 @@ class OttTx(MultiTax):
             names[taxid] = name
         return nodes, ranks, names
 
+    def _search_names(self):
+        return super()._search_names() + [self._extended_name_nodes]
+
+    def _set_merged_nodes(self, merged):
+        self._forwards = merged
+
+    def build_ngram_index(self):
+        super().build_ngram_index()
+        if self._extended_name_nodes:
+            self._extended_name_ngrams = NgramIndex(self._extended_name_nodes)
+
     def forwards(self, node: str):
         """
         Returns relative entry from the forwards.tsv file of a given node.
@@ -151,7 +166,11 @@ class OttTx(MultiTax):
             if exact:
                 ret = self._exact_name(text, self._extended_name_nodes)
             else:
-                ret = self._partial_name(text, self._extended_name_nodes)
+                ret = self._partial_name(
+                    text, self._extended_name_nodes, self._extended_name_ngrams
+                )
+            # Only return nodes on the tree (e.g. views)
+            ret = [r for r in ret if r in self._nodes]
 
             # Only return nodes of chosen rank
             if rank:
@@ -0,0 +1,457 @@
+import asyncio
+import http.client
+import json
+import socket
+import time
+from collections import deque
+from urllib.parse import parse_qs, urlsplit
+
+
+class TaxClient(object):
+    """
+    Client for a taxonomy served with TaxServer (or "multitax serve").
+    Each function accepts one or many queries and returns one or many results, respectively.
+    A persistent (keep-alive) connection is re-used between calls.
+
+    Example:
+
+        from multitax.server import TaxClient
+        client = TaxClient(port=8080)
+        client.lineage("562", ranks=["genus", "species"])
+        # ['561', '562']
+        client.name(["562", "561"])
+        # ['Escherichia coli', 'Escherichia']
+    """
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 8080,
+        path: str = None,
+        timeout: float = 60,
+    ):
+        """
+        Parameters:
+        * **host** *[str]*: Server host.
+        * **port** *[int]*: Server port.
+        * **path** *[str]*: Unix socket path. If set, host and port are ignored.
+        * **timeout** *[float]*: Timeout in seconds.
+        """
+        if path:
+            self._conn = _UnixConnection(path, timeout=timeout)
+        else:
+            self._conn = http.client.HTTPConnection(host, port, timeout=timeout)
+
+    def _query(self, endpoint: str, q, **options):
+        if endpoint == "lca":
+            # A string would be iterated as characters
+            if isinstance(q, str):
+                raise ValueError(
+                    "lca requires a list of nodes or a list of lists of nodes"
+                )
+            q = list(q)
+            single = bool(q) and all(isinstance(i, str) for i in q)
+            if not single and any(isinstance(i, str) for i in q):
+                raise ValueError(
+                    "lca requires a list of nodes or a list of lists of nodes"
+                )
+            params = {"q": [q] if single else [list(i) for i in q]}
+        else:
+            single = isinstance(q, str)
+            params = {"q": [q] if single else list(q)}
+        if isinstance(options.get("ranks"), str):
+            options["ranks"] = [options["ranks"]]
+        params.update({k: v for k, v in options.items() if v is not None})
+        ret = self._request("POST", "/" + endpoint, params)["results"]
+        return ret[0] if single else ret
+
+    def _request(self, method: str, target: str, params: dict = None):
+        body = json.dumps(params).encode() if params is not None else None
+        headers = {"Content-Type": "application/json"} if body else {}
+        try:
+            self._conn.request(method, target, body=body, headers=headers)
+            resp = self._conn.getresponse()
+        except (ConnectionError, http.client.HTTPException):
+            # Connection closed by the server, retry once
+            self._conn.close()
+            self._conn.request(method, target, body=body, headers=headers)
+            resp = self._conn.getresponse()
+        ret = json.loads(resp.read())
+        if resp.status != 200:
+            raise ValueError(ret.get("error", resp.reason))
+        return ret
+
+    def close(self):
+        """
+        Closes the connection to the server.
+        """
+        self._conn.close()
+
+    def latest(self, q):
+        return self._query("latest", q)
+
+    def lca(self, q):
+        """
+        Returns the LCA of a list of nodes or a list with the LCA of each list of nodes.
+        """
+        return self._query("lca", q)
+
+    def lineage(self, q, root_node: str = None, ranks: list = None):
+        return self._query("lineage", q, root_node=root_node, ranks=ranks)
+
+    def metrics(self):
+        """
+        Returns the per-endpoint metrics of the server. See TaxServer.metrics()
+        """
+        return self._request("GET", "/metrics")
+
+    def name(self, q):
+        return self._query("name", q)
+
+    def name_lineage(self, q, root_node: str = None, ranks: list = None):
+        return self._query("name_lineage", q, root_node=root_node, ranks=ranks)
+
+    def parent(self, q):
+        return self._query("parent", q)
+
+    def rank(self, q):
+        return self._query("rank", q)
+
+    def rank_lineage(self, q, root_node: str = None, ranks: list = None):
+        return self._query("rank_lineage", q, root_node=root_node, ranks=ranks)
+
+    def search(self, q, rank: str = None, exact: bool = True):
+        return self._query("search", q, rank=rank, exact=exact)
+
+    def translate(self, q):
+        return self._query("translate", q)
+
+
+class TaxServer(object):
+    """
+    Asyncio HTTP/JSON server to query a loaded taxonomy.
+
+    Endpoints (GET or POST) receive one or more queries "q" and return {"results": [...]} in the same order:
+    * /lineage, /name_lineage, /rank_lineage: q=node, options root_node and ranks
+    * /name, /rank, /parent, /latest, /translate: q=node
+    * /search: q=text, options rank and exact
+    * /lca: q=list of nodes (comma-separated for GET)
+    * /metrics: per-endpoint counts and latencies (ms)
+
+    Concurrent requests to the same endpoint (with the same options) are micro-batched:
+    queries are collected for batch_window seconds (or until batch_size) and resolved in one bulk lookup,
+    repeated queries within a batch are resolved once.
+
+    Example:
+
+        GET /lineage?q=562&q=561&ranks=genus,species
+        # {"results": [["561", "562"], ["561", null]]} (undefined nodes as null)
+        POST /lca {"q": [["562", "620"], ["562", "561"]]}
+        # {"results": ["543", "561"]}
+    """
+
+    def __init__(
+        self,
+        tax,
+        batch_window: float = 0.001,
+        batch_size: int = 4096,
+        max_samples: int = 10000,
+    ):
+        """
+        Parameters:
+        * **tax** *[MultiTax]*: Loaded taxonomy.
+        * **batch_window** *[float]*: Time in seconds to collect queries into a batch. 0 to resolve on the next loop iteration.
+        * **batch_size** *[int]*: Maximum number of queries in a batch.
+        * **max_samples** *[int]*: Number of latest requests per endpoint used to calculate latency percentiles.
+        """
+        self.tax = tax
+        self.batch_window = batch_window
+        self.batch_size = batch_size
+        self.max_samples = max_samples
+        self._batches = {}
+        self._metrics = {}
+
+        # endpoint: (function, options)
+        self._endpoints = {
+            "latest": (tax.latest, ()),
+            "lca": (None, ()),
+            "lineage": (
+                lambda node, o: tax.lineage(node, **o),
+                ("root_node", "ranks"),
+            ),
+            "name": (tax.name, ()),
+            "name_lineage": (
+                lambda node, o: tax.name_lineage(node, **o),
+                ("root_node", "ranks"),
+            ),
+            "parent": (tax.parent, ()),
+            "rank": (tax.rank, ()),
+            "rank_lineage": (
+                lambda node, o: tax.rank_lineage(node, **o),
+                ("root_node", "ranks"),
+            ),
+            "search": (
+                lambda text, o: tax.search_name(text, **o),
+                ("rank", "exact"),
+            ),
+            "translate": (lambda node: sorted(tax.translate(node)), ()),
+        }
+
+    def _bulk(self, endpoint: str, options: dict, queries: list):
+        if endpoint == "lca":
+            return self.tax.consensus_many(queries, method="lca")
+        function, opts = self._endpoints[endpoint]
+        memo = {}
+        for q in queries:
+            if q not in memo:
+                memo[q] = function(q, options) if opts else function(q)
+        return [memo[q] for q in queries]
+
+    async def _dispatch(self, method: str, target: str, body: bytes):
+        url = urlsplit(target)
+        endpoint = url.path.strip("/")
+        if endpoint == "metrics":
+            return 200, self.metrics()
+        elif endpoint not in self._endpoints:
+            return 404, {
+                "error": "Endpoint ["
+                + endpoint
+                + "] not found. Options: "
+                + ",".join(self._endpoints)
+                + ",metrics"
+            }
+
+        if method == "GET":
+            params = self._parse_query(endpoint, url.query)
+        elif method == "POST":
+            params = json.loads(body) if body else {}
+            if not isinstance(params, dict):
+                raise ValueError("Request body should be a JSON object")
+        else:
+            return 405, {"error": "Method [" + method + "] not allowed"}
+
+        queries = params.pop("q", [])
+        if not isinstance(queries, list) or (
+            endpoint == "lca" and not all(isinstance(q, list) for q in queries)
+        ):
+            raise ValueError("Queries [q] should be a list")
+        if endpoint != "lca":
+            queries = [str(q) for q in queries]
+
+        opts = self._endpoints[endpoint][1]
+        for k in params:
+            if k not in opts:
+                raise ValueError(
+                    "Option [" + k + "] is not valid. Options: " + ",".join(opts)
+                )
+        ranks = params.get("ranks")
+        if ranks is not None and not (
+            isinstance(ranks, list) and all(isinstance(r, str) for r in ranks)
+        ):
+            raise ValueError("Option [ranks] should be a list")
+
+        results = await self._submit(endpoint, params, queries) if queries else []
+        return 200, {"results": results}
+
+    def _flush(self, key):
+        endpoint, options, items, handle = self._batches.pop(key)
+        if handle:
+            handle.cancel()
+        try:
+            results = self._bulk(endpoint, options, [q for _, qs in items for q in qs])
+        except Exception as e:
+            for future, _ in items:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        m = self._metrics.setdefault(endpoint, self._new_metrics())
+        m["batches"] += 1
+        m["queries"] += len(results)
+        start = 0
+        for future, qs in items:
+            if not future.done():
+                future.set_result(results[start : start + len(qs)])
+            start += len(qs)
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                start = time.perf_counter()
+                headers = {}
+                while True:
+                    h = await reader.readline()
+                    if h in (b"\r\n", b"\n", b""):
+                        break
+                    k, _, v = h.decode("latin-1").partition(":")
+                    headers[k.strip().lower()] = v.strip()
+                try:
+                    length = int(headers.get("content-length", 0))
+                    if length < 0:
+                        raise ValueError
+                except ValueError:
+                    # Body cannot be read: answer and close the connection
+                    length = None
+                body = await reader.readexactly(length) if length else b""
+
+                try:
+                    method, target, version = line.decode("latin-1").split()
+                except ValueError:
+                    method, target, version = None, "", "HTTP/1.0"
+                endpoint = urlsplit(target).path.strip("/")
+                try:
+                    if method is None:
+                        raise ValueError("Malformed request line")
+                    if length is None:
+                        raise ValueError("Invalid Content-Length")
+                    status, payload = await self._dispatch(method, target, body)
+                except ValueError as e:
+                    status, payload = 400, {"error": str(e)}
+                except Exception as e:
+                    status, payload = 500, {"error": repr(e)}
+
+                keep_alive = (
+                    length is not None
+                    and version == "HTTP/1.1"
+                    and headers.get("connection", "").lower() != "close"
+                )
+                data = json.dumps(payload).encode()
+                writer.write(
+                    (
+                        "HTTP/1.1 {} {}\r\n"
+                        "Content-Type: application/json\r\n"
+                        "Content-Length: {}\r\n"
+                        "Connection: {}\r\n\r\n"
+                    )
+                    .format(
+                        status,
+                        http.client.responses.get(status, ""),
+                        len(data),
+                        "keep-alive" if keep_alive else "close",
+                    )
+                    .encode("latin-1")
+                    + data
+                )
+                await writer.drain()
+
+                if endpoint in self._endpoints:
+                    m = self._metrics.setdefault(endpoint, self._new_metrics())
+                    m["requests"] += 1
+                    if status != 200:
+                        m["errors"] += 1
+                    m["latencies"].append((time.perf_counter() - start) * 1000)
+
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    def _new_metrics(self):
+        return {
+            "requests": 0,
+            "errors": 0,
+            "queries": 0,
+            "batches": 0,
+            "latencies": deque(maxlen=self.max_samples),
+        }
+
+    def _parse_query(self, endpoint: str, query: str):
+        params = {}
+        for k, v in parse_qs(query, keep_blank_values=True).items():
+            if k == "q":
+                params[k] = [q.split(",") for q in v] if endpoint == "lca" else v
+            elif k == "ranks":
+                params[k] = ",".join(v).split(",")
+            elif k == "exact":
+                params[k] = v[-1].lower() not in ("0", "false", "no")
+            else:
+                params[k] = v[-1]
+        return params
+
+    async def _submit(self, endpoint: str, options: dict, queries: list):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        key = (endpoint, json.dumps(options, sort_keys=True))
+        if key not in self._batches:
+            self._batches[key] = (endpoint, options, [], None)
+        items = self._batches[key][2]
+        items.append((future, queries))
+        if sum(len(qs) for _, qs in items) >= self.batch_size:
+            self._flush(key)
+        elif self._batches[key][3] is None:
+            self._batches[key] = (
+                endpoint,
+                options,
+                items,
+                loop.call_later(self.batch_window, self._flush, key),
+            )
+        return await future
+
+    def metrics(self):
+        """
+        Returns per-endpoint metrics: number of requests, errors, queries and batches, mean batch size and
+        latencies in ms (mean, p50, p95, p99, max) of the latest max_samples requests.
+
+        Returns: dict
+        """
+        ret = {}
+        for endpoint, m in sorted(self._metrics.items()):
+            lat = sorted(m["latencies"])
+            ret[endpoint] = {
+                "requests": m["requests"],
+                "errors": m["errors"],
+                "queries": m["queries"],
+                "batches": m["batches"],
+                "mean_batch_size": m["queries"] / m["batches"] if m["batches"] else 0,
+                "latency_ms": {
+                    "mean": sum(lat) / len(lat) if lat else 0,
+                    "p50": lat[int(0.50 * (len(lat) - 1))] if lat else 0,
+                    "p95": lat[int(0.95 * (len(lat) - 1))] if lat else 0,
+                    "p99": lat[int(0.99 * (len(lat) - 1))] if lat else 0,
+                    "max": lat[-1] if lat else 0,
+                },
+            }
+        return ret
+
+    def serve(self, host: str = "127.0.0.1", port: int = 8080, path: str = None):
+        """
+        Runs the server until interrupted. Listens on host:port or on a Unix socket (path).
+
+        Returns: None
+        """
+
+        async def run():
+            server = await self.start(host=host, port=port, path=path)
+            async with server:
+                await server.serve_forever()
+
+        try:
+            asyncio.run(run())
+        except KeyboardInterrupt:
+            pass
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8080, path: str = None):
+        """
+        Starts the server on the running event loop. Listens on host:port or on a Unix socket (path).
+
+        Returns: asyncio.Server
+        """
+        if path:
+            return await asyncio.start_unix_server(self._handle, path=path)
+        else:
+            return await asyncio.start_server(self._handle, host=host, port=port)
+
+
+class _UnixConnection(http.client.HTTPConnection):
+    def __init__(self, path: str, timeout: float = 60):
+        super().__init__("localhost", timeout=timeout)
+        self._path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self._path)
@@ -5,7 +5,10 @@ import tarfile
 import urllib.request
 import zlib
 import warnings
+from array import array
+from bisect import bisect_left, bisect_right
 from collections import OrderedDict
+from collections.abc import Mapping, Sequence
 from urllib.error import HTTPError
 
 
@@ -15,10 +18,10 @@ def check_dir(prefix: str):
         raise NotADirectoryError(abs_path)
 
 
-def check_file(file: str):
+def check_file(file: str, allow_empty: bool = False):
     if not os.path.isfile(file):
         raise FileNotFoundError(file + " file do not exist")
-    if os.path.getsize(file) == 0:
+    if not allow_empty and os.path.getsize(file) == 0:
         raise FileNotFoundError(file + " file is empty")
 
 
@@ -88,10 +91,89 @@ def download_files(urls: list, output_prefix: str = None, retry_attempts: int =
     raise Exception("One or more files could not be downloaded: " + ", ".join(urls))
 
 
+def edit_distance(a: str, b: str, max_distance: int = None):
+    """
+    Levenshtein distance between two strings.
+    If max_distance is provided, stops early and returns max_distance + 1 once it is exceeded.
+    """
+    if len(a) < len(b):
+        a, b = b, a
+    row = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        prev, row[0] = row[0], i
+        for j, cb in enumerate(b, 1):
+            prev, row[j] = row[j], min(row[j] + 1, row[j - 1] + 1, prev + (ca != cb))
+        if max_distance is not None and min(row) > max_distance:
+            return max_distance + 1
+    return row[-1]
+
+
 def filter_function(elements, function, value):
     return [elements[i] for i, v in enumerate(map(function, elements)) if v == value]
 
 
+class IntervalMask(object):
+    """
+    Membership of nodes on a restricted tree, based on pre-order intervals of the full tree.
+    A node is a member if it is on the subtree of root, on any kept subtree (or is an ancestor of a kept node)
+    and not a descendant of any pruned node. Nodes without interval are not members.
+    """
+
+    def __init__(
+        self,
+        intervals: dict,
+        root: str,
+        keep: list = None,
+        keep_ancestors: set = None,
+        prune: list = None,
+    ):
+        """
+        Parameters:
+        * **intervals** *[dict]*: node,(pre-order position, last pre-order position of subtree, depth) of the full tree.
+        * **root** *[str]*: Root node of the restricted tree.
+        * **keep** *[list]*: Nodes with subtrees to be kept.
+        * **keep_ancestors** *[set]*: Ancestors of kept nodes (up to root).
+        * **prune** *[list]*: Nodes with descendants to be removed (nodes are kept).
+        """
+        self._intervals = intervals
+        self._root = intervals[root]
+        self._keep_ancestors = keep_ancestors if keep_ancestors else set()
+        self._keep_starts, self._keep_ends = self._merge(keep, intervals)
+        self._prune_starts, self._prune_ends = self._merge(prune, intervals)
+        self._keep = keep is not None
+
+    def __contains__(self, node):
+        interval = self._intervals.get(node)
+        if interval is None:
+            return False
+        pre = interval[0]
+        if pre < self._root[0] or pre > self._root[1]:
+            return False
+        if self._keep and node not in self._keep_ancestors:
+            # Last kept interval starting at or before node
+            i = bisect_right(self._keep_starts, pre) - 1
+            if i < 0 or pre > self._keep_ends[i]:
+                return False
+        if self._prune_starts:
+            # Last pruned interval starting strictly before node (pruned nodes are kept)
+            i = bisect_left(self._prune_starts, pre) - 1
+            if i >= 0 and pre <= self._prune_ends[i]:
+                return False
+        return True
+
+    def _merge(self, nodes, intervals):
+        """
+        Returns sorted starts and ends of intervals of nodes, skipping nested ones
+        """
+        starts = []
+        ends = []
+        for pre, last, _ in sorted(intervals[n] for n in nodes or []):
+            if not ends or pre > ends[-1]:
+                starts.append(pre)
+                ends.append(last)
+        return starts, ends
+
+
 def join_check(elements, sep: str):
     if elements:
         return sep.join(map(str, elements))
@@ -99,6 +181,83 @@ def join_check(elements, sep: str):
         return ""
 
 
+class Lineage(Sequence):
+    """
+    Immutable lineage (root to node) sharing its prefix with the lineage of the parent node.
+    Stored lineages are views over the same chain of ancestors instead of independent lists.
+    Behaves like a read-only list: indexing, slicing (returns list), iteration, len and comparison to lists.
+    """
+
+    __slots__ = ("_node", "_prefix", "_len")
+
+    def __init__(self, node: str = None, prefix=None):
+        self._node = node
+        self._prefix = prefix
+        if prefix is not None:
+            self._len = prefix._len + 1
+        else:
+            self._len = 0 if node is None else 1
+
+    def __add__(self, other):
+        return self.tolist() + list(other)
+
+    def __contains__(self, node):
+        lin = self
+        while lin is not None and lin._len:
+            if lin._node == node:
+                return True
+            lin = lin._prefix
+        return False
+
+    def __eq__(self, other):
+        if isinstance(other, (Lineage, list, tuple)):
+            return self._len == len(other) and self.tolist() == list(other)
+        return NotImplemented
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return self.tolist()[i]
+        if i < 0:
+            i += self._len
+        if i < 0 or i >= self._len:
+            raise IndexError("Lineage index out of range")
+        lin = self
+        for _ in range(self._len - 1 - i):
+            lin = lin._prefix
+        return lin._node
+
+    __hash__ = None
+
+    def __iter__(self):
+        return iter(self.tolist())
+
+    def __len__(self):
+        return self._len
+
+    def __repr__(self):
+        return repr(self.tolist())
+
+    def __radd__(self, other):
+        return list(other) + self.tolist()
+
+    def __reversed__(self):
+        lin = self
+        while lin is not None and lin._len:
+            yield lin._node
+            lin = lin._prefix
+
+    def tolist(self):
+        """
+        Returns lineage as a new list (root to node).
+        """
+        lin = [None] * self._len
+        node = self
+        for i in range(self._len - 1, -1, -1):
+            lin[i] = node._node
+            node = node._prefix
+        return lin
+
+
 def load_url_mem(url: str):
     """
     Parameters:
@@ -120,6 +279,178 @@ def load_url_mem(url: str):
     return tmpfile
 
 
+class MaskedMapping(Mapping):
+    """
+    Read-only view of a dict restricted to keys in a mask (any object supporting `in`, e.g. a set or IntervalMask).
+    Values can be overridden for some keys. The underlying dict is not copied.
+    """
+
+    __slots__ = ("_data", "_mask", "_overrides", "_len")
+
+    def __init__(self, data, mask, overrides: dict = None):
+        """
+        Parameters:
+        * **data** *[dict]*: Underlying dict (or mapping).
+        * **mask** *[object]*: Keys allowed on the view.
+        * **overrides** *[dict]*: key,value replacing values of data for keys on the view.
+        """
+        self._data = data
+        self._mask = mask
+        self._overrides = overrides if overrides else {}
+        self._len = None
+
+    def __contains__(self, key):
+        return key in self._data and key in self._mask
+
+    def __getitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        if key in self._overrides:
+            return self._overrides[key]
+        return self._data[key]
+
+    def __iter__(self):
+        for key in self._data:
+            if key in self._mask:
+                yield key
+
+    def __len__(self):
+        # Counted on first use
+        if self._len is None:
+            self._len = sum(1 for _ in self)
+        return self._len
+
+
+class NgramIndex(object):
+    """
+    Index of names by their n-grams (default: trigrams) for partial (substring) search.
+    Candidate names share all n-grams of the searched text and are verified before returning.
+    """
+
+    def __init__(self, names, n: int = 3):
+        """
+        Parameters:
+        * **names** *[iterable]*: Names to be indexed (e.g. keys of a name,nodes dict).
+        * **n** *[int]*: Length of the n-grams.
+        """
+        self.n = n
+        self._names = []
+        self._ngrams = {}
+        for name in names:
+            self.add(name)
+
+    def _key(self, name: str):
+        return name
+
+    def _split(self, text: str):
+        return {text[i : i + self.n] for i in range(len(text) - self.n + 1)}
+
+    def add(self, name: str):
+        """
+        Adds a name to the index. Undefined (None) names are not indexed.
+        """
+        if name is None:
+            return
+        idx = len(self._names)
+        self._names.append(name)
+        for ngram in self._split(self._key(name)):
+            if ngram not in self._ngrams:
+                self._ngrams[ngram] = array("L")
+            self._ngrams[ngram].append(idx)
+
+    def search(self, text: str):
+        """
+        Returns list of indexed names containing the text (case sensitive).
+        """
+        if len(text) < self.n:
+            # Text too short to use the index
+            return [name for name in self._names if text in name]
+
+        postings = []
+        for ngram in self._split(text):
+            if ngram not in self._ngrams:
+                return []
+            postings.append(self._ngrams[ngram])
+
+        # Intersect from the shortest posting list
+        postings.sort(key=len)
+        candidates = set(postings[0])
+        for p in postings[1:]:
+            candidates.intersection_update(p)
+            if not candidates:
+                return []
+
+        return [self._names[i] for i in sorted(candidates) if text in self._names[i]]
+
+
+class FuzzyIndex(NgramIndex):
+    """
+    Index of case-insensitive and padded n-grams for approximate (edit distance) search.
+    Candidates are collected from the rarest n-grams of the searched text (count filter),
+    filtered by length and verified with a bounded edit distance.
+    Short texts, where a match may share less than 2 n-grams with the text, are compared
+    to names of similar length only (length buckets) instead of the n-gram postings.
+    """
+
+    def __init__(self, names, n: int = 3):
+        """
+        Parameters:
+        * **names** *[iterable]*: Names to be indexed (e.g. keys of a name,nodes dict).
+        * **n** *[int]*: Length of the n-grams.
+        """
+        # Indices of names by length (case insensitive)
+        self._lengths = {}
+        super().__init__(names, n=n)
+
+    def _key(self, name: str):
+        pad = "\x00" * (self.n - 1)
+        return pad + name.casefold() + pad
+
+    def add(self, name: str):
+        """
+        Adds a name to the index. Undefined (None) names are not indexed.
+        """
+        if name is None:
+            return
+        super().add(name)
+        self._lengths.setdefault(len(name.casefold()), array("L")).append(
+            len(self._names) - 1
+        )
+
+    def search(self, text: str, max_distance: int = 2):
+        """
+        Returns list of tuples (name, distance) of indexed names within max_distance edits of text (case insensitive), sorted by distance.
+        """
+        text_key = text.casefold()
+        grams = self._split(self._key(text))
+        # Each edit changes at most n n-grams: a match shares at least min_shared of them
+        min_shared = len(grams) - max_distance * self.n
+        if min_shared >= 2:
+            # A match should be in at least one of the (len(grams) - min_shared + 1) rarest posting lists
+            postings = sorted(
+                (self._ngrams[g] for g in grams if g in self._ngrams), key=len
+            )
+            candidates = set()
+            for p in postings[: len(grams) - min_shared + 1]:
+                candidates.update(p)
+        else:
+            # Count filter would take (almost) any name sharing a n-gram, use length buckets
+            candidates = set()
+            for length in range(
+                len(text_key) - max_distance, len(text_key) + max_distance + 1
+            ):
+                candidates.update(self._lengths.get(length, []))
+
+        ret = []
+        for i in candidates:
+            name = self._names[i].casefold()
+            if abs(len(name) - len(text_key)) <= max_distance:
+                d = edit_distance(text_key, name, max_distance)
+                if d <= max_distance:
+                    ret.append((self._names[i], d))
+        return sorted(ret, key=lambda x: (x[1], x[0]))
+
+
 def open_files(files: list):
     """
     Parameters:
@@ -140,6 +471,72 @@ def open_files(files: list):
     return fhs
 
 
+class PrefixIndex(object):
+    """
+    Sorted index of names for prefix search (autocomplete).
+    Merges several name,nodes dicts and optionally ignores case.
+    """
+
+    def __init__(self, names_list: list, case_sensitive: bool = False):
+        """
+        Parameters:
+        * **names_list** *[list]*: List of dicts {name: [nodes]} to be indexed.
+        * **case_sensitive** *[bool]*: Keep case of names.
+        """
+        self.case_sensitive = case_sensitive
+        entries = {}
+        for names in names_list:
+            for name, nodes in names.items():
+                if name is None:
+                    continue
+                key = self._key(name)
+                if key not in entries:
+                    entries[key] = []
+                entries[key].extend(nodes)
+        self._keys = sorted(entries)
+        self._nodes = [entries[k] for k in self._keys]
+
+    def _key(self, name: str):
+        return name if self.case_sensitive else name.casefold()
+
+    def add(self, name: str, node: str):
+        """
+        Adds a node with a certain name to the index, keeping names sorted.
+        """
+        if name is None:
+            return
+        key = self._key(name)
+        i = bisect_left(self._keys, key)
+        if i == len(self._keys) or self._keys[i] != key:
+            self._keys.insert(i, key)
+            self._nodes.insert(i, [])
+        self._nodes[i].append(node)
+
+    def remove(self, name: str, node: str):
+        """
+        Removes a node with a certain name from the index, if present.
+        """
+        if name is None:
+            return
+        key = self._key(name)
+        i = bisect_left(self._keys, key)
+        if i < len(self._keys) and self._keys[i] == key and node in self._nodes[i]:
+            self._nodes[i].remove(node)
+            if not self._nodes[i]:
+                del self._keys[i]
+                del self._nodes[i]
+
+    def search(self, prefix: str):
+        """
+        Generator of node lists of names starting with prefix, in sorted order of names.
+        """
+        prefix = self._key(prefix)
+        i = bisect_left(self._keys, prefix)
+        while i < len(self._keys) and self._keys[i].startswith(prefix):
+            yield self._nodes[i]
+            i += 1
+
+
 def reverse_dict(d: dict):
     rd = {}
     for k, v in d.items():
@@ -170,6 +567,307 @@ def save_urls(urls: list, output_prefix: str):
     return files
 
 
+class SharedBlock(object):
+    """
+    Attached shared memory block with arrays as memoryviews.
+    Views are released before closing the block (otherwise closing fails while views exist).
+    """
+
+    def __init__(self, shm):
+        """
+        Parameters:
+        * **shm** *[multiprocessing.shared_memory.SharedMemory]*: Attached block.
+        """
+        self.shm = shm
+        self._views = []
+
+    def __del__(self):
+        self.close()
+
+    def close(self):
+        """
+        Releases views and closes the block (views cannot be used afterwards).
+        """
+        for v in self._views:
+            v.release()
+        self._views = []
+        self.shm.close()
+
+    def view(self, start: int, nbytes: int, typecode: str):
+        """
+        Returns memoryview of nbytes from start, cast to typecode.
+        """
+        v = self.shm.buf[start : start + nbytes].cast(typecode)
+        self._views.append(v)
+        return v
+
+
+class SharedMapping(Mapping):
+    """
+    Read-only mapping of string keys to values stored on flat arrays (e.g. shared memory), without copying them.
+    Keys are found with an open addressing hash table (crc32, stable across processes). Values can be:
+    strings (index of value on strings or keys, -1 for no value, -2 for None), tuples of ints (tuple of arrays,
+    negative first value for no value) or lists of keys (tuple of offsets and key indices, lists=True).
+    """
+
+    __slots__ = (
+        "_keys",
+        "_table",
+        "_values",
+        "_strings",
+        "_default",
+        "_lists",
+        "_last",
+        "_len",
+    )
+
+    def __init__(
+        self,
+        keys,
+        table,
+        values,
+        strings=None,
+        default=None,
+        lists: bool = False,
+    ):
+        """
+        Parameters:
+        * **keys** *[SharedStrings]*: Keys by index.
+        * **table** *[array]*: Hash table of keys (see `SharedMapping.hash_table`).
+        * **values** *[array, tuple]*: Values of each key by index.
+        * **strings** *[SharedStrings]*: Table of string values. Default: keys.
+        * **default** *[str]*: Value of keys without value (otherwise not on the mapping).
+        * **lists** *[bool]*: Values are lists of keys (offsets, key indices).
+        """
+        self._keys = keys
+        self._table = table
+        self._values = values
+        self._strings = strings if strings is not None else keys
+        self._default = default
+        self._lists = lists
+        # Last key found and its index (e.g. `in` followed by `[]`)
+        self._last = (None, -1)
+        # Number of keys with values (read-only, counted on first use)
+        self._len = None
+
+    def __contains__(self, key):
+        i = self._find(key)
+        return i >= 0 and self._has_value(i)
+
+    def __getitem__(self, key):
+        i = self._find(key)
+        if i < 0 or not self._has_value(i):
+            raise KeyError(key)
+        if self._lists:
+            offsets, idx = self._values
+            return [self._keys[idx[j]] for j in range(offsets[i], offsets[i + 1])]
+        elif isinstance(self._values, tuple):
+            return tuple(v[i] for v in self._values)
+        elif self._values[i] == -1:
+            return self._default
+        elif self._values[i] == -2:
+            return None
+        else:
+            return self._strings[self._values[i]]
+
+    def __iter__(self):
+        for i in range(len(self._keys)):
+            if self._has_value(i):
+                yield self._keys[i]
+
+    def __len__(self):
+        # Also used by truth tests (e.g. setup on first use) on every query
+        if self._len is None:
+            if self._default is not None:
+                self._len = len(self._keys)
+            else:
+                self._len = sum(1 for i in range(len(self._keys)) if self._has_value(i))
+        return self._len
+
+    def _find(self, key):
+        """
+        Returns index of key or -1
+        """
+        last = self._last
+        if last[0] == key:
+            return last[1]
+        if not isinstance(key, str):
+            return -1
+        encoded = key.encode()
+        mask = len(self._table) - 1
+        h = zlib.crc32(encoded) & mask
+        while self._table[h]:
+            i = self._table[h] - 1
+            if self._keys.encoded(i) == encoded:
+                self._last = (key, i)
+                return i
+            h = (h + 1) & mask
+        return -1
+
+    def _has_value(self, i):
+        if self._lists:
+            return self._values[0][i + 1] > self._values[0][i]
+        elif isinstance(self._values, tuple):
+            return self._values[0][i] >= 0
+        else:
+            return self._values[i] != -1 or self._default is not None
+
+    @staticmethod
+    def hash_table(keys: list):
+        """
+        Returns open addressing hash table (array of key index + 1, 0 for empty) of unique keys, with at least twice their size (power of 2).
+        """
+        size = 1
+        while size < 2 * len(keys):
+            size *= 2
+        mask = size - 1
+        table = array("q", bytes(8 * size))
+        for i, key in enumerate(keys):
+            h = zlib.crc32(key.encode()) & mask
+            while table[h]:
+                h = (h + 1) & mask
+            table[h] = i + 1
+        return table
+
+
+class SharedStrings(Sequence):
+    """
+    Read-only sequence of strings stored on flat buffers (offsets and utf-8 encoded data), e.g. shared memory.
+    """
+
+    __slots__ = ("_offsets", "_data")
+
+    def __init__(self, offsets, data):
+        """
+        Parameters:
+        * **offsets** *[array]*: Start of each string on data (plus end of last string).
+        * **data** *[bytes-like]*: Concatenated encoded strings.
+        """
+        self._offsets = offsets
+        self._data = data
+
+    def __getitem__(self, i):
+        return str(self._data[self._offsets[i] : self._offsets[i + 1]], "utf-8")
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def encoded(self, i):
+        """
+        Returns encoded string (bytes-like) of position i.
+        """
+        return self._data[self._offsets[i] : self._offsets[i + 1]]
+
+    @staticmethod
+    def pack(strings: list):
+        """
+        Returns offsets (array) and data (bytes) of a list of strings.
+        """
+        offsets = array("q", [0])
+        data = bytearray()
+        for string in strings:
+            data += string.encode()
+            offsets.append(len(data))
+        return offsets, bytes(data)
+
+
+class SqliteMapping(Mapping):
+    """
+    Read-only mapping of keys to values queried from a SQLite database, with a LRU cache of recently used keys.
+    Queries use named parameters (:key for the key, plus fixed params). Values can be the first column of the
+    first row or lists of the first column of all rows (lists=True). Keys without rows are not on the mapping.
+    """
+
+    __slots__ = (
+        "_con",
+        "_get",
+        "_keys",
+        "_count",
+        "_lists",
+        "_params",
+        "_cache",
+        "_size",
+        "_len",
+    )
+
+    _missing = object()
+
+    def __init__(
+        self,
+        con,
+        get: str,
+        keys: str,
+        count: str,
+        lists: bool = False,
+        params: dict = None,
+        cache: int = 10000,
+    ):
+        """
+        Parameters:
+        * **con** *[sqlite3.Connection]*: Connection to the database.
+        * **get** *[str]*: Query of values of a :key.
+        * **keys** *[str]*: Query of all keys.
+        * **count** *[str]*: Query of the number of keys.
+        * **lists** *[bool]*: Values are lists of all rows.
+        * **params** *[dict]*: Fixed parameters of the queries.
+        * **cache** *[int]*: Number of keys (and their values) kept in memory.
+        """
+        self._con = con
+        self._get = get
+        self._keys = keys
+        self._count = count
+        self._lists = lists
+        self._params = params if params else {}
+        self._cache = OrderedDict()
+        self._size = cache
+        self._len = None
+
+    def __contains__(self, key):
+        return self._value(key) is not self._missing
+
+    def __getitem__(self, key):
+        value = self._value(key)
+        if value is self._missing:
+            raise KeyError(key)
+        return value
+
+    def __iter__(self):
+        for row in self._con.execute(self._keys, self._params):
+            yield row[0]
+
+    def __len__(self):
+        if self._len is None:
+            self._len = self._con.execute(self._count, self._params).fetchone()[0]
+        return self._len
+
+    def _value(self, key):
+        """
+        Returns value of key (cached) or _missing
+        """
+        cache = self._cache
+        try:
+            value = cache[key]
+            cache.move_to_end(key)
+            return value
+        except KeyError:
+            pass
+        if not isinstance(key, str):
+            return self._missing
+        rows = self._con.execute(self._get, {**self._params, "key": key}).fetchall()
+        if self._lists:
+            value = [row[0] for row in rows] if rows else self._missing
+        else:
+            value = rows[0][0] if rows else self._missing
+        cache[key] = value
+        if len(cache) > self._size:
+            try:
+                cache.popitem(last=False)
+            except KeyError:
+                # Evicted concurrently
+                pass
+        return value
+
+
 def warning_on_one_line(message, category, filename, lineno, file=None, line=None):
     return "%s:%s: %s: %s\n" % (filename, lineno, category.__name__, message)
 
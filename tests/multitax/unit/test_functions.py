@@ -1,6 +1,8 @@
-from multitax.utils import check_file
+from multitax.utils import check_file, reverse_dict
 from multitax import *
 from tests.multitax.utils import setup_dir
+import json
+import os
 import unittest
 
 
@@ -58,6 +60,11 @@ class TestFunctions(unittest.TestCase):
         self.assertCountEqual(tax.search_name("Node1", exact=False), ["1"])
         self.assertCountEqual(tax.search_name("NotThere", exact=False), [])
 
+        # Undefined (None) names are skipped, without index
+        tax.add("5.3", "4.4")
+        self.assertEqual(tax.name("5.3"), None)
+        self.assertCountEqual(tax.search_name("Node5", exact=False), ["5.1", "5.2"])
+
         # Changing root name
         tax = CustomTx(files=self.test_file, root_name="AnotherRootName")
         self.assertCountEqual(tax.search_name("Node1", exact=False), [])
@@ -80,6 +87,94 @@ class TestFunctions(unittest.TestCase):
         self.assertCountEqual(tax.search_name(
             "Node5", exact=False, rank="rank-XXX"), [])
 
+    def test_build_ngram_index(self):
+        """
+        test build_ngram_index function (partial search_name)
+        """
+        tax = CustomTx(files=self.test_file)
+        self.assertIsNone(tax._name_ngrams)
+        tax.build_ngram_index()
+        self.assertIsNotNone(tax._name_ngrams)
+        self.assertCountEqual(tax.search_name(
+            "Node2", exact=False), ["2.1", "2.2"])
+        self.assertCountEqual(tax.search_name("ode4.", exact=False), [
+                              "4.1", "4.2", "4.3", "4.4", "4.5", "4.6"])
+        # Short text (smaller than n-gram)
+        self.assertCountEqual(tax.search_name(".2", exact=False), [
+                              "2.2", "3.2", "4.2", "5.2"])
+        self.assertCountEqual(tax.search_name("NotThere", exact=False), [])
+        self.assertCountEqual(tax.search_name(
+            "Node", exact=False, rank="rank-5"), ["5.1", "5.2"])
+        # Exact search not affected
+        self.assertCountEqual(tax.search_name("Node2.1"), ["2.1"])
+
+        # Index is updated when tree changes
+        tax.add("5.3", "4.4", name="Node5.3")
+        self.assertIsNotNone(tax._name_ngrams)
+        self.assertCountEqual(tax.search_name(
+            "Node5", exact=False), ["5.1", "5.2", "5.3"])
+        tax.remove("5.1")
+        self.assertCountEqual(tax.search_name(
+            "Node5", exact=False), ["5.2", "5.3"])
+
+    def test_search_prefix(self):
+        """
+        test search_prefix function
+        """
+        tax = CustomTx(files=self.test_file)
+        self.assertEqual(tax.search_prefix("Node4"), [
+                         "4.1", "4.2", "4.3", "4.4", "4.5", "4.6"])
+        self.assertEqual(tax.search_prefix("node4", limit=2), ["4.1", "4.2"])
+        self.assertEqual(tax.search_prefix("node4", case_sensitive=True), [])
+        self.assertEqual(tax.search_prefix("NODE2.", rank="rank-2"), [
+                         "2.1", "2.2"])
+        self.assertEqual(tax.search_prefix("Node2.", rank="rank-3"), [])
+        self.assertEqual(tax.search_prefix("XXX"), [])
+        self.assertEqual(tax.search_prefix("Node", order="depth", limit=3), [
+                         "1", "2.1", "2.2"])
+        self.assertEqual(tax.search_prefix("Node4", order="size", limit=2), [
+                         "4.4", "4.1"])
+        with self.assertRaises(ValueError):
+            tax.search_prefix("Node", order="XXX")
+
+        # Extended names
+        tax = OttTx(files="tests/multitax/data_minimal/ott.tgz",
+                    extended_names=True)
+        self.assertCountEqual(tax.search_prefix("haemophilus sp. hk"), [
+                              "525972"])
+        self.assertCountEqual(tax.search_prefix("Haemophilus sp. CCUG 2"), [
+                              "788108"])
+
+    def test_search_name_fuzzy(self):
+        """
+        test search_name_fuzzy function
+        """
+        tax = CustomTx(files=self.test_file)
+        self.assertEqual(tax.search_name_fuzzy("Node4.4", max_distance=0), [
+                         "4.4"])
+        self.assertEqual(tax.search_name_fuzzy("nod4.4", max_distance=1), [
+                         "4.4"])
+        self.assertEqual(tax.search_name_fuzzy("Nod4.4", max_distance=2)[0],
+                         "4.4")
+        self.assertCountEqual(tax.search_name_fuzzy("Node5.9", max_distance=1), [
+                              "5.1", "5.2"])
+        self.assertCountEqual(tax.search_name_fuzzy(
+            "Node4.9", max_distance=1, rank="rank-5"), [])
+        self.assertEqual(tax.search_name_fuzzy("XXXXXXXX"), [])
+
+        # Short texts are compared by length (may share no n-gram)
+        from multitax.utils import FuzzyIndex
+        index = FuzzyIndex(["ab", "xy", "abcdef", None])
+        self.assertEqual(index.search("ay", max_distance=1), [("ab", 1), ("xy", 1)])
+        self.assertEqual(index.search("abcdeg", max_distance=1), [("abcdef", 1)])
+
+        # Extended names
+        tax = OttTx(files="tests/multitax/data_minimal/ott.tgz",
+                    extended_names=True)
+        self.assertEqual(tax.search_name_fuzzy("Haemofilus"), ["470454"])
+        self.assertEqual(tax.search_name_fuzzy(
+            "haemophilus sp HK 85", max_distance=1), ["525972"])
+
     def test_nodes_rank(self):
         """
         test nodes_rank function
@@ -153,6 +248,59 @@ class TestFunctions(unittest.TestCase):
         self.assertCountEqual(tax.leaves("5.1"), ["5.1"])
         self.assertCountEqual(tax.leaves("999.999"), [])
 
+    def test_iter_subtree(self):
+        """
+        test iter_subtree function
+        """
+        tax = CustomTx(files=self.test_file)
+        self.assertEqual(list(tax.iter_subtree("2.2")), [
+                         "2.2", "3.4", "4.4", "5.1", "5.2", "4.5"])
+        self.assertEqual(list(tax.iter_subtree("2.2", order="post")), [
+                         "5.1", "5.2", "4.4", "3.4", "4.5", "2.2"])
+        self.assertEqual(list(tax.iter_subtree("2.2", order="bfs")), [
+                         "2.2", "3.4", "4.5", "4.4", "5.1", "5.2"])
+        self.assertCountEqual(list(tax.iter_subtree()), list(tax._nodes))
+        self.assertEqual(list(tax.iter_subtree("5.1")), ["5.1"])
+        self.assertEqual(list(tax.iter_subtree("XXX")), [])
+
+        # max_depth and ranks
+        self.assertEqual(list(tax.iter_subtree(max_depth=1)), [
+                         "1", "2.1", "2.2", "4.6"])
+        self.assertEqual(list(tax.iter_subtree("2.2", order="post", max_depth=1)), [
+                         "3.4", "4.5", "2.2"])
+        self.assertEqual(list(tax.iter_subtree(order="bfs", max_depth=0)), ["1"])
+        self.assertEqual(list(tax.iter_subtree(ranks=["rank-5", "rank-2"])), [
+                         "2.1", "2.2", "5.1", "5.2"])
+        self.assertEqual(list(tax.iter_subtree("2.1", max_depth=1, ranks=["rank-4"])), [])
+
+        # Lazy: early termination
+        it = tax.iter_subtree()
+        self.assertEqual(next(it), "1")
+        self.assertEqual(next(it), "2.1")
+
+        with self.assertRaises(ValueError):
+            list(tax.iter_subtree(order="XXX"))
+
+    def test_iter_lineages(self):
+        """
+        test iter_lineages function
+        """
+        tax = CustomTx(files=self.test_file)
+        lineages = dict(tax.iter_lineages())
+        self.assertEqual(len(lineages), 14)
+        for node, lin in lineages.items():
+            self.assertEqual(lin, tax.lineage(node))
+
+        self.assertEqual(list(tax.iter_lineages(["5.2", "XXX"])), [
+                         ("5.2", ["1", "2.2", "3.4", "4.4", "5.2"]), ("XXX", [])])
+        self.assertEqual(list(tax.iter_lineages("4.2", ranks=["rank-2"])), [
+                         ("4.2", ["2.1"])])
+        self.assertEqual(dict(tax.iter_lineages(root_node="4.4")), {
+                         "4.4": ["4.4"], "5.1": ["4.4", "5.1"], "5.2": ["4.4", "5.2"]})
+        self.assertEqual(dict(tax.iter_lineages(root_node="4.4", ranks=["rank-5"])), {
+                         "4.4": [tax.undefined_node], "5.1": ["5.1"], "5.2": ["5.2"]})
+        self.assertEqual(list(tax.iter_lineages(root_node="XXX")), [])
+
     def test_lineage(self):
         """
         test lineage function
@@ -323,6 +471,116 @@ class TestFunctions(unittest.TestCase):
             "3.4", ["X", "Y", "Z"]), tax.undefined_node)
         self.assertEqual(tax.closest_parent("3.4", []), "3.4")
 
+    def test_distance(self):
+        """
+        test distance function
+        """
+        tax = CustomTx(files=self.test_file)
+        self.assertEqual(tax.distance("5.2", "5.1"), 2)
+        self.assertEqual(tax.distance("5.2", "4.5"), 4)
+        self.assertEqual(tax.distance("5.2", "4.1"), 7)
+        self.assertEqual(tax.distance("5.2", "2.2"), 3)
+        self.assertEqual(tax.distance("4.6", "4.6"), 0)
+        self.assertEqual(tax.distance("5.2", "XXX"), None)
+        self.assertEqual(tax.distance("5.2", "5.1", metric="rank"), "rank-4")
+        self.assertEqual(tax.distance("5.2", "4.5", metric="rank"), "rank-2")
+        self.assertEqual(tax.distance("5.2", "4.1", metric="rank"), "rank-1")
+        self.assertEqual(tax.distance("XXX", "4.1", metric="rank"), None)
+        with self.assertRaises(ValueError):
+            tax.distance("5.2", "5.1", metric="XXX")
+
+    def test_distance_matrix(self):
+        """
+        test distance_matrix function
+        """
+        try:
+            import numpy  # noqa: F401
+        except ImportError:
+            self.skipTest("numpy not installed")
+
+        tax = CustomTx(files=self.test_file)
+        nodes = ["5.2", "4.1", "1", "XXX", "5.1", "4.5", "5.2"]
+        dist = tax.distance_matrix(nodes)
+        self.assertEqual(dist.shape, (7, 7))
+        for i, n1 in enumerate(nodes):
+            for j, n2 in enumerate(nodes):
+                d = tax.distance(n1, n2)
+                self.assertEqual(dist[i, j], d if d is not None else -1)
+
+        dist = tax.distance_matrix(nodes, metric="rank", chunk=2)
+        for i, n1 in enumerate(nodes):
+            for j, n2 in enumerate(nodes):
+                d = tax.distance(n1, n2, metric="rank")
+                self.assertEqual(dist[i, j], d if d is not None else tax.undefined_rank)
+
+        self.assertEqual(tax.distance_matrix([]).shape, (0, 0))
+        with self.assertRaises(ValueError):
+            tax.distance_matrix(nodes, metric="XXX")
+
+    def test_rollup(self):
+        """
+        test rollup function
+        """
+        tax = CustomTx(files=self.test_file)
+        totals = tax.rollup({"5.1": 1, "5.2": 2, "4.4": 4, "4.1": 8, "XXX": 100})
+        self.assertEqual(totals, {"5.1": 1, "5.2": 2, "4.4": 7, "3.4": 7, "2.2": 7,
+                                  "4.1": 8, "3.1": 8, "2.1": 8, "1": 15})
+        self.assertEqual(tax.rollup({"5.1": 1, "4.1": 8}, ranks=["rank-2", "rank-3"]),
+                         {"3.4": 1, "2.2": 1, "3.1": 8, "2.1": 8})
+        # Values aligned with nodes, repeated nodes are summed
+        self.assertEqual(tax.rollup([1, 2, 3], nodes=["5.1", "5.1", "1"]),
+                         {"5.1": 3, "4.4": 3, "3.4": 3, "2.2": 3, "1": 6})
+        self.assertEqual(tax.rollup({}), {})
+        with self.assertRaises(ValueError):
+            tax.rollup([1, 2])
+        with self.assertRaises(ValueError):
+            tax.rollup([1, 2], nodes=["5.1"])
+
+        try:
+            import numpy as np
+        except ImportError:
+            return
+        # Multiple samples (nodes x samples)
+        totals = tax.rollup(np.array([[1, 0], [2, 1], [8, 8]]),
+                            nodes=["5.1", "5.2", "4.1"], ranks=["rank-1", "rank-4"])
+        self.assertEqual(list(totals["1"]), [11, 9])
+        self.assertEqual(list(totals["4.4"]), [3, 1])
+        self.assertEqual(list(totals["4.1"]), [8, 8])
+
+    def test_lca(self):
+        """
+        test lca function
+        """
+        tax = CustomTx(files=self.test_file)
+        self.assertEqual(tax.lca(["5.1", "5.2"]), "4.4")
+        self.assertEqual(tax.lca(["5.1", "4.5", "XXX"]), "2.2")
+        self.assertEqual(tax.lca(["5.1", "4.1"]), "1")
+        self.assertEqual(tax.lca(["4.4", "5.2"]), "4.4")
+        self.assertEqual(tax.lca(["4.2"]), "4.2")
+        self.assertEqual(tax.lca(["XXX"]), tax.undefined_node)
+        self.assertEqual(tax.lca([]), tax.undefined_node)
+
+    def test_consensus_many(self):
+        """
+        test consensus_many function
+        """
+        tax = CustomTx(files=self.test_file)
+        sets = [{"5.1", "5.2"}, ["5.1", "4.5", "4.1"], {"5.1": 3, "4.1": 1},
+                ["5.1", "5.1", "5.2", "4.5"], [], {"XXX"}]
+        self.assertEqual(tax.consensus_many(sets),
+                         ["4.4", "1", "1", "2.2", tax.undefined_node, tax.undefined_node])
+        self.assertEqual(tax.consensus_many(sets, method="majority"),
+                         ["4.4", "2.2", "5.1", "4.4", tax.undefined_node, tax.undefined_node])
+        self.assertEqual(tax.consensus_many(sets, method="majority", threshold=0.7),
+                         ["4.4", "1", "5.1", "4.4", tax.undefined_node, tax.undefined_node])
+        self.assertEqual(tax.consensus_many(sets, method="majority", threshold=1),
+                         tax.consensus_many(sets))
+        # Process pool with small chunks
+        self.assertEqual(tax.consensus_many(sets, processes=2, chunksize=2),
+                         tax.consensus_many(sets))
+        with self.assertRaises(ValueError):
+            tax.consensus_many(sets, method="XXX")
+
     def test_stats(self):
         """
         test stats function
@@ -339,6 +597,44 @@ class TestFunctions(unittest.TestCase):
         self.assertCountEqual(list(stats["ranked_leaves"].keys()), [
                               "rank-4", "rank-5"])
 
+    def test_subtree_stats(self):
+        """
+        test build_subtree_counts and subtree_stats functions
+        """
+        tax = CustomTx(files=self.test_file)
+        self.assertEqual(len(tax._subtree_counts), 0)
+        tax.build_subtree_counts()
+        # Only internal nodes are stored
+        self.assertEqual(len(tax._subtree_counts), 7)
+
+        st = tax.subtree_stats("2.2")
+        self.assertEqual(st["nodes"], 6)
+        self.assertEqual(st["leaves"], 3)
+        self.assertEqual(st["ranked_nodes"], {
+                         "rank-2": 1, "rank-3": 1, "rank-4": 2, "rank-5": 2})
+        self.assertEqual(st["ranked_leaves"], {"rank-4": 1, "rank-5": 2})
+
+        st = tax.subtree_stats("5.1")
+        self.assertEqual(st["nodes"], 1)
+        self.assertEqual(st["leaves"], 1)
+        self.assertEqual(st["ranked_leaves"], {"rank-5": 1})
+
+        st = tax.subtree_stats("XXX")
+        self.assertEqual(st["nodes"], 0)
+        self.assertEqual(st["leaves"], 0)
+
+        # stats() reuses root counts
+        self.assertEqual(tax.subtree_stats("1")["nodes"], 14)
+        stats = tax.stats()
+        self.assertEqual(stats["leaves"], 7)
+        self.assertEqual(sum(stats["ranked_nodes"].values()), 14)
+        self.assertCountEqual(list(stats["ranked_leaves"].keys()), [
+                              "rank-4", "rank-5"])
+
+        # Built on first use
+        tax = CustomTx(files=self.test_file)
+        self.assertEqual(tax.subtree_stats("4.4")["leaves"], 2)
+
     def test_build_lineages(self):
         """
         test build_lineages function
@@ -365,6 +661,10 @@ class TestFunctions(unittest.TestCase):
         self.assertEqual(len(tax._lineages), 14)
         self.assertEqual(tax.lineage("5.2"), ["2.2", "4.4"])
         self.assertEqual(tax.lineage("XXX"), [])
+        # ranked lineages are shared between nodes, returned as copies
+        tax.lineage("5.2").append("XXX")
+        self.assertEqual(tax.lineage("5.1"), ["2.2", "4.4"])
+        self.assertEqual(tax.lineage("5.2"), ["2.2", "4.4"])
         # do not use stored lineage with keyword arguments
         self.assertEqual(tax.lineage("5.2", root_node="3.4"),
                          ["3.4", "4.4", "5.2"])
@@ -373,6 +673,46 @@ class TestFunctions(unittest.TestCase):
         self.assertEqual(tax.lineage("5.2", root_node="2.2", ranks=[
                          "rank-2", "rank-5"]), ["2.2", "5.2"])
 
+        # stored lineages share prefixes, lineage() returns new lists
+        tax.build_lineages()
+        lin = tax.lineage("5.2")
+        self.assertIsInstance(lin, list)
+        self.assertEqual(lin, ["1", "2.2", "3.4", "4.4", "5.2"])
+        lin.append("6.1")
+        self.assertEqual(tax.lineage("5.2"), ["1", "2.2", "3.4", "4.4", "5.2"])
+        self.assertIs(tax._lineages["5.2"]._prefix, tax._lineages["4.4"])
+        self.assertEqual(json.dumps(tax.lineage("4.4")), '["1", "2.2", "3.4", "4.4"]')
+        self.assertEqual(tax.name_lineage("4.6"), ["Node1", "Node4.6"])
+
+    def test_build_rank_table(self):
+        """
+        test build_rank_table function
+        """
+        tax = CustomTx(files=self.test_file)
+        tax.build_rank_table(["rank-2", "rank-3", "rank-5"])
+        self.assertEqual(len(tax._rank_table), 3)
+        self.assertEqual(len(tax._rank_table["rank-3"]), 14)
+        self.assertEqual(tax._rank_table["rank-3"]["5.2"], "3.4")
+        self.assertEqual(tax._rank_table["rank-3"]["4.5"], tax.undefined_node)
+
+        self.assertEqual(tax.parent_rank("5.2", "rank-3"), "3.4")
+        self.assertEqual(tax.parent_rank("4.6", "rank-2"), tax.undefined_node)
+        self.assertEqual(tax.parent_rank("XXX", "rank-2"), tax.undefined_node)
+        self.assertEqual(tax.lineage("5.1", ranks=["rank-5", "rank-2"]),
+                         ["5.1", "2.2"])
+        self.assertEqual(tax.lineage("XXX", ranks=["rank-2"]), [])
+        self.assertEqual(tax.name_lineage("4.2", ranks=["rank-2", "rank-3"]),
+                         ["Node2.1", "Node3.2"])
+        self.assertEqual(tax.closest_parent(
+            "5.2", ["rank-2", "rank-3"]), "3.4")
+        self.assertEqual(tax.closest_parent(
+            "4.6", ["rank-2", "rank-3"]), tax.undefined_node)
+        # Ranks not in table are computed
+        self.assertEqual(tax.lineage("5.2", ranks=["rank-1", "rank-4"]),
+                         ["1", "4.4"])
+        self.assertEqual(tax.closest_parent(
+            "5.2", ["rank-1", "rank-3", "rank-4"]), "4.4")
+
     def test_clear_lineages(self):
         """
         test clear_lineages function
@@ -452,6 +792,57 @@ class TestFunctions(unittest.TestCase):
         with self.assertRaises(ValueError):
             tax.check_consistency()
 
+    def test_freeze(self):
+        """
+        test freeze function
+        """
+        tax = CustomTx(files=self.test_file)
+        tax.freeze(ranks=["rank-2", "rank-4"])
+        # All aux structures built
+        self.assertNotEqual(len(tax._node_children), 0)
+        self.assertNotEqual(len(tax._name_nodes), 0)
+        self.assertNotEqual(len(tax._rank_nodes), 0)
+        self.assertNotEqual(len(tax._lineages), 0)
+        self.assertNotEqual(len(tax._node_intervals), 0)
+        self.assertNotEqual(len(tax._subtree_counts), 0)
+        self.assertIsNotNone(tax._name_ngrams)
+        self.assertIsNotNone(tax._name_fuzzy)
+        self.assertCountEqual(tax._name_prefixes, [True, False])
+        self.assertEqual(tax.lineage("5.1", ranks=["rank-2", "rank-4"]), ["2.2", "4.4"])
+
+        # Mutators and aux builders raise
+        for f, args in [(tax.add, ["6.1", "4.4"]), (tax.remove, ["4.4"]),
+                        (tax.prune, ["2.1"]), (tax.filter, ["2.1"]),
+                        (tax.build_lineages, []), (tax.clear_lineages, []),
+                        (tax.build_rank_table, [["rank-3"]]),
+                        (tax.build_subtree_counts, []), (tax.build_ngram_index, [])]:
+            with self.assertRaises(ValueError):
+                f(*args)
+        # Freezing again does nothing
+        tax.freeze()
+
+        # Concurrent reads
+        from concurrent.futures import ThreadPoolExecutor
+        nodes = list(tax._nodes) * 50
+        with ThreadPoolExecutor(4) as pool:
+            lineages = list(pool.map(tax.lineage, nodes))
+            children = list(pool.map(tax.children, nodes))
+        self.assertEqual(lineages[:14], [tax.lineage(n) for n in nodes[:14]])
+        self.assertEqual(children[-14:], [tax.children(n) for n in nodes[:14]])
+
+        # Views of frozen taxonomies are not frozen
+        view = tax.view(root="2.2")
+        view.build_lineages()
+        view.freeze(search=False)
+        self.assertEqual(view.lineage("5.1"), ["2.2", "3.4", "4.4", "5.1"])
+
+        # Without search indices, searches do not change the frozen taxonomy
+        self.assertEqual(view.search_prefix("node4", limit=2), ["4.4", "4.5"])
+        self.assertEqual(view.search_prefix("node4", case_sensitive=True), [])
+        self.assertCountEqual(view.search_name_fuzzy("Node5.X", max_distance=1), ["5.1", "5.2"])
+        self.assertEqual(view._name_prefixes, {})
+        self.assertIsNone(view._name_fuzzy)
+
     def test_filter(self):
         """
         test filter function
@@ -504,6 +895,24 @@ class TestFunctions(unittest.TestCase):
         tax.filter("XXXXX", desc=True)
         self.assertEqual(tax.stats()["nodes"], 1)
 
+        # Nested nodes (any order): all descendants are kept
+        tax = CustomTx(files=self.test_file)
+        tax.filter(["2.2", "4.4"], desc=True)
+        self.assertEqual(tax.stats()["nodes"], 7)
+        self.assertEqual(tax.lineage("5.1"), ["1", "2.2", "3.4", "4.4", "5.1"])
+        self.assertCountEqual(tax.leaves("1"), ["4.5", "5.1", "5.2"])
+        tax = CustomTx(files=self.test_file)
+        tax.filter(["4.4", "2.2"], desc=True)
+        self.assertEqual(tax.stats()["nodes"], 7)
+        self.assertEqual(tax.lineage("5.1"), ["1", "2.2", "3.4", "4.4", "5.1"])
+        self.assertCountEqual(tax.leaves("1"), ["4.5", "5.1", "5.2"])
+
+        # Nested nodes (ancestors)
+        tax = CustomTx(files=self.test_file)
+        tax.filter(["5.1", "4.4", "3.1"])
+        self.assertEqual(tax.stats()["nodes"], 7)
+        self.assertCountEqual(tax.leaves("1"), ["3.1", "5.1"])
+
     def test_add(self):
         """
         test add function
@@ -525,6 +934,32 @@ class TestFunctions(unittest.TestCase):
         self.assertEqual(tax.lineage("6.1"), [
                          "1", "2.2", "3.4", "4.4", "5.3", "6.1"])
 
+        # Built aux structures are updated with new nodes
+        tax = CustomTx(files=self.test_file, build_name_nodes=True,
+                       build_node_children=True, build_rank_nodes=True)
+        tax.build_lineages()
+        tax.build_rank_table(["rank-3", "rank-5"])
+        tax.build_ngram_index()
+        self.assertEqual(tax.search_prefix("node6"), [])
+        self.assertEqual(tax.search_name_fuzzy("Node6.l", max_distance=1), [])
+        tax.add("5.3", "4.4", name="Node5.3", rank="rank-5")
+        tax.add("6.1", "5.3", name="Node6.1", rank="rank-6")
+        self.assertEqual(tax._node_children, reverse_dict(tax._nodes))
+        self.assertEqual(tax._name_nodes, reverse_dict(tax._names))
+        self.assertEqual(tax._rank_nodes, reverse_dict(tax._ranks))
+        self.assertEqual(tax.lineage("6.1"), [
+                         "1", "2.2", "3.4", "4.4", "5.3", "6.1"])
+        self.assertEqual(tax.lineage("6.1", ranks=["rank-3", "rank-5"]),
+                         ["3.4", "5.3"])
+        self.assertEqual(tax.search_name("de6.", exact=False), ["6.1"])
+        self.assertEqual(tax.search_prefix("node6"), ["6.1"])
+        self.assertEqual(tax.search_name_fuzzy("Node6.l", max_distance=1), ["6.1"])
+        self.assertEqual(tax.leaves("4.4"), ["5.1", "5.2", "6.1"])
+        # Lineages built with ranks
+        tax.build_lineages(ranks=["rank-2", "rank-6"])
+        tax.add("7.1", "6.1", rank="rank-6")
+        self.assertEqual(tax._lineages["7.1"], ["2.2", "6.1"])
+
         # Add node without valid parent, raises ValueError
         with self.assertRaises(ValueError):
             tax.add("6.2", "XXX")
@@ -533,6 +968,57 @@ class TestFunctions(unittest.TestCase):
         with self.assertRaises(ValueError):
             tax.add("5.1", "4.4")
 
+    def test_add_many(self):
+        """
+        test add_many and from_edges functions
+        """
+        tax = CustomTx(files=self.test_file, build_node_children=True)
+        tax.build_lineages()
+        tax._translated_nodes = {"4.4": {"A"}}
+        # Children before parents, parents on tree or records
+        tax.add_many([("6.1", "5.3", "Node6.1", "rank-6"),
+                      ("5.3", "4.4"),
+                      ("5.4", "4.4", "Node5.4")])
+        self.assertEqual(tax.check_consistency(), None)
+        self.assertEqual(tax.lineage("6.1"), [
+                         "1", "2.2", "3.4", "4.4", "5.3", "6.1"])
+        self.assertEqual(tax.name("5.4"), "Node5.4")
+        self.assertEqual(tax.rank("5.4"), tax.undefined_rank)
+        self.assertEqual(tax.name("5.3"), tax.undefined_name)
+        self.assertCountEqual(tax.children("4.4"), ["5.1", "5.2", "5.3", "5.4"])
+        # Translations are deleted, with or without built aux. structures
+        self.assertEqual(tax.translate("4.4"), [])
+        tax = CustomTx(files=self.test_file)
+        tax._translated_nodes = {"4.4": {"A"}}
+        tax.add_many([("5.3", "4.4")])
+        self.assertEqual(tax.translate("4.4"), [])
+        tax._translated_nodes = {"4.4": {"A"}}
+        tax.add("5.4", "4.4")
+        self.assertEqual(tax.translate("4.4"), [])
+
+        # Invalid records raise ValueError without changing the taxonomy
+        for records in [[("7.1", "6.1"), ("5.1", "4.4")],  # already present
+                        [("7.1", "6.1"), ("7.1", "6.1")],  # duplicated
+                        [("7.1", "6.1"), ("7.2", "XXX")],  # missing parent
+                        [("7.1", "7.2"), ("7.2", "7.3"), ("7.3", "7.1")]]:  # cycle
+            with self.assertRaises(ValueError):
+                tax.add_many(records)
+            self.assertEqual(tax.latest("7.1"), tax.undefined_node)
+
+        # From edges, including root record
+        tax = DummyTx.from_edges([("3", "2", "Node3", "rank-3"),
+                                  ("2", "1", "Node2", "rank-2"),
+                                  ("1", "0", "Node1", "rank-1")])
+        self.assertEqual(tax.check_consistency(), None)
+        self.assertEqual(tax.lineage("3"), ["1", "2", "3"])
+        self.assertEqual(tax.name_lineage("3"), ["Node1", "Node2", "Node3"])
+        self.assertEqual(tax.root_rank, "rank-1")
+
+        # From edges grafted on parsed taxonomy
+        tax = CustomTx.from_edges([("5.3", "4.4")], files=self.test_file)
+        self.assertEqual(tax.parent("5.3"), "4.4")
+        self.assertEqual(tax.stats()["nodes"], 15)
+
     def test_remove(self):
         """
         test remove function
@@ -545,16 +1031,36 @@ class TestFunctions(unittest.TestCase):
         self.assertEqual(tax.rank("5.2"), tax.undefined_node)
         self.assertEqual(tax.lineage("5.2"), [])
 
-        # Initialize aux structures and clear them after removing node
+        # Initialize aux structures and update them after removing node
         tax = CustomTx(files=self.test_file, build_name_nodes=True,
                        build_node_children=True, build_rank_nodes=True)
-        self.assertNotEqual(len(tax._name_nodes), 0)
-        self.assertNotEqual(len(tax._node_children), 0)
-        self.assertNotEqual(len(tax._rank_nodes), 0)
+        tax.build_lineages()
+        tax.build_rank_table(["rank-3", "rank-4"])
+        self.assertEqual(tax.search_prefix("node5"), ["5.1", "5.2"])
         tax.remove("5.2")
-        self.assertEqual(len(tax._name_nodes), 0)
-        self.assertEqual(len(tax._node_children), 0)
-        self.assertEqual(len(tax._rank_nodes), 0)
+        self.assertEqual(tax._node_children, reverse_dict(tax._nodes))
+        self.assertEqual(tax._name_nodes, reverse_dict(tax._names))
+        self.assertEqual(tax._rank_nodes, reverse_dict(tax._ranks))
+        self.assertEqual(tax.children("4.4"), ["5.1"])
+        self.assertEqual(tax.search_name("Node5.2"), [])
+        self.assertEqual(tax.search_prefix("node5"), ["5.1"])
+        self.assertEqual(tax.nodes_rank("rank-5"), ["5.1"])
+        # Removing internal node invalidates lineages of descendants
+        tax.remove("4.4")
+        self.assertEqual(tax.lineage("5.1"), [])
+        self.assertEqual(tax.lineage("5.1", ranks=["rank-3", "rank-4"]), [])
+        self.assertEqual(tax.lineage("4.5"), ["1", "2.2", "4.5"])
+        # Adding it again links descendants back to the tree
+        tax.add("4.4", "3.4", name="Node4.4", rank="rank-4")
+        self.assertEqual(tax.lineage("5.1"), ["1", "2.2", "3.4", "4.4", "5.1"])
+        self.assertEqual(tax.lineage("5.1", ranks=["rank-3", "rank-4"]), ["3.4", "4.4"])
+        self.assertEqual(tax.lineage("4.4"), ["1", "2.2", "3.4", "4.4"])
+        rebuilt = CustomTx(files=self.test_file)
+        rebuilt.remove("5.2")
+        for node in tax._nodes:
+            self.assertEqual(tax.lineage(node), rebuilt.lineage(node))
+            self.assertEqual(tax.lineage(node, ranks=["rank-3", "rank-4"]),
+                             rebuilt.lineage(node, ranks=["rank-3", "rank-4"]))
 
         # with check_consistency
         tax.remove("5.1", check_consistency=True)
@@ -624,6 +1130,464 @@ class TestFunctions(unittest.TestCase):
         tax.prune(tax.root_node)
         self.assertEqual(len(tax._nodes), 1)
 
+    def test_pickle(self):
+        """
+        test pickling (compact state, aux structures built on first use)
+        """
+        import pickle
+        tax = CustomTx(files=self.test_file)
+        tax.add("5.3", "4.4")  # undefined name and rank
+        tax.add("5.4", "4.4", name="Node5.4")
+        tax.build_lineages()
+        tax.build_rank_table(["rank-2"])
+        tax.children("1")
+        tax.search_name("Node", exact=False)
+
+        unpickled = pickle.loads(pickle.dumps(tax))
+        self.assertIsInstance(unpickled, CustomTx)
+        self.assertEqual(unpickled._nodes, tax._nodes)
+        self.assertEqual(unpickled._names, tax._names)
+        self.assertEqual(unpickled._ranks, tax._ranks)
+        self.assertEqual(unpickled.root_node, tax.root_node)
+        self.assertEqual(len(unpickled._lineages), 0)
+        self.assertEqual(len(unpickled._rank_table), 0)
+        self.assertEqual(len(unpickled._node_children), 0)
+        self.assertEqual(unpickled.lineage("5.3"), tax.lineage("5.3"))
+        self.assertCountEqual(unpickled.children("1"), tax.children("1"))
+        # Still mutable
+        unpickled.add("6.1", "5.3")
+        self.assertEqual(unpickled.parent("6.1"), "5.3")
+
+        # Broken tree (parents outside the tree are kept)
+        tax.remove("4.4")
+        unpickled = pickle.loads(pickle.dumps(tax))
+        self.assertEqual(unpickled.parent("5.1"), "4.4")
+        self.assertEqual(unpickled.lineage("5.1"), [])
+
+        # Views are unpickled as read-only copies
+        view = CustomTx(files=self.test_file).view(root="2.1")
+        unpickled = pickle.loads(pickle.dumps(view))
+        self.assertEqual(unpickled._nodes, dict(view._nodes))
+        self.assertEqual(unpickled.root_node, "2.1")
+        with self.assertRaises(ValueError):
+            unpickled.add("6.1", "4.1")
+
+        # Frozen taxonomies are frozen again
+        tax = CustomTx(files=self.test_file)
+        tax.freeze(ranks=["rank-3"], search=False)
+        unpickled = pickle.loads(pickle.dumps(tax))
+        self.assertTrue(unpickled._frozen)
+        self.assertCountEqual(unpickled._rank_table, ["rank-3"])
+        self.assertIsNone(unpickled._name_fuzzy)
+        self.assertEqual(unpickled.lineage("5.1"), tax.lineage("5.1"))
+
+    def test_shared_memory(self):
+        """
+        test to_shared_memory and attach_shared functions
+        """
+        from multitax.multitax import MultiTax
+        tax = CustomTx(files=self.test_file)
+        tax.add("5.3", "4.4")  # undefined name and rank
+        shm = tax.to_shared_memory()
+        try:
+            shared = MultiTax.attach_shared(shm.name)
+            self.assertIsInstance(shared, CustomTx)
+            self.assertEqual(shared.check_consistency(), None)
+            self.assertEqual(shared.root_node, tax.root_node)
+            self.assertEqual(shared.stats(), tax.stats())
+            for node in list(tax._nodes) + ["XXX"]:
+                self.assertEqual(shared.parent(node), tax.parent(node))
+                self.assertEqual(shared.name(node), tax.name(node))
+                self.assertEqual(shared.rank(node), tax.rank(node))
+                self.assertEqual(shared.lineage(node), tax.lineage(node))
+                self.assertCountEqual(shared.children(node), tax.children(node))
+            self.assertEqual(shared._node_intervals["2.2"], tax._node_intervals["2.2"])
+            self.assertEqual(shared.lca(["5.1", "4.5"]), "2.2")
+            self.assertEqual(shared.search_name("Node4.4"), ["4.4"])
+            self.assertCountEqual(shared.view(root="3.4").leaves(), ["5.1", "5.2", "5.3"])
+            # Read-only
+            with self.assertRaises(ValueError):
+                shared.add("6.1", "5.3")
+            del shared
+
+            # Truth tests of aux. structures (on every query) do not scan all keys
+            from unittest import mock
+            from multitax.utils import SharedMapping
+            big = CustomTx(files=self.test_file)
+            big.add_many([("L" + str(i), "4.1") for i in range(5000)])
+            shm_big = big.to_shared_memory()
+            shared = CustomTx.attach_shared(shm_big.name)
+            with mock.patch.object(SharedMapping, "_has_value", autospec=True,
+                                   side_effect=lambda self, i: True) as probes:
+                for _ in range(100):
+                    self.assertEqual(shared.children("5.1"), [])
+                    self.assertEqual(shared.lca(["5.1", "4.5"]), "2.2")
+            # Keys of each mapping are counted at most once
+            self.assertLess(probes.call_count, 3 * len(big._nodes))
+            del shared
+            shm_big.close()
+            shm_big.unlink()
+
+            # Python < 3.13: other processes attaching do not unlink the block on exit
+            # (the creator process and its workers share the registration of the block)
+            import sys
+            from multiprocessing import resource_tracker
+            if sys.version_info < (3, 13):
+                with mock.patch.object(resource_tracker, "unregister") as unregister:
+                    shared = CustomTx.attach_shared(shm.name)
+                    unregister.assert_not_called()
+                    del shared
+                    with mock.patch("os.getpid", return_value=-1):
+                        shared = CustomTx.attach_shared(shm.name)
+                    unregister.assert_called_once_with(shm._name, "shared_memory")
+                    del shared
+
+            # Without intervals, built on first use
+            shm2 = tax.to_shared_memory(intervals=False)
+            shared = CustomTx.attach_shared(shm2.name)
+            self.assertEqual(len(shared._node_intervals), 0)
+            self.assertEqual(shared.lca(["5.1", "4.5"]), "2.2")
+            del shared
+            shm2.close()
+            shm2.unlink()
+        finally:
+            shm.close()
+            shm.unlink()
+
+    def test_sqlite(self):
+        """
+        test to_sqlite and attach_sqlite functions
+        """
+        from multitax.multitax import MultiTax
+        tax = CustomTx(files=self.test_file)
+        tax.add("5.3", "4.4")  # undefined name and rank
+        tax._nodes["6.1"] = "XXX"  # invalid lineage
+        db = self.tmp_dir + "tax.db"
+        tax.to_sqlite(db, overwrite=True)
+        with self.assertRaises(FileExistsError):
+            tax.to_sqlite(db)
+
+        sql = MultiTax.attach_sqlite(db, cache=4)
+        self.assertIsInstance(sql, CustomTx)
+        self.assertEqual(sql.root_node, tax.root_node)
+        self.assertEqual(sql.stats(), tax.stats())
+        self.assertEqual(list(sql._nodes), list(tax._nodes))
+        for node in list(tax._nodes) + ["XXX"]:
+            self.assertEqual(sql.parent(node), tax.parent(node))
+            self.assertEqual(sql.name(node), tax.name(node))
+            self.assertEqual(sql.rank(node), tax.rank(node))
+            self.assertEqual(sql.lineage(node), tax.lineage(node))
+            self.assertEqual(sql.name_lineage(node), tax.name_lineage(node))
+            self.assertEqual(sql.lineage(node, ranks=["rank-2", "rank-4"]),
+                             tax.lineage(node, ranks=["rank-2", "rank-4"]))
+            self.assertEqual(sql.children(node), tax.children(node))
+        self.assertEqual(sql.lineage("6.1"), [])
+        self.assertEqual(sql.nodes_rank("rank-5"), ["5.1", "5.2"])
+        self.assertEqual(sql.nodes_rank("XXX"), [])
+        self.assertEqual(sql.search_name("Node4.4"), ["4.4"])
+        self.assertCountEqual(sql.search_name("Node5", exact=False), ["5.1", "5.2"])
+        self.assertCountEqual(sql.leaves("3.4"), ["5.1", "5.2", "5.3"])
+        self.assertEqual(sql.lca(["5.1", "4.5"]), "2.2")
+        # Cache is bounded
+        self.assertLessEqual(len(sql._nodes._cache), 4)
+        # Read-only
+        with self.assertRaises(ValueError):
+            sql.add("6.2", "5.3")
+
+        # Merged nodes and extended names (NcbiTx)
+        import pickle
+        tax = NcbiTx(files="tests/multitax/data_minimal/ncbi.tar.gz", extended_names=True)
+        db = self.tmp_dir + "ncbi.db"
+        tax.to_sqlite(db, overwrite=True)
+        sql = MultiTax.attach_sqlite(db)
+        self.assertIsInstance(sql, NcbiTx)
+        self.assertEqual(sql.stats(), tax.stats())
+        self.assertEqual(sql.latest("1235230"), "459525")
+        self.assertEqual(sql.merged("1235908"), "363999")
+        self.assertEqual(sql.merged("XXX"), sql.undefined_node)
+        for text in ["Xylariaceae", "Xylariaceae sp. 5129", "mitosporic Xylariaceae"]:
+            for exact in [True, False]:
+                self.assertCountEqual(sql.search_name(text, exact=exact),
+                                      tax.search_name(text, exact=exact))
+                self.assertCountEqual(sql.search_name(text, exact=exact, force_extended=True),
+                                      tax.search_name(text, exact=exact, force_extended=True))
+        self.assertCountEqual(sql.search_name_fuzzy("Xylariaceae sp 5129"),
+                              tax.search_name_fuzzy("Xylariaceae sp 5129"))
+        # Copied on pickling
+        copy = pickle.loads(pickle.dumps(sql))
+        self.assertEqual(copy.latest("1235230"), "459525")
+        self.assertCountEqual(copy.search_name("Xylariaceae sp. 5129"), ["363999"])
+
+        # Forwards (OttTx)
+        tax = OttTx(files="tests/multitax/data_minimal/ott.tgz", extended_names=True)
+        tax.to_sqlite(db, overwrite=True)
+        sql = OttTx.attach_sqlite(db)
+        self.assertEqual(sql._forwards, tax._forwards)
+        self.assertEqual(sql.search_name("Haemophilus sp. HK 85"), ["525972"])
+        self.assertEqual(sql.search_name_fuzzy("Haemofilus"), tax.search_name_fuzzy("Haemofilus"))
+
+    def test_validate(self):
+        """
+        test validate function
+        """
+        tax = CustomTx(files=self.test_file)
+        report = tax.validate()
+        self.assertTrue(report["valid"])
+        for k in ["unreachable", "orphans", "cycles", "duplicates"]:
+            self.assertEqual(report[k], [])
+        self.assertEqual(tax.validate(report=False), None)
+
+        # Cycle 7.1 <-> 7.2 with descendant 8.1, node 2.1 redefined
+        cycle_file = self.tmp_dir + "cycle.tsv"
+        with open(cycle_file, "w") as f:
+            f.write("1\t0\nA\t1\nB\tA\n7.1\t7.2\n7.2\t7.1\n8.1\t7.1\nB\t1\n")
+
+        # Raise error on load
+        with self.assertRaises(ValueError):
+            CustomTx(files=cycle_file, cols=["node", "parent"])
+
+        tax = CustomTx(files=cycle_file, cols=["node", "parent"], validate=False)
+        report = tax.validate()
+        self.assertFalse(report["valid"])
+        self.assertCountEqual(report["unreachable"], ["7.1", "7.2", "8.1"])
+        self.assertEqual(report["orphans"], [])
+        self.assertEqual(len(report["cycles"]), 1)
+        self.assertCountEqual(report["cycles"][0], ["7.1", "7.2"])
+        self.assertEqual(report["duplicates"], ["B"])
+        with self.assertRaises(ValueError):
+            tax.validate(report=False)
+
+        # Orphans (removing parent nodes)
+        tax = CustomTx(files=self.test_file)
+        tax.remove("3.2")
+        report = tax.validate()
+        self.assertFalse(report["valid"])
+        self.assertCountEqual(report["unreachable"], ["4.2", "4.3"])
+        self.assertCountEqual(report["orphans"], ["4.2", "4.3"])
+        self.assertEqual(report["cycles"], [])
+
+        # Only duplicates, warns on load
+        dup_file = self.tmp_dir + "dup.tsv"
+        with open(dup_file, "w") as f:
+            f.write("1\t0\nA\t1\nB\tA\nB\t1\n")
+        with self.assertWarns(UserWarning):
+            tax = CustomTx(files=dup_file, cols=["node", "parent"])
+        self.assertEqual(tax.parent("B"), "1")
+
+    def test_view(self):
+        """
+        test view function
+        """
+        tax = CustomTx(files=self.test_file)
+
+        # Subtree of 2.2
+        view = tax.view(root="2.2")
+        self.assertEqual(view.check_consistency(), None)
+        self.assertEqual(view.root_node, "2.2")
+        self.assertEqual(view.parent("2.2"), tax.root_parent)
+        self.assertEqual(view.stats()["nodes"], 6)
+        self.assertEqual(view.lineage("5.1"), ["2.2", "3.4", "4.4", "5.1"])
+        self.assertEqual(view.lineage("3.1"), [])
+        self.assertEqual(view.name("3.1"), tax.undefined_name)
+        self.assertCountEqual(view.leaves(), ["4.5", "5.1", "5.2"])
+        self.assertCountEqual(view.search_name("Node4", exact=False), ["4.4", "4.5"])
+        self.assertCountEqual(view.nodes_rank("rank-4"), ["4.4", "4.5"])
+        self.assertEqual(view.search_prefix("node3"), ["3.4"])
+
+        # Keep and prune
+        view = tax.view(keep=["3.1", "4.4"], prune=["4.4"])
+        self.assertEqual(view.check_consistency(), None)
+        self.assertCountEqual(view._nodes, [
+                              "1", "2.1", "2.2", "3.1", "3.4", "4.1", "4.4"])
+        self.assertCountEqual(view.leaves(), ["4.1", "4.4"])
+        self.assertEqual(tax.view(keep="XXX").stats()["nodes"], 1)
+        with self.assertRaises(ValueError):
+            tax.view(prune="XXX")
+        with self.assertRaises(ValueError):
+            tax.view(root="XXX")
+
+        # View of view
+        view2 = view.view(root="2.2")
+        self.assertCountEqual(view2._nodes, ["2.2", "3.4", "4.4"])
+
+        # Read-only
+        for f, args in [(view.add, ["6.1", "4.4"]), (view.remove, ["4.4"]),
+                        (view.prune, ["2.1"]), (view.filter, ["2.1"]),
+                        (view.add_many, [[("6.1", "4.4")]])]:
+            with self.assertRaises(ValueError):
+                f(*args)
+
+        # Original taxonomy not changed
+        self.assertEqual(tax.stats()["nodes"], 14)
+        self.assertEqual(tax.check_consistency(), None)
+
+    def test_annotate(self):
+        """
+        test annotate function
+        """
+        import gzip
+        import io
+        from multitax.cli import main
+
+        tax = CustomTx(files=self.test_file)
+        infile = self.tmp_dir + "annotate.tsv.gz"
+        with gzip.open(infile, "wt") as f:
+            f.write("read\ttaxid\n")
+            for read, node in enumerate(["5.1", "4.2", "XXX", "5.1", "", "1"]):
+                f.write("r" + str(read) + "\t" + node + "\tx\n")
+
+        outf = io.StringIO()
+        self.assertEqual(tax.annotate(infile, outf, column=2, cols=["rank", "lineage", "name_lineage"], header=True, chunk=4), 6)
+        lines = outf.getvalue().splitlines()
+        self.assertEqual(len(lines), 7)
+        self.assertEqual(lines[0], "read\ttaxid\trank\tlineage\tname_lineage")
+        self.assertEqual(lines[1], "r0\t5.1\tx\trank-5\t1|2.2|3.4|4.4|5.1\tNode1|Node2.2|Node3.4|Node4.4|Node5.1")
+        self.assertEqual(lines[3], "r2\tXXX\tx\t" + str(tax.undefined_rank) + "\t\t")
+        self.assertEqual(lines[1], lines[4].replace("r3", "r0"))
+        self.assertEqual(lines[6], "r5\t1\tx\trank-1\t1\tNode1")
+
+        # Same fields as write()
+        cols = ["node", "latest", "parent", "rank", "name", "leaves", "children", "lineage", "rank_lineage", "name_lineage"]
+        outfile = self.tmp_dir + "annotate_write.tsv"
+        tax.write(outfile, cols=cols, ranks=["rank-2", "rank-4"])
+        outf = io.StringIO()
+        with open(outfile) as inf:
+            tax.annotate(inf, outf, cols=cols[1:], ranks=["rank-2", "rank-4"])
+        with open(outfile) as inf:
+            written_lines = inf.read().splitlines()
+            self.assertEqual(len(written_lines), len(outf.getvalue().splitlines()))
+            for written, annotated in zip(written_lines, outf.getvalue().splitlines()):
+                self.assertEqual(annotated, written + "\t" + "\t".join(written.split("\t")[1:]))
+
+        # Multiple processes, plain (byte ranges) and gzipped input, small chunks
+        plainfile = self.tmp_dir + "annotate.tsv"
+        with gzip.open(infile, "rt") as inf, open(plainfile, "w") as f:
+            f.write(inf.read() * 50)
+        for file in [plainfile, infile]:
+            for header in [True, False]:
+                serial, parallel = io.StringIO(), io.StringIO()
+                count = tax.annotate(file, serial, column=2, cols=["rank", "lineage"], header=header)
+                self.assertEqual(tax.annotate(file, parallel, column=2, cols=["rank", "lineage"], header=header,
+                                              processes=2, chunk_bytes=64), count)
+                self.assertEqual(parallel.getvalue(), serial.getvalue())
+
+        # Same decoding (utf-8, "\r\n" and "\r" in fields) on single and multiple processes
+        crlffile = self.tmp_dir + "annotate_crlf.tsv"
+        with open(crlffile, "wb") as f:
+            f.write("r\u00e9ad\t5.1\r\nr1\t4.2\rx\r\nr2\t1\n".encode() * 20)
+        serial, parallel = io.StringIO(), io.StringIO()
+        self.assertEqual(tax.annotate(crlffile, serial, column=2, cols=["rank"]), 60)
+        self.assertEqual(tax.annotate(crlffile, parallel, column=2, cols=["rank"],
+                                      processes=2, chunk_bytes=16), 60)
+        self.assertEqual(parallel.getvalue(), serial.getvalue())
+        self.assertEqual(serial.getvalue().splitlines()[0], "r\u00e9ad\t5.1\trank-5")
+
+        with self.assertRaises(ValueError):
+            tax.annotate(infile, io.StringIO(), cols=["XXX"])
+        with self.assertRaises(ValueError):
+            tax.annotate(infile, io.StringIO(), column=0)
+
+        # Files are closed on errors
+        import gc
+        import warnings
+        with warnings.catch_warnings(record=True) as w:
+            warnings.simplefilter("always", ResourceWarning)
+            with self.assertRaises(FileExistsError):
+                tax.annotate(plainfile, plainfile, processes=2)
+
+            class FailingOutput(object):
+                def write(self, data):
+                    raise OSError("No space left")
+
+                def flush(self):
+                    pass
+
+            for processes in [1, 2]:
+                with self.assertRaises(OSError):
+                    tax.annotate(plainfile, FailingOutput(), column=2, cols=["rank"],
+                                 processes=processes)
+            gc.collect()
+        self.assertEqual([x for x in w if issubclass(x.category, ResourceWarning)], [])
+
+        # Command-line
+        outfile = self.tmp_dir + "annotate_cli.tsv"
+        main(["annotate", "--tax", "custom", "--files", self.test_file, "-i", infile, "-o", outfile,
+              "-c", "2", "--cols", "rank", "lineage", "name_lineage", "--header", "--processes", "2"])
+        with open(outfile) as f:
+            self.assertEqual(f.read().splitlines(), lines)
+
+    def test_arrow(self):
+        """
+        test to_arrow, write_parquet and from_arrow functions
+        """
+        # Lineages of node indices share the lineage of the parent
+        tax = CustomTx(files=self.test_file)
+        columns = tax._columns()
+        lins = tax._index_lineages(columns)
+        nodes = columns["nodes"]
+        i, p = nodes.index("5.1"), nodes.index("4.4")
+        self.assertEqual([nodes[k] for k in lins[i]], ["1", "2.2", "3.4", "4.4", "5.1"])
+        self.assertIs(lins[i]._prefix, lins[p])
+
+        try:
+            import pyarrow as pa
+            import pyarrow.compute as pc
+        except ImportError:
+            self.skipTest("pyarrow not installed")
+        from multitax.multitax import MultiTax
+
+        tax = CustomTx(files=self.test_file)
+        # Node outside the tree
+        tax._nodes["X.1"] = "XXX"
+        tax._names["X.1"] = None
+        ranks = ["rank-2", "rank-4", "rank-5"]
+        table = tax.to_arrow(rank_columns=ranks)
+        self.assertEqual(table.num_rows, len(tax._nodes))
+        self.assertEqual(table.column_names, ["node", "parent", "rank", "name", "lineage", "rank_lineage", "name_lineage"] + ranks)
+        self.assertTrue(pa.types.is_dictionary(table.schema.field("rank").type))
+        self.assertTrue(pa.types.is_list(table.schema.field("lineage").type))
+        for row in table.to_pylist():
+            node = row["node"]
+            self.assertEqual(row["parent"], tax.parent(node))
+            self.assertEqual(row["rank"], tax.rank(node))
+            self.assertEqual(row["name"], tax.name(node))
+            self.assertEqual(row["lineage"], tax.lineage(node))
+            self.assertEqual(row["rank_lineage"], tax.rank_lineage(node))
+            self.assertEqual(row["name_lineage"], tax.name_lineage(node))
+            self.assertEqual([row[r] for r in ranks], [n if n != tax.undefined_node else None for n in tax.lineage(node, ranks=ranks)] or [None] * len(ranks))
+        self.assertEqual(table.filter(pc.equal(table["node"], "5.1")).select(ranks).to_pylist(), [{"rank-2": "2.2", "rank-4": "4.4", "rank-5": "5.1"}])
+
+        # Views
+        view = tax.view(prune=["2.2"])
+        table = view.to_arrow(cols=["node", "lineage"])
+        self.assertEqual(table.num_rows, len(view._nodes))
+        self.assertEqual({r["node"]: r["lineage"] for r in table.to_pylist()}, {n: view.lineage(n) for n in view._nodes})
+
+        # Round-trip
+        outfile = self.tmp_dir + "tax.parquet"
+        tax.write_parquet(outfile, cols=["node", "parent", "rank", "name", "name_lineage"], rank_columns=ranks)
+        with self.assertRaises(FileExistsError):
+            tax.write_parquet(outfile)
+        tax.write_parquet(outfile, overwrite=True, compression="snappy")
+        for loaded in [MultiTax.from_arrow(outfile), CustomTx.from_arrow(tax.to_arrow(cols=["node", "parent", "rank", "name"]))]:
+            self.assertIsInstance(loaded, CustomTx)
+            self.assertEqual(loaded._nodes, tax._nodes)
+            self.assertEqual(loaded._ranks, tax._ranks)
+            self.assertEqual({n: loaded.name(n) for n in tax._nodes}, {n: tax.name(n) for n in tax._nodes})
+            self.assertEqual((loaded.root_node, loaded.root_parent, loaded.undefined_rank), (tax.root_node, tax.root_parent, tax.undefined_rank))
+
+        # Table without metadata
+        loaded = MultiTax.from_arrow(pa.table({"node": ["a", "b", "c"], "parent": ["b", "r", "a"]}))
+        self.assertEqual(loaded.root_node, "b")
+        self.assertEqual(loaded.lineage("c"), ["b", "a", "c"])
+
+        with self.assertRaises(ValueError):
+            tax.to_arrow(cols=["XXX"])
+        with self.assertRaises(ValueError):
+            tax.to_arrow(cols=["node", "rank"], rank_columns=["rank"])
+        with self.assertRaises(ValueError):
+            MultiTax.from_arrow(pa.table({"node": ["a"]}))
+
     def test_write(self):
         """
         test write function
@@ -659,6 +1623,95 @@ class TestFunctions(unittest.TestCase):
                   sep_multi="_")
         self.assertEqual(check_file(outfile), None)
 
+        # Same output with/without background thread, compressed or not, in small chunks
+        import gzip
+        cols = ["node", "rank", "lineage", "rank_lineage", "name_lineage"]
+        outfile = self.tmp_dir + "chunks.tsv"
+        tax.write(outfile, cols=cols, background=False, chunk=3)
+        with open(outfile) as f:
+            expected = f.read()
+        self.assertEqual(len(expected.splitlines()), len(tax._nodes))
+        self.assertIn("5.1\trank-5\t1|2.2|3.4|4.4|5.1\trank-1|rank-2|rank-3|rank-4|rank-5\tNode1|Node2.2|Node3.4|Node4.4|Node5.1\n", expected)
+        # Lineages are not kept after writing
+        self.assertEqual(tax._lineages, {})
+        tax.write(outfile, cols=cols, chunk=3, overwrite=True)
+        with open(outfile) as f:
+            self.assertEqual(f.read(), expected)
+        tax.write(outfile, cols=cols, gz=True, compresslevel=1)
+        with gzip.open(outfile + ".gz", "rt") as f:
+            self.assertEqual(f.read(), expected)
+        # File exists
+        with self.assertRaises(FileExistsError):
+            tax.write(outfile, cols=cols)
+        with self.assertRaises(ValueError):
+            tax.write(outfile, cols=["XXX"], overwrite=True)
+
+    def test_write_taxdump(self):
+        """
+        test write_taxdump function
+        """
+        # Non-numeric nodes, mapped to taxids
+        tax = CustomTx(files=self.test_file)
+        prefix = self.tmp_dir + "taxdump_"
+        mapping = tax.write_taxdump(prefix)
+        self.assertEqual(mapping[tax.root_node], 1)
+        self.assertEqual(len(set(mapping.values())), len(tax._nodes))
+        self.assertEqual(check_file(prefix + "taxid.map"), None)
+        # No merged nodes: empty merged.dmp is loaded with the other files
+        dump = NcbiTx(files=[prefix + "nodes.dmp", prefix + "names.dmp", prefix + "merged.dmp"])
+        self.assertEqual(dump._merged, {})
+        taxids = {node: str(taxid) for node, taxid in mapping.items()}
+        for node in tax._nodes:
+            self.assertEqual(dump.lineage(taxids[node]), [taxids[n] for n in tax.lineage(node)])
+            self.assertEqual(dump.name(taxids[node]), tax.name(node))
+            self.assertEqual(dump.rank(taxids[node]), tax.rank(node))
+
+        # Files exist
+        with self.assertRaises(FileExistsError):
+            tax.write_taxdump(prefix)
+
+        # Stable taxids for existing nodes, new taxids for new nodes
+        tax.remove("5.1")
+        tax.add("6.1", "5.2", name="Node6.1", rank="rank-6")
+        new_mapping = tax.write_taxdump(prefix, overwrite=True)
+        for node, taxid in mapping.items():
+            self.assertEqual(new_mapping[node], taxid)
+        self.assertNotIn(new_mapping["6.1"], mapping.values())
+        dump = NcbiTx(files=[prefix + "nodes.dmp", prefix + "names.dmp", prefix + "merged.dmp"])
+        self.assertEqual(dump.lineage(str(new_mapping["6.1"])), [str(new_mapping[n]) for n in tax.lineage("6.1")])
+        self.assertEqual(dump.parent(str(mapping["5.1"])), dump.undefined_node)
+
+        # Mixed numeric/non-numeric nodes: all nodes are mapped, node without name
+        # New directory is created
+        tax = CustomTx(files=self.test_file)
+        tax.add("100", "4.4", rank="rank-5")
+        prefix = self.tmp_dir + "taxdump_mixed/sub/"
+        if os.path.isfile(prefix + "taxid.map"):
+            os.remove(prefix + "taxid.map")
+        mapping = tax.write_taxdump(prefix, overwrite=True)
+        self.assertCountEqual(mapping, tax._nodes)
+        self.assertEqual(mapping["1"], 1)
+        self.assertEqual(mapping["100"], len(tax._nodes))
+        dump = NcbiTx(files=[prefix + "nodes.dmp", prefix + "names.dmp"])
+        self.assertEqual(dump.lineage(str(mapping["100"])), [str(mapping[n]) for n in tax.lineage("100")])
+        # One scientific name per taxid
+        self.assertEqual(len(dump._names), len(dump._nodes))
+        self.assertEqual(dump.name(str(mapping["100"])), "100")
+
+        # Only merged.dmp can be empty
+        with self.assertRaises(FileNotFoundError):
+            NcbiTx(files=[prefix + "merged.dmp", prefix + "names.dmp"])
+
+        # Numeric nodes are kept, with merged nodes
+        tax = NcbiTx(files="tests/multitax/data_minimal/ncbi.tar.gz")
+        prefix = self.tmp_dir + "taxdump_ncbi_"
+        self.assertEqual(tax.write_taxdump(prefix), {})
+        dump = NcbiTx(files=[prefix + "nodes.dmp", prefix + "names.dmp", prefix + "merged.dmp"])
+        self.assertEqual(dump._nodes, tax._nodes)
+        self.assertEqual(dump._names, tax._names)
+        self.assertEqual(dump._ranks, tax._ranks)
+        self.assertEqual(dump._merged, tax._merged)
+
     def test_ott_forwards(self):
         """
         Test forwards functionality (ott only)
@@ -745,6 +1798,12 @@ class TestFunctions(unittest.TestCase):
             "Xylariaceae sp.", exact=False), [])
         self.assertCountEqual(tax_ex.search_name(
             "Xylariaceae sp.", exact=False), ["363999"])
+        # Partial name with n-gram index
+        tax_ex.build_ngram_index()
+        self.assertCountEqual(tax_ex.search_name(
+            "Xylariaceae sp.", exact=False), ["363999"])
+        self.assertCountEqual(tax_ex.search_name(
+            "Xylariaceae", exact=False, force_extended=True), ["37990", "363999"])
 
     def test_ott_extended_names(self):
         """
@@ -795,3 +1854,9 @@ class TestFunctions(unittest.TestCase):
         self.assertCountEqual(tax.search_name("CCUG 26672", exact=False), [])
         self.assertCountEqual(tax_ex.search_name(
             "CCUG 26672", exact=False), ["788108"])
+        # Partial name with n-gram index
+        tax_ex.build_ngram_index()
+        self.assertCountEqual(tax_ex.search_name(
+            "CCUG 26672", exact=False), ["788108"])
+        self.assertCountEqual(tax_ex.search_name("Haemophilus sp. CCUG", exact=False, force_extended=True), [
+                              "391494", "158636", "4621", "4622", "788108"])
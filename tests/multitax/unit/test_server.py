@@ -0,0 +1,180 @@
+from multitax import CustomTx
+from multitax.cli import main
+from multitax.server import TaxClient, TaxServer
+from concurrent.futures import ThreadPoolExecutor
+from tests.multitax.utils import setup_dir
+import asyncio
+import json
+import os
+import socket
+import threading
+import unittest
+import urllib.request
+
+
+class TestServer(unittest.TestCase):
+    test_file = "tests/multitax/data_minimal/custom_unit_test.tsv.gz"
+    tmp_dir = "tests/multitax/unit/tmp_functions/"
+
+    @classmethod
+    def setUpClass(self):
+        setup_dir(self.tmp_dir)
+        self.tax = CustomTx(files=self.test_file)
+        self.tax._translated_nodes = {"4.2": {"B", "A"}}
+        self.server = TaxServer(self.tax, batch_window=0.01)
+        self.socket = os.path.join(self.tmp_dir, "server.sock")
+        if os.path.exists(self.socket):
+            os.remove(self.socket)
+        self.loop = asyncio.new_event_loop()
+        self.tcp = self.loop.run_until_complete(self.server.start(port=0))
+        self.unix = self.loop.run_until_complete(self.server.start(path=self.socket))
+        self.port = self.tcp.sockets[0].getsockname()[1]
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+
+    @classmethod
+    def tearDownClass(self):
+        async def stop():
+            self.tcp.close()
+            self.unix.close()
+            # Close open connections
+            tasks = asyncio.all_tasks() - {asyncio.current_task()}
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        asyncio.run_coroutine_threadsafe(stop(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+    def test_client(self):
+        """
+        test client functions against the loaded taxonomy
+        """
+        client = TaxClient(port=self.port)
+        nodes = ["5.1", "4.2", "XXX", "5.1"]
+        self.assertEqual(client.lineage("5.1"), self.tax.lineage("5.1"))
+        self.assertEqual(client.lineage(nodes), [self.tax.lineage(n) for n in nodes])
+        self.assertEqual(
+            client.lineage(nodes, ranks=["rank-2", "rank-4"]),
+            [self.tax.lineage(n, ranks=["rank-2", "rank-4"]) for n in nodes],
+        )
+        self.assertEqual(
+            client.lineage(nodes, root_node="2.2"),
+            [self.tax.lineage(n, root_node="2.2") for n in nodes],
+        )
+        self.assertEqual(
+            client.name_lineage(nodes), [self.tax.name_lineage(n) for n in nodes]
+        )
+        self.assertEqual(
+            client.rank_lineage(nodes), [self.tax.rank_lineage(n) for n in nodes]
+        )
+        self.assertEqual(client.name(nodes), [self.tax.name(n) for n in nodes])
+        self.assertEqual(client.rank(nodes), [self.tax.rank(n) for n in nodes])
+        self.assertEqual(client.parent(nodes), [self.tax.parent(n) for n in nodes])
+        self.assertEqual(client.latest(nodes), [self.tax.latest(n) for n in nodes])
+        self.assertEqual(client.translate(["4.2", "5.1"]), [["A", "B"], []])
+        self.assertEqual(client.search("Node5.1"), ["5.1"])
+        self.assertCountEqual(
+            client.search("Node5", exact=False, rank="rank-5"), ["5.1", "5.2"]
+        )
+        self.assertEqual(client.lca(["5.1", "4.5"]), "2.2")
+        self.assertEqual(client.lca([["5.1", "4.5"], ["5.1", "4.2"]]), ["2.2", "1"])
+        self.assertEqual(client.lineage([]), [])
+        client.close()
+
+        # Unix socket
+        client = TaxClient(path=self.socket)
+        self.assertEqual(client.name("5.1"), "Node5.1")
+        client.close()
+
+    def test_errors(self):
+        """
+        test invalid requests
+        """
+        client = TaxClient(port=self.port)
+        with self.assertRaises(ValueError):
+            client._request("GET", "/XXX")
+        with self.assertRaises(ValueError):
+            client._request("POST", "/lineage", {"q": ["5.1"], "XXX": 1})
+        with self.assertRaises(ValueError):
+            client._request("POST", "/lineage", {"q": "5.1"})
+        with self.assertRaises(ValueError):
+            client._request("POST", "/lineage", {"q": ["5.1"], "ranks": "rank-2"})
+        # Connection is still usable
+        self.assertEqual(client.name("5.1"), "Node5.1")
+        # Strings are not iterated as lists of nodes
+        with self.assertRaises(ValueError):
+            client.lca("5.1")
+        with self.assertRaises(ValueError):
+            client.lca([["5.1", "4.5"], "4.2"])
+        self.assertEqual(client.lineage("5.1", ranks="rank-2"), ["2.2"])
+        client.close()
+
+        # Invalid Content-Length: 400 and connection closed
+        for length in ["XXX", "-1"]:
+            with socket.create_connection(("127.0.0.1", self.port)) as sock:
+                sock.sendall(("POST /name HTTP/1.1\r\nContent-Length: " + length
+                              + "\r\n\r\n").encode())
+                resp = b""
+                while True:
+                    data = sock.recv(4096)
+                    if not data:
+                        break
+                    resp += data
+            self.assertTrue(resp.startswith(b"HTTP/1.1 400"))
+            self.assertIn(b"Connection: close", resp)
+
+    def test_get(self):
+        """
+        test GET requests with query parameters
+        """
+        url = "http://127.0.0.1:" + str(self.port)
+        with urllib.request.urlopen(
+            url + "/lineage?q=5.1&q=4.2&ranks=rank-2,rank-4"
+        ) as resp:
+            self.assertEqual(
+                json.loads(resp.read())["results"],
+                [["2.2", "4.4"], ["2.1", "4.2"]],
+            )
+        with urllib.request.urlopen(url + "/lca?q=5.1,4.5&q=5.1,4.2") as resp:
+            self.assertEqual(json.loads(resp.read())["results"], ["2.2", "1"])
+        with urllib.request.urlopen(url + "/search?q=Node5&exact=false") as resp:
+            self.assertCountEqual(
+                json.loads(resp.read())["results"][0], ["5.1", "5.2"]
+            )
+
+    def test_metrics(self):
+        """
+        test micro-batching of concurrent requests and metrics
+        """
+        before = self.server.metrics().get("rank", {"requests": 0, "batches": 0})
+
+        def query(node):
+            client = TaxClient(port=self.port)
+            ret = client.rank(node)
+            client.close()
+            return ret
+
+        nodes = ["5.1", "4.2", "3.1", "2.2"] * 8
+        with ThreadPoolExecutor(8) as pool:
+            ranks = list(pool.map(query, nodes))
+        self.assertEqual(ranks, [self.tax.rank(n) for n in nodes])
+
+        client = TaxClient(port=self.port)
+        metrics = client.metrics()["rank"]
+        client.close()
+        self.assertEqual(metrics["requests"] - before["requests"], len(nodes))
+        self.assertLessEqual(metrics["batches"] - before["batches"], len(nodes))
+        for p in ["mean", "p50", "p95", "p99", "max"]:
+            self.assertGreater(metrics["latency_ms"][p], 0)
+
+    def test_cli(self):
+        """
+        test command-line arguments
+        """
+        with self.assertRaises(SystemExit):
+            main(["serve", "--tax", "XXX"])
+        with self.assertRaises(SystemExit):
+            main([])